@@ -0,0 +1,148 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from config import (
+    CHAT_MAX_CONCURRENT, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT, CHAT_REQUEST_DEADLINE,
+    OPENAI_CHAT_CONCURRENCY, OPENAI_EMBEDDING_CONCURRENCY, VECTOR_STORE_CONCURRENCY, UPSTREAM_BACKGROUND_SHARE
+)
+from metrics import ADMISSION_SHED
+
+# Monotonic time by which the current request must have been served (None outside requests)
+request_deadline_var: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class OverloadedError(Exception):
+    """Raised when a request is shed instead of being queued past its deadline"""
+
+    def __init__(self, message: str, retry_after: float = 1.0, status_code: int = 503):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status_code = status_code
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without one"""
+    deadline = request_deadline_var.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+class ConcurrencyLimiter:
+    """Caps concurrent calls to one upstream; waiters give up at their request's deadline
+
+    Background work (slot(background=True)) holds at most background_share of the
+    slots, so it cannot crowd out chat turns, and waits its turn instead of being
+    shed, even when it was started from a request and inherited its deadline.
+    """
+
+    def __init__(self, name: str, limit: int, background_share: float = UPSTREAM_BACKGROUND_SHARE):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+        self._background = asyncio.Semaphore(max(1, int(limit * background_share)))
+
+    @asynccontextmanager
+    async def slot(self, background: bool = False):
+        if background:
+            await self._background.acquire()
+        try:
+            timeout = None if background else remaining_time()
+            if timeout is not None and timeout <= 0:
+                ADMISSION_SHED.labels(self.name).inc()
+                raise OverloadedError(f"Request deadline passed before calling {self.name}")
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=timeout)
+            except asyncio.TimeoutError:
+                ADMISSION_SHED.labels(self.name).inc()
+                raise OverloadedError(f"Timed out waiting for {self.name} capacity")
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+        finally:
+            if background:
+                self._background.release()
+
+class AdmissionController:
+    """Bounded admission for chat requests
+
+    Up to max_concurrent requests run at once and up to max_queue more wait, each
+    for at most queue_timeout; anything beyond is shed immediately with a
+    Retry-After estimated from recent service times. Admitted requests get a
+    deadline that bounds their waits for upstream capacity.
+    """
+
+    def __init__(self, name: str = "chat", max_concurrent: int = CHAT_MAX_CONCURRENT,
+                 max_queue: int = CHAT_MAX_QUEUE, queue_timeout: float = CHAT_QUEUE_TIMEOUT,
+                 deadline: float = CHAT_REQUEST_DEADLINE):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.deadline = deadline
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._service_time = 1.0  # exponentially weighted average, seconds
+
+    def _retry_after(self) -> float:
+        # Time for the queue ahead to drain at the current service rate
+        return min(30.0, self._service_time * (self.waiting + 1) / self.max_concurrent)
+
+    async def acquire(self) -> Callable[[], None]:
+        """Admit a request, returning the function that releases its slot"""
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                ADMISSION_SHED.labels(f"{self.name}_queue_full").inc()
+                raise OverloadedError("Server is busy, please retry shortly", self._retry_after())
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                ADMISSION_SHED.labels(f"{self.name}_queue_timeout").inc()
+                raise OverloadedError("Server is busy, please retry shortly", self._retry_after())
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        request_deadline_var.set(time.monotonic() + self.deadline)
+        start = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.in_flight -= 1
+            self._service_time = 0.9 * self._service_time + 0.1 * (time.monotonic() - start)
+            self._semaphore.release()
+
+        return release
+
+    @asynccontextmanager
+    async def admit(self):
+        release = await self.acquire()
+        try:
+            yield
+        finally:
+            release()
+
+# Global admission controller for chat turns and upstream limiters
+chat_admission = AdmissionController()
+openai_chat_limiter = ConcurrencyLimiter("openai_chat", OPENAI_CHAT_CONCURRENCY)
+openai_embedding_limiter = ConcurrencyLimiter("openai_embedding", OPENAI_EMBEDDING_CONCURRENCY)
+vector_store_limiter = ConcurrencyLimiter("vector_store", VECTOR_STORE_CONCURRENCY)
+upstream_limiters = (openai_chat_limiter, openai_embedding_limiter, vector_store_limiter)
@@ -0,0 +1,260 @@
+"""Local stand-ins for OpenAI, the vector store and MongoDB with injectable latency and failures"""
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from config import EMBEDDING_DIMENSION
+from vector_store import VectorMatch, VectorStore, metadata_matches
+
+@dataclass
+class UpstreamProfile:
+    """Latency and failure behaviour of a fake upstream"""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    failure_rate: float = 0.0
+
+    async def delay(self):
+        latency = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def should_fail(self) -> bool:
+        return random.random() < self.failure_rate
+
+class InjectedFailure(Exception):
+    """Raised by a fake upstream to simulate an outage"""
+
+FAKE_REPLY = (
+    "That sounds really tough, and I'm glad you told me. What's been weighing on you the most "
+    "about it lately? Sometimes just naming it out loud makes it a little lighter."
+)
+
+def fake_embedding(text: str, dimension: int = EMBEDDING_DIMENSION) -> np.ndarray:
+    """Deterministic unit vector for a text, so repeated texts embed identically"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def create_fake_openai_app(chat: UpstreamProfile, embeddings: UpstreamProfile, token_delay_ms: float = 5.0) -> FastAPI:
+    """OpenAI-compatible chat completion, embedding and model list endpoints"""
+    app = FastAPI()
+
+    def failure_response():
+        return JSONResponse(status_code=500, content={"error": {"message": "Injected failure", "type": "server_error"}})
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await chat.delay()
+        if chat.should_fail():
+            return failure_response()
+
+        prompt = body["messages"][-1]["content"]
+        if "Respond with ONLY one line per exchange" in prompt:
+            content = "\n".join(f"{n}: {random.randint(2, 9)}" for n in range(1, prompt.count("Exchange ") + 1))
+        else:
+            content = FAKE_REPLY
+        created = int(time.time())
+
+        if body.get("stream"):
+            async def stream():
+                for token in content.split(" "):
+                    chunk = {
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created,
+                        "model": body["model"],
+                        "choices": [{"index": 0, "delta": {"content": token + " "}, "finish_reason": None}]
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(token_delay_ms / 1000)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        return {
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }
+
+    @app.post("/v1/embeddings")
+    async def create_embeddings(request: Request):
+        body = await request.json()
+        await embeddings.delay()
+        if embeddings.should_fail():
+            return failure_response()
+
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+
+        return {"object": "list", "data": data, "model": body["model"], "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    @app.get("/v1/models")
+    async def list_models():
+        # Used by the app's startup warm-up
+        return {"object": "list", "data": []}
+
+    return app
+
+class BackgroundServer:
+    """Run an ASGI app with uvicorn on a free local port in a daemon thread"""
+
+    def __init__(self, app: FastAPI):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+class FakeVectorStore(VectorStore):
+    """In-memory brute-force vector store with injectable latency and failures"""
+
+    name = "fake"
+
+    def __init__(self, profile: UpstreamProfile):
+        self.profile = profile
+        self.vectors: Dict[Tuple[str, str], Dict] = {}
+
+    async def _call(self):
+        await self.profile.delay()
+        if self.profile.should_fail():
+            raise InjectedFailure("Injected vector store failure")
+
+    async def initialize(self):
+        await self._call()
+
+    async def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None,
+                    namespace: str = "") -> List[VectorMatch]:
+        await self._call()
+        query_vector = np.asarray(vector, dtype=np.float32)
+        matches = [
+            VectorMatch(vector_id, float(np.dot(item["values"], query_vector)), item["metadata"])
+            for (item_namespace, vector_id), item in self.vectors.items()
+            if item_namespace == namespace and metadata_matches(item["metadata"], filter)
+        ]
+        return sorted(matches, key=lambda match: match.score, reverse=True)[:top_k]
+
+    async def upsert(self, vectors: List[Dict], namespace: str = ""):
+        await self._call()
+        for item in vectors:
+            values = np.asarray(item["values"], dtype=np.float32)
+            self.vectors[(namespace, item["id"])] = {"values": values / (np.linalg.norm(values) or 1.0), "metadata": item.get("metadata") or {}}
+
+    async def delete(self, ids: List[str], namespace: str = ""):
+        await self._call()
+        for vector_id in ids:
+            self.vectors.pop((namespace, vector_id), None)
+
+    async def list_records(self, filter: Optional[Dict], limit: int, namespace: str = "",
+                           prefix: str = "") -> List[Dict]:
+        await self._call()
+        records = [
+            {"id": vector_id, "values": item["values"].tolist(), "metadata": item["metadata"]}
+            for (item_namespace, vector_id), item in self.vectors.items()
+            if item_namespace == namespace and vector_id.startswith(prefix) and metadata_matches(item["metadata"], filter)
+        ]
+        return records[:limit]
+
+class _SlowCursor:
+    """Motor-style cursor proxy that adds latency before results are read"""
+
+    def __init__(self, cursor, profile: UpstreamProfile):
+        self._cursor = cursor
+        self._profile = profile
+        self._delayed = False
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if name in ("sort", "limit", "skip"):
+            def chain(*args, **kwargs):
+                self._cursor = attribute(*args, **kwargs)
+                return self
+            return chain
+        return attribute
+
+    async def _delay(self):
+        if not self._delayed:
+            self._delayed = True
+            await self._profile.delay()
+            if self._profile.should_fail():
+                raise InjectedFailure("Injected MongoDB failure")
+
+    async def to_list(self, length=None):
+        await self._delay()
+        return await self._cursor.to_list(length)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self._delay()
+        return await self._cursor.__anext__()
+
+class _SlowCollection:
+    """Motor-style collection proxy that adds latency to every operation"""
+
+    def __init__(self, collection, profile: UpstreamProfile):
+        self._collection = collection
+        self._profile = profile
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name in ("find", "aggregate"):
+            return lambda *args, **kwargs: _SlowCursor(attribute(*args, **kwargs), self._profile)
+        if not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            await self._profile.delay()
+            if self._profile.should_fail():
+                raise InjectedFailure("Injected MongoDB failure")
+            return await attribute(*args, **kwargs)
+        return call
+
+class SlowDatabase:
+    """Motor-style database proxy whose collections add latency and failures"""
+
+    def __init__(self, database, profile: UpstreamProfile):
+        self._database = database
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return _SlowCollection(self._database[name], self._profile)
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+    async def command(self, *args, **kwargs):
+        # Only the startup ping is issued; mongomock-motor does not implement it
+        await self._profile.delay()
+        return {"ok": 1.0}
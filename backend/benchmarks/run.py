@@ -0,0 +1,235 @@
+"""Load and latency benchmark for the chat pipeline, driven against local stand-ins for every upstream
+
+Usage (from the backend folder):
+    python -m benchmarks.run --concurrency 32 --requests 500
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.15
+
+Exits with status 1 when a compared metric regresses beyond the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+ENDPOINTS = ("chat", "chat_stream", "history")
+
+SAMPLE_MESSAGES = [
+    "hi",
+    "thanks, that helps",
+    "I've been feeling really anxious about my job interview next week",
+    "My sister and I keep fighting and I don't know how to fix it",
+    "I can't sleep, my mind keeps racing about work deadlines",
+    "ok",
+    "I feel lonely since moving to a new city for work",
+    "Honestly I'm exhausted and overwhelmed by everything lately",
+]
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent simulated clients")
+    parser.add_argument("--requests", type=int, default=200, help="total requests across all clients")
+    parser.add_argument("--endpoints", default="chat", help=f"comma-separated mix of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--turns-per-session", type=int, default=20, help="turns before a client starts a new session")
+    parser.add_argument("--openai-latency-ms", type=float, default=300.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=60.0)
+    parser.add_argument("--vector-latency-ms", type=float, default=40.0)
+    parser.add_argument("--mongo-latency-ms", type=float, default=3.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="uniform jitter added to every upstream call")
+    parser.add_argument("--token-delay-ms", type=float, default=5.0, help="delay between streamed tokens")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability each upstream call fails")
+    parser.add_argument("--mongo-url", help="benchmark against a real MongoDB instead of mongomock-motor")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="write this run's results as a baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression vs the baseline")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args(argv)
+
+def summarize(latencies: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> Dict[str, Dict]:
+    """p50/p95/p99 latency (ms), throughput and error counts per endpoint"""
+    results = {}
+    for endpoint in sorted(set(latencies) | set(errors)):
+        samples = np.array(latencies.get(endpoint, []), dtype=np.float64) * 1000
+        results[endpoint] = {
+            "count": int(len(samples)),
+            "errors": errors.get(endpoint, 0),
+            "p50_ms": round(float(np.percentile(samples, 50)), 2) if len(samples) else None,
+            "p95_ms": round(float(np.percentile(samples, 95)), 2) if len(samples) else None,
+            "p99_ms": round(float(np.percentile(samples, 99)), 2) if len(samples) else None,
+            "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0
+        }
+    return results
+
+def print_report(results: Dict[str, Dict]):
+    print(f"{'endpoint':<18}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}")
+    for endpoint, stats in results.items():
+        print(
+            f"{endpoint:<18}{stats['count']:>7}{stats['errors']:>8}"
+            f"{stats['p50_ms'] or 0:>10.1f}{stats['p95_ms'] or 0:>10.1f}{stats['p99_ms'] or 0:>10.1f}"
+            f"{stats['throughput_rps']:>9.1f}"
+        )
+
+def compare_to_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Describe every latency or throughput regression beyond the tolerance"""
+    regressions = []
+    for endpoint, stats in results.items():
+        reference = baseline.get(endpoint)
+        if not reference:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if stats[metric] is not None and reference.get(metric) and stats[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{endpoint} {metric}: {stats[metric]:.1f} vs baseline {reference[metric]:.1f}")
+        if reference.get("throughput_rps") and stats["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{endpoint} throughput_rps: {stats['throughput_rps']:.1f} vs baseline {reference['throughput_rps']:.1f}"
+            )
+    return regressions
+
+def install_fake_mongo(args: argparse.Namespace, profile):
+    """Point the shared client registry at the benchmark database"""
+    from benchmarks.fake_upstreams import SlowDatabase
+    from clients import clients
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        raw_db = AsyncIOMotorClient(args.mongo_url)[f"mindbuddy_bench_{int(time.time())}"]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        raw_db = AsyncMongoMockClient()["mindbuddy_bench"]
+
+    clients.db = SlowDatabase(raw_db, profile)
+
+async def drive(base_url: str, args: argparse.Namespace) -> Dict[str, Dict]:
+    """Run the simulated clients against the app over HTTP and collect per-endpoint latencies"""
+    import httpx
+
+    endpoints = [endpoint.strip() for endpoint in args.endpoints.split(",") if endpoint.strip()]
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    remaining = [args.requests]
+
+    async def client_loop(client: httpx.AsyncClient):
+        session_id = None
+        turns = 0
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            endpoint = random.choice(endpoints)
+            if endpoint == "history" and not session_id:
+                endpoint = "chat"
+            message = random.choice(SAMPLE_MESSAGES)
+            start = time.perf_counter()
+            try:
+                if endpoint == "chat":
+                    response = await client.post("/api/therapy/chat", json={"message": message, "session_id": session_id})
+                    response.raise_for_status()
+                    session_id = response.json()["session_id"]
+                elif endpoint == "chat_stream":
+                    first_token = None
+                    async with client.stream(
+                        "POST", "/api/therapy/chat/stream", json={"message": message, "session_id": session_id}
+                    ) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data: "):
+                                continue
+                            event = json.loads(line[6:])
+                            if event["type"] == "session":
+                                session_id = event["session_id"]
+                            elif event["type"] == "token" and first_token is None:
+                                first_token = time.perf_counter()
+                            elif event["type"] == "error":
+                                raise RuntimeError(event["detail"])
+                    if first_token is not None:
+                        latencies["chat_stream_ttft"].append(first_token - start)
+                else:
+                    response = await client.get(f"/api/therapy/session/{session_id}/history", params={"limit": 50})
+                    response.raise_for_status()
+                latencies[endpoint].append(time.perf_counter() - start)
+            except Exception:
+                errors[endpoint] += 1
+
+            turns += 1
+            if turns >= args.turns_per_session:
+                session_id, turns = None, 0
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return summarize(latencies, errors, elapsed)
+
+async def run(args: argparse.Namespace) -> Dict[str, Dict]:
+    # The app reads its configuration at import time, so configure it before importing anything
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-benchmark",
+        "MONGO_URL": args.mongo_url or "mongodb://localhost:27017",
+        "DB_NAME": "mindbuddy_bench",
+        "EMBEDDING_CACHE_DIR": "",
+        "LOCAL_VECTOR_STORE_DIR": tempfile.mkdtemp(prefix="mindbuddy-bench-"),
+    })
+
+    from benchmarks.fake_upstreams import BackgroundServer, FakeVectorStore, UpstreamProfile, create_fake_openai_app
+
+    chat_profile = UpstreamProfile(args.openai_latency_ms, args.jitter_ms, args.failure_rate)
+    embedding_profile = UpstreamProfile(args.embedding_latency_ms, args.jitter_ms, args.failure_rate)
+    vector_profile = UpstreamProfile(args.vector_latency_ms, args.jitter_ms, args.failure_rate)
+    mongo_profile = UpstreamProfile(args.mongo_latency_ms, args.jitter_ms / 10, args.failure_rate)
+
+    fake_openai = BackgroundServer(create_fake_openai_app(chat_profile, embedding_profile, args.token_delay_ms))
+    fake_openai.start()
+    os.environ["OPENAI_BASE_URL"] = f"{fake_openai.url}/v1"
+
+    import memory_service
+    import server
+
+    memory_service.create_vector_store = lambda *args, **kwargs: FakeVectorStore(vector_profile)
+    install_fake_mongo(args, mongo_profile)
+
+    # Serve the app over real HTTP so streamed responses (and time to first token) are not buffered
+    app_server = BackgroundServer(server.app)
+    app_server.start()
+    try:
+        return await drive(app_server.url, args)
+    finally:
+        app_server.stop()
+        fake_openai.stop()
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    random.seed(args.seed)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("Latency regressions against baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect, status
+
+from admission import OverloadedError, chat_admission
+from config import (
+    MAX_CONVERSATION_HISTORY, WS_MAX_CONNECTIONS, WS_MAX_CONNECTIONS_PER_USER, WS_IDLE_TIMEOUT,
+    WS_MAX_PENDING_WRITES, WS_SHUTDOWN_TIMEOUT
+)
+from context_builder import ChatPrefix, build_chat_messages, chat_prefix
+from history_cache import session_history_cache
+from memory_ingestion import enqueue_conversation_memory
+from message_store import get_recent_messages, store_user_message, store_turn
+from metrics import ADMISSION_SHED, request_id_var, request_spans_var, span
+from models import TherapyMessage
+from resilience import turn_degradations_var
+from session_owners import SessionOwnershipError, create_session, resolve_session_user
+from summary_service import get_session_summary, note_messages_left_window
+from therapy_service import get_memories_within_budget, stream_completion
+
+logger = logging.getLogger(__name__)
+spans_logger = logging.getLogger("mindbuddy.spans")
+
+# Retrieval outcomes after which the connection's previous memories are reused
+MEMORY_DEGRADATIONS = {"memory_timeout", "memory_unavailable", "memory_error"}
+
+class ChatConnection:
+    """A WebSocket chat session whose state is kept across turns
+
+    The connection holds the recent window, the memories last retrieved and the
+    system prompt prefix built from them and the rolling summary, which is only
+    rebuilt when the memories or the summary change. The summary comes from the
+    process's summary cache, so a turn reads nothing back from MongoDB. Turns are
+    written in the background, in order, by the connection's writer task.
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: Optional[str], user_id: Optional[str]):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.user_id = user_id
+        self.window: deque = deque(maxlen=MAX_CONVERSATION_HISTORY)
+        self.memories: List[str] = []
+        self.prefix: Optional[ChatPrefix] = None
+        self.closed = asyncio.Event()
+        self._writes: asyncio.Queue = asyncio.Queue(maxsize=WS_MAX_PENDING_WRITES)
+        self._writer: Optional[asyncio.Task] = None
+
+    async def send(self, payload: Dict):
+        await self.websocket.send_text(json.dumps(payload))
+
+    async def open(self):
+        """Resolve an existing session's user and load its window"""
+        if self.session_id is not None:
+            self.user_id = await resolve_session_user(self.session_id, self.user_id)
+            messages = session_history_cache.get(self.session_id)
+            if messages is None:
+                with span("mongo_history_find"):
+                    messages = await get_recent_messages(self.session_id, MAX_CONVERSATION_HISTORY)
+            self.window.extend(messages)
+        self._writer = asyncio.create_task(self._write_turns())
+
+    async def close(self):
+        """Flush the turns still waiting to be written"""
+        if self._writer is not None:
+            await self._writes.put(None)
+            await self._writer
+
+    async def _write_turns(self):
+        # Spans of background writes are logged one by one rather than piling up on the connection
+        request_spans_var.set(None)
+        while True:
+            turn = await self._writes.get()
+            if turn is None:
+                return
+            user_message, ai_message = turn
+            try:
+                await store_user_message(user_message)
+                await store_turn(user_message, ai_message)
+                # Summaries are built from the stored transcript, so they are updated after the write
+                if len(self.window) >= MAX_CONVERSATION_HISTORY:
+                    note_messages_left_window(self.session_id, 1 if ai_message is None else 2)
+            except Exception as e:
+                logger.error(f"Error storing turn for session {self.session_id}: {e}")
+
+    def _remember(self, message: Dict):
+        self.window.append(message)
+        session_history_cache.append(self.session_id, message)
+
+    async def serve_turn(self, content: str):
+        """Answer one message, streaming tokens back and queueing the turn for storage"""
+        degradations = []
+        turn_degradations_var.set(degradations)
+
+        if self.session_id is None:
+            session = await create_session(self.user_id)
+            self.session_id, self.user_id = session.id, session.user_id
+            session_history_cache.set(self.session_id, [])
+            await self.send({"type": "session", "session_id": self.session_id})
+
+        user_message = TherapyMessage(session_id=self.session_id, role="user", content=content).dict()
+        self._remember(user_message)
+        try:
+            memories, summary = await asyncio.gather(
+                get_memories_within_budget(content, self.session_id, self.user_id),
+                get_session_summary(self.session_id)
+            )
+            # Memories from the previous turn beat none when this turn's retrieval failed
+            if MEMORY_DEGRADATIONS.intersection(degradations):
+                memories = self.memories
+            else:
+                self.memories = memories
+
+            with span("context_build"):
+                self.prefix = chat_prefix(summary, memories, self.prefix)
+                messages = build_chat_messages(list(self.window), memories, summary, prefix=self.prefix)
+
+            response_parts = []
+            async for token in stream_completion(messages):
+                response_parts.append(token)
+                await self.send({"type": "token", "content": token})
+        except BaseException:
+            # Like the HTTP endpoints, an unanswered message still joins the transcript in either layout
+            await self._writes.put((user_message, None))
+            raise
+
+        ai_response = "".join(response_parts)
+        ai_message = TherapyMessage(session_id=self.session_id, role="assistant", content=ai_response).dict()
+        self._remember(ai_message)
+        await self._writes.put((user_message, ai_message))
+
+        # Queue conversation for background evaluation and storage in long-term memory
+        await enqueue_conversation_memory(self.session_id, content, ai_response, user_id=self.user_id)
+
+        await self.send({
+            "type": "done", "session_id": self.session_id, "message_id": ai_message["id"], "degradations": degradations
+        })
+
+# Open connections, and how many each user has
+_connections: Set[ChatConnection] = set()
+_user_connections: Counter = Counter()
+
+def connection_count() -> int:
+    return len(_connections)
+
+def _parse_message(text: str) -> str:
+    """The message text of a {"message": ...} frame; raises ValueError if it is malformed"""
+    try:
+        content = json.loads(text).get("message")
+    except (ValueError, AttributeError):
+        raise ValueError("Expected a JSON object with a message")
+    if not isinstance(content, str) or not content.strip():
+        raise ValueError("Expected a JSON object with a message")
+    return content
+
+async def _serve_turn(connection: ChatConnection, content: str):
+    """Serve one turn under chat admission control, logging its spans as one line"""
+    spans: List[Dict] = []
+    request_spans_var.set(spans)
+    start = time.perf_counter()
+    try:
+        release = await chat_admission.acquire()
+        try:
+            await connection.serve_turn(content)
+        finally:
+            release()
+    except OverloadedError as e:
+        logger.warning(f"Socket chat turn shed: {e}")
+        await connection.send({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        logger.error(f"Error in socket chat turn: {e}")
+        await connection.send({"type": "error", "detail": f"Error processing therapy session: {str(e)}"})
+    finally:
+        spans_logger.info(json.dumps({
+            "event": "socket_turn",
+            "request_id": request_id_var.get(),
+            "session_id": connection.session_id,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+            "spans": spans
+        }))
+
+async def serve_chat_socket(websocket: WebSocket, session_id: Optional[str] = None, user_id: Optional[str] = None):
+    """Serve chat turns over one WebSocket until the client leaves or goes idle
+
+    Clients send {"message": ...} frames and receive the same session, token,
+    done and error events as the streaming HTTP endpoint.
+    """
+    await websocket.accept()
+    connection = ChatConnection(websocket, session_id, user_id)
+    if len(_connections) >= WS_MAX_CONNECTIONS:
+        ADMISSION_SHED.labels("ws_connections").inc()
+        await connection.send({"type": "error", "detail": "Too many open chat connections, please retry shortly"})
+        await websocket.close(status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    _connections.add(connection)
+    counted_user = None
+    try:
+        await connection.open()
+        if connection.session_id is not None:
+            await connection.send({"type": "session", "session_id": connection.session_id})
+
+        # Counted against the session's user, also when the client named only the session
+        counted_user = connection.user_id
+        if counted_user:
+            _user_connections[counted_user] += 1
+            if _user_connections[counted_user] > WS_MAX_CONNECTIONS_PER_USER:
+                ADMISSION_SHED.labels("ws_user_connections").inc()
+                await connection.send({"type": "error", "detail": "Too many open chat connections for this user"})
+                await websocket.close(status.WS_1013_TRY_AGAIN_LATER)
+                return
+
+        while True:
+            try:
+                text = await asyncio.wait_for(websocket.receive_text(), timeout=WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await websocket.close(status.WS_1001_GOING_AWAY, reason="Idle timeout")
+                return
+            try:
+                content = _parse_message(text)
+            except ValueError as e:
+                await connection.send({"type": "error", "detail": str(e)})
+                continue
+            await _serve_turn(connection, content)
+            # A socket opened without a user or session gets its user from the session its first turn creates
+            if counted_user is None and connection.user_id:
+                counted_user = connection.user_id
+                _user_connections[counted_user] += 1
+
+    except SessionOwnershipError as e:
+        logger.warning(f"Socket chat rejected: {e}")
+        await connection.send({"type": "error", "detail": str(e)})
+        await websocket.close(status.WS_1008_POLICY_VIOLATION)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in socket chat: {e}")
+    finally:
+        _connections.discard(connection)
+        if counted_user:
+            _user_connections[counted_user] -= 1
+            if _user_connections[counted_user] <= 0:
+                del _user_connections[counted_user]
+        await connection.close()
+        connection.closed.set()
+
+async def close_chat_sockets():
+    """Close every open socket and wait for their pending turns to be written"""
+    connections = list(_connections)
+    for connection in connections:
+        try:
+            await connection.websocket.close(status.WS_1001_GOING_AWAY, reason="Server shutting down")
+        except Exception:
+            pass
+    if connections:
+        done, pending = await asyncio.wait(
+            [asyncio.create_task(connection.closed.wait()) for connection in connections],
+            timeout=WS_SHUTDOWN_TIMEOUT
+        )
+        for task in pending:
+            task.cancel()
+        logger.info(f"Closed {len(connections)} chat sockets ({len(pending)} did not finish in time)")
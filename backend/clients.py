@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Optional
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from config import (
+    require_env,
+    OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_TIMEOUT, OPENAI_CONNECT_TIMEOUT,
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS
+)
+
+logger = logging.getLogger(__name__)
+
+class ClientRegistry:
+    """Shared, lazily built clients for every upstream the backend talks to
+
+    Importing the app builds nothing and reads no credentials; each client is
+    created on first use with a single pooled connection pool that all services
+    share. The app lifespan warms the pools on startup and closes them on shutdown.
+    The vector store is owned by memory_service and closed alongside.
+    """
+
+    def __init__(self):
+        self._openai: Optional[AsyncOpenAI] = None
+        self._mongo: Optional[AsyncIOMotorClient] = None
+        self._db: Optional[AsyncIOMotorDatabase] = None
+
+    @property
+    def openai(self) -> AsyncOpenAI:
+        """OpenAI client for chat completions and embeddings, over one keep-alive connection pool"""
+        if self._openai is None:
+            self._openai = AsyncOpenAI(
+                api_key=require_env("OPENAI_API_KEY"),
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+                    )
+                )
+            )
+        return self._openai
+
+    @property
+    def mongo(self) -> AsyncIOMotorClient:
+        if self._mongo is None:
+            self._mongo = AsyncIOMotorClient(
+                require_env("MONGO_URL"),
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS
+            )
+        return self._mongo
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        """The application database"""
+        if self._db is None:
+            self._db = self.mongo[require_env("DB_NAME")]
+        return self._db
+
+    @db.setter
+    def db(self, database):
+        # Lets tools and benchmarks point every service at another database
+        self._db = database
+
+    async def warm_up(self):
+        """Open upstream connections before the first request so it skips the TCP/TLS handshakes"""
+        async def ping_mongo():
+            await self.db.command("ping")
+
+        async def ping_openai():
+            await self.openai.models.list()
+
+        results = await asyncio.gather(ping_mongo(), ping_openai(), return_exceptions=True)
+        for name, result in zip(("MongoDB", "OpenAI"), results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not warm up {name} connection: {result}")
+
+    async def close(self):
+        """Close every client and drain its connection pool"""
+        if self._openai is not None:
+            await self._openai.close()
+            self._openai = None
+        if self._mongo is not None:
+            self._mongo.close()
+            self._mongo = None
+        self._db = None
+
+# Global client registry
+clients = ClientRegistry()
@@ -6,12 +6,16 @@ from dotenv import load_dotenv
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Environment Variables
-MONGO_URL = os.environ['MONGO_URL']
-DB_NAME = os.environ['DB_NAME']
-OPENAI_API_KEY = os.environ['OPENAI_API_KEY']
-PINECONE_API_KEY = os.environ['PINECONE_API_KEY']
-PINECONE_INDEX = os.environ['PINECONE_INDEX']
+def require_env(name: str) -> str:
+    """Read a required environment variable when a client is first built, not at import time"""
+    value = os.environ.get(name)
+    if not value:
+        raise RuntimeError(f"Missing required environment variable: {name}")
+    return value
+
+# Environment Variables (MONGO_URL, DB_NAME and OPENAI_API_KEY are required, see clients.py)
+PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY', '')
+PINECONE_INDEX = os.environ.get('PINECONE_INDEX', '')
 CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*')
 
 # API Configuration
@@ -25,5 +29,131 @@ EMBEDDING_DIMENSION = 1536
 MEMORY_THRESHOLD_CURRENT_SESSION = 0.6
 MEMORY_THRESHOLD_CROSS_SESSION = 0.5
 MEMORY_SCORE_THRESHOLD = 6
+MEMORY_LOCAL_SKIP_BELOW = float(os.environ.get('MEMORY_LOCAL_SKIP_BELOW', '0.2'))  # local scores below this are skipped without the LLM
+MEMORY_LOCAL_STORE_ABOVE = float(os.environ.get('MEMORY_LOCAL_STORE_ABOVE', '0.7'))  # local scores at or above this are stored without the LLM
+MEMORY_RECORD_DECISIONS = os.environ.get('MEMORY_RECORD_DECISIONS', 'true').lower() == 'true'
+MEMORY_DECISIONS_TTL_DAYS = int(os.environ.get('MEMORY_DECISIONS_TTL_DAYS', '30'))  # recorded decisions are deleted after this many days
 MAX_MEMORIES = 5
-MAX_CONVERSATION_HISTORY = 10
\ No newline at end of file
+MAX_CONVERSATION_HISTORY = 10
+
+# Memory Retrieval Configuration
+MEMORY_QUERY_TOP_K = 20  # one over-fetched query is partitioned into current-session and previous memories
+MEMORY_CURRENT_SESSION_LIMIT = 3
+MEMORY_CACHE_SIMILARITY = float(os.environ.get('MEMORY_CACHE_SIMILARITY', '0.92'))  # cosine similarity to reuse a session's last retrieval
+MEMORY_CACHE_MAX_SESSIONS = int(os.environ.get('MEMORY_CACHE_MAX_SESSIONS', '10000'))
+MEMORY_CACHE_TTL = 300  # seconds a cached retrieval can miss memories stored by other sessions
+
+# Topic Configuration
+TOPIC_VOCABULARY_PATH = os.environ.get('TOPIC_VOCABULARY_PATH', str(ROOT_DIR / 'topic_vocabulary.json'))  # {"topic": ["synonym", ...]}
+MEMORY_MAX_TOPICS = 5  # topics stored per memory
+MEMORY_TOPIC_RETRIEVAL = os.environ.get('MEMORY_TOPIC_RETRIEVAL', 'boost')  # "boost", "filter" or "off"
+MEMORY_TOPIC_BOOST = 0.05  # added to a memory's similarity per topic it shares with the query (at most 2)
+
+# Memory Compaction Configuration
+MEMORY_DEFAULT_IMPORTANCE = 0.5  # for memories stored before importance was recorded
+MEMORY_COMPACTION_INTERVAL = int(os.environ.get('MEMORY_COMPACTION_INTERVAL', '21600'))  # seconds between background runs, 0 disables
+MEMORY_COMPACTION_MIN_PENDING = 20  # new memories since the last compaction that make a user due
+MEMORY_COMPACTION_MAX_AGE = 7 * 86400  # seconds after which a user is compacted (and decayed) regardless
+MEMORY_COMPACTION_USERS_PER_RUN = 500
+MEMORY_COMPACTION_CONCURRENCY = 4
+MEMORY_COMPACTION_MAX_MEMORIES = 1000  # memories read per user per run
+MEMORY_COMPACTION_LEASE = 600  # seconds a process holds a user while compacting it
+MEMORY_MERGE_SIMILARITY = float(os.environ.get('MEMORY_MERGE_SIMILARITY', '0.9'))  # cosine similarity for near-duplicates
+MEMORY_MERGE_MAX_CLUSTER = 8
+MEMORY_DECAY_HALF_LIFE_DAYS = float(os.environ.get('MEMORY_DECAY_HALF_LIFE_DAYS', '90'))
+MEMORY_DECAY_MIN_SCORE = 0.1  # memories whose decayed importance drops below this are deleted
+MEMORY_DECAY_EXEMPT_IMPORTANCE = 0.8  # memories at least this important never decay
+
+# Context Configuration
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '3000'))  # prompt tokens for system prompt, summary, memories and history
+MEMORY_CONTEXT_TOKEN_BUDGET = 800
+MEMORY_MAX_TOKENS = 200
+HISTORY_MESSAGE_MAX_TOKENS = 600
+SUMMARY_MAX_TOKENS = 250
+SUMMARY_MIN_NEW_MESSAGES = 6
+SUMMARY_MAX_MESSAGES_PER_UPDATE = 40
+SUMMARY_CACHE_SIZE = 10000
+
+# Session History Configuration
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+
+# Session Owner Configuration
+SESSION_OWNER_CACHE_SIZE = 10000  # sessions whose owning user is kept in memory
+
+# Message Storage Configuration
+MESSAGE_STORAGE = os.environ.get('MESSAGE_STORAGE', 'documents')  # "documents" (one per message) or "buckets" (per-session buckets)
+MESSAGE_BUCKET_SIZE = 50  # messages per bucket document
+
+# WebSocket Chat Configuration
+WS_MAX_CONNECTIONS = int(os.environ.get('WS_MAX_CONNECTIONS', '1000'))  # open chat sockets per process
+WS_MAX_CONNECTIONS_PER_USER = int(os.environ.get('WS_MAX_CONNECTIONS_PER_USER', '3'))
+WS_IDLE_TIMEOUT = float(os.environ.get('WS_IDLE_TIMEOUT', '300'))  # seconds without a message before a socket is closed
+WS_MAX_PENDING_WRITES = 16  # turns a socket may have waiting to be written before its next turn waits
+WS_SHUTDOWN_TIMEOUT = 10.0  # seconds allowed to close sockets and flush their writes on shutdown
+
+# History Cache Configuration
+HISTORY_CACHE_MAX_SESSIONS = int(os.environ.get('HISTORY_CACHE_MAX_SESSIONS', '10000'))
+HISTORY_CACHE_TTL = 300  # seconds a cached window is trusted after it was loaded from MongoDB
+
+# Vector Store Configuration
+VECTOR_STORE_BACKEND = os.environ.get('VECTOR_STORE_BACKEND', 'pinecone')  # "pinecone" or "local"
+LOCAL_VECTOR_STORE_DIR = os.environ.get('LOCAL_VECTOR_STORE_DIR', str(ROOT_DIR / 'data' / 'vectors'))
+LOCAL_VECTOR_SEGMENT_SIZE = 10000
+VECTOR_STORE_UPSERT_BATCH_SIZE = 100
+
+# Pinecone Configuration
+PINECONE_MAX_WORKERS = int(os.environ.get('PINECONE_MAX_WORKERS', '8'))
+PINECONE_LIST_PAGE_SIZE = 100  # ids listed, then fetched, per request when reading records back (Pinecone's maximum)
+
+# Admission Control
+CHAT_MAX_CONCURRENT = int(os.environ.get('CHAT_MAX_CONCURRENT', '64'))  # chat turns served at once
+CHAT_MAX_QUEUE = int(os.environ.get('CHAT_MAX_QUEUE', '128'))  # chat turns waiting for a slot before new ones are shed
+CHAT_QUEUE_TIMEOUT = float(os.environ.get('CHAT_QUEUE_TIMEOUT', '5'))  # seconds a turn may wait for a slot
+CHAT_REQUEST_DEADLINE = float(os.environ.get('CHAT_REQUEST_DEADLINE', '30'))  # latency budget of an admitted turn, bounding upstream waits and the completion
+OPENAI_CHAT_CONCURRENCY = int(os.environ.get('OPENAI_CHAT_CONCURRENCY', '48'))
+OPENAI_EMBEDDING_CONCURRENCY = int(os.environ.get('OPENAI_EMBEDDING_CONCURRENCY', '32'))
+VECTOR_STORE_CONCURRENCY = int(os.environ.get('VECTOR_STORE_CONCURRENCY', '16'))
+UPSTREAM_BACKGROUND_SHARE = float(os.environ.get('UPSTREAM_BACKGROUND_SHARE', '0.25'))  # fraction of each upstream limit background work may hold
+
+# Degraded Mode
+MEMORY_RETRIEVAL_TIMEOUT = float(os.environ.get('MEMORY_RETRIEVAL_TIMEOUT', '1.5'))  # seconds a turn waits for memories before replying without them
+EMBEDDING_TIMEOUT = 10.0
+EMBEDDING_HEDGE_DELAY = float(os.environ.get('EMBEDDING_HEDGE_DELAY', '0'))  # seconds before a query embedding is requested again in parallel (0 disables)
+VECTOR_QUERY_TIMEOUT = 5.0
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))  # consecutive failures that open an upstream's circuit
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', '30'))  # seconds before an open circuit lets a trial call through
+
+# Upstream Connection Pools
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', '100'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '20'))
+OPENAI_KEEPALIVE_EXPIRY = 60.0  # seconds an idle connection is kept open for reuse
+OPENAI_TIMEOUT = 60.0
+OPENAI_CONNECT_TIMEOUT = 5.0
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '5'))  # connections opened ahead of the first request
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGO_WAIT_QUEUE_TIMEOUT_MS = 5000  # fail fast instead of queueing indefinitely for a pooled connection
+
+# Embedding Cache Configuration
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', '10000'))
+EMBEDDING_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR')  # unset keeps the cache in memory only
+EMBEDDING_CACHE_DISK_CAPACITY = int(os.environ.get('EMBEDDING_CACHE_DISK_CAPACITY', '100000'))
+
+# Memory Ingestion Configuration
+EMBEDDING_BATCH_SIZE = 64
+MEMORY_QUEUE_MAXSIZE = int(os.environ.get('MEMORY_QUEUE_MAXSIZE', '1000'))
+MEMORY_QUEUE_PUT_TIMEOUT = 0.5  # seconds a request waits for queue space before the exchange is dropped
+MEMORY_BATCH_SIZE = 32
+MEMORY_BATCH_INTERVAL = 2.0  # seconds to wait for a batch to fill
+MEMORY_INGESTION_WORKERS = 2
+MEMORY_FLUSH_TIMEOUT = 30.0  # seconds allowed to drain the queue on shutdown
+
+# Reindex Configuration
+REINDEX_BATCH_SIZE = 512  # exchanges per batch, embedded in one request
+REINDEX_CONCURRENCY = int(os.environ.get('REINDEX_CONCURRENCY', '8'))  # batches evaluated, embedded and upserted in parallel
+REINDEX_MAX_RETRIES = 3
+REINDEX_CATCHUP_SLACK = 600  # seconds before the job start re-scanned for exchanges added during the rebuild
+
+# Admin API (disabled unless a token is set)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
@@ -0,0 +1,132 @@
+import functools
+import logging
+from typing import Dict, List, Optional
+
+from config import (
+    CHAT_MODEL, CONTEXT_TOKEN_BUDGET, MEMORY_CONTEXT_TOKEN_BUDGET, MEMORY_MAX_TOKENS,
+    HISTORY_MESSAGE_MAX_TOKENS, SUMMARY_MAX_TOKENS
+)
+from prompts import get_therapy_system_prompt
+
+logger = logging.getLogger(__name__)
+
+# Approximate per-message overhead of the chat format (role and separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    """Load the tokenizer for CHAT_MODEL, or None when tiktoken is unavailable"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(CHAT_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable ({e}) - estimating token counts from text length")
+        return None
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Count tokens locally, falling back to a ~4 characters per token estimate"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text to at most max_tokens tokens, counting the "..." that marks the cut"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max(max_tokens * 4 - 3, 0)].rstrip() + "..."
+    return encoding.decode(encoding.encode(text)[:max(max_tokens - 1, 0)]).rstrip() + "..."
+
+def _memory_context(memories: List[str]) -> str:
+    if not memories:
+        return ""
+    memory_context = "\n\nRelevant context from previous conversations:\n" + "\n".join([f"- {memory}" for memory in memories])
+    memory_context += "\n\nPlease reference these previous conversations when relevant to provide continuity and deeper understanding."
+    return memory_context
+
+class ChatPrefix:
+    """The system prompt built from a rolling summary and memories
+
+    A conversation that keeps one across turns (see chat_prefix) only re-packs its
+    summary and memories when either of them changes.
+    """
+
+    def __init__(self, summary: str, memories: List[str]):
+        self.summary = summary
+        self.memories = memories
+        self._summary = truncate_to_tokens(summary, SUMMARY_MAX_TOKENS) if summary else ""
+        # Tokens of the system message without memories
+        self.base_tokens = count_tokens(get_therapy_system_prompt(summary=self._summary)) + MESSAGE_TOKEN_OVERHEAD
+        self._prompts: Dict[int, str] = {}
+
+    def matches(self, summary: str, memories: List[str]) -> bool:
+        return summary == self.summary and memories == self.memories
+
+    def system_prompt(self, memory_budget: int) -> str:
+        """The system prompt with as many memories, most relevant first, as fit memory_budget tokens"""
+        if memory_budget not in self._prompts:
+            packed_memories = []
+            remaining = memory_budget
+            for memory in self.memories:
+                memory = truncate_to_tokens(memory, MEMORY_MAX_TOKENS)
+                memory_tokens = count_tokens(memory) + 2
+                if memory_tokens > remaining:
+                    break
+                packed_memories.append(memory)
+                remaining -= memory_tokens
+            # Only the usual budget and the latest squeezed one are kept
+            while len(self._prompts) >= 2:
+                self._prompts.pop(next(iter(self._prompts)))
+            self._prompts[memory_budget] = get_therapy_system_prompt(_memory_context(packed_memories), summary=self._summary)
+        return self._prompts[memory_budget]
+
+def chat_prefix(summary: str, memories: List[str], previous: Optional[ChatPrefix] = None) -> ChatPrefix:
+    """A prefix for the summary and memories, reusing previous while they are unchanged"""
+    if previous is not None and previous.matches(summary, memories):
+        return previous
+    return ChatPrefix(summary, memories)
+
+def build_chat_messages(history: List[Dict], memories: List[str], summary: str = "",
+                        budget: int = CONTEXT_TOKEN_BUDGET, prefix: Optional[ChatPrefix] = None) -> List[Dict]:
+    """Pack the system prompt, rolling summary, memories and recent history into a token budget
+
+    History is given in chronological order and must end with the current user
+    message, which is always included. The rolling summary stands in for turns
+    older than the history window; memories get at most MEMORY_CONTEXT_TOKEN_BUDGET
+    tokens; the remaining budget is filled with history from newest to oldest.
+    A prefix built by chat_prefix for the same summary and memories is reused.
+    """
+    prefix = chat_prefix(summary, memories, prefix)
+    used = prefix.base_tokens
+
+    # The current user message is always sent
+    latest = history[-1]
+    latest_content = truncate_to_tokens(latest["content"], max(budget - used - MESSAGE_TOKEN_OVERHEAD, 1))
+    used += count_tokens(latest_content) + MESSAGE_TOKEN_OVERHEAD
+
+    # Memories, most relevant first, within their own sub-budget
+    memory_budget = min(MEMORY_CONTEXT_TOKEN_BUDGET, budget - used - count_tokens(_memory_context(["x"])))
+    system_prompt = prefix.system_prompt(memory_budget)
+    used = count_tokens(system_prompt) + MESSAGE_TOKEN_OVERHEAD + count_tokens(latest_content) + MESSAGE_TOKEN_OVERHEAD
+
+    # Earlier history, newest first, until the budget runs out
+    packed_history = [{"role": latest["role"], "content": latest_content}]
+    for msg in reversed(history[:-1]):
+        content = truncate_to_tokens(msg["content"], HISTORY_MESSAGE_MAX_TOKENS)
+        message_tokens = count_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+        if used + message_tokens > budget:
+            break
+        packed_history.append({"role": msg["role"], "content": content})
+        used += message_tokens
+    packed_history.reverse()
+
+    return [{"role": "system", "content": system_prompt}] + packed_history
@@ -0,0 +1,36 @@
+import logging
+from pymongo import ASCENDING
+
+from clients import clients
+from config import MEMORY_DECISIONS_TTL_DAYS
+
+logger = logging.getLogger(__name__)
+
+async def ensure_indexes():
+    """Create the indexes the chat and history queries rely on"""
+    try:
+        db = clients.db
+        # Recent-window reads and keyset-paginated history: find by session_id sorted by (timestamp, id)
+        await db.therapy_messages.create_index(
+            [("session_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)],
+            name="session_id_timestamp_id"
+        )
+        # Bucketed message storage: a session's buckets in order of their first message
+        await db.therapy_message_buckets.create_index(
+            [("session_id", ASCENDING), ("start", ASCENDING)],
+            name="session_id_start"
+        )
+        # Recent-window reads and turn appends: a session's buckets by their last message
+        await db.therapy_message_buckets.create_index(
+            [("session_id", ASCENDING), ("end", ASCENDING)],
+            name="session_id_end"
+        )
+        await db.therapy_sessions.create_index("id", unique=True, name="id_unique")
+        await db.session_summaries.create_index("session_id", unique=True, name="session_id_unique")
+        # Recorded memory decisions are only kept long enough to tune the evaluator thresholds
+        await db.memory_decisions.create_index(
+            "timestamp", expireAfterSeconds=MEMORY_DECISIONS_TTL_DAYS * 86400, name="timestamp_ttl"
+        )
+        logger.info("Ensured MongoDB indexes")
+    except Exception as e:
+        logger.error(f"Error creating MongoDB indexes: {e}")
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+class DiskEmbeddingStore:
+    """Fixed-capacity, memory-mapped embedding store that survives restarts
+
+    Vectors live in a float32 memmap of shape (capacity, dimension). Keys are
+    appended to a log of "key slot" lines; slots are reused ring-style once the
+    store is full, and the latest log line for a slot wins on reload. Before a
+    slot is reused, a "- slot" line drops the key it held, so a crash part way
+    through an overwrite never maps the old key to the new vector.
+    """
+
+    def __init__(self, directory: str, dimension: int, capacity: int):
+        self.directory = Path(directory)
+        self.dimension = dimension
+        self.capacity = capacity
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._vectors_path = self.directory / "vectors.f32"
+        self._keys_path = self.directory / "keys.log"
+        self._meta_path = self.directory / "meta.json"
+
+        meta = {"dimension": dimension, "capacity": capacity}
+        if not self._meta_path.exists() or json.loads(self._meta_path.read_text()) != meta:
+            # Layout changed (or first run) - start from an empty store
+            self._vectors_path.unlink(missing_ok=True)
+            self._keys_path.unlink(missing_ok=True)
+            self._meta_path.write_text(json.dumps(meta))
+
+        mode = "r+" if self._vectors_path.exists() else "w+"
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dimension))
+
+        self._slots: Dict[str, int] = {}
+        self._slot_keys: Dict[int, str] = {}
+        self._next_slot = 0
+        self._log_lines = 0
+        self._keys_file = None
+        self._load_keys()
+
+    def _load_keys(self):
+        """Rebuild the key index from the key log and compact the log"""
+        if self._keys_path.exists():
+            with open(self._keys_path) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 2 or not parts[1].isdigit():
+                        continue
+                    key, slot = parts[0], int(parts[1])
+                    if slot >= self.capacity:
+                        continue
+                    if key == "-":
+                        # A slot released for an overwrite that never completed is reused first
+                        self._release(slot)
+                        self._next_slot = slot
+                    else:
+                        self._assign(key, slot)
+                        self._next_slot = (slot + 1) % self.capacity
+        self._compact()
+
+    def _compact(self):
+        """Rewrite the log with only live entries, oldest slot first, so the last line marks the ring position"""
+        if self._keys_file is not None:
+            self._keys_file.close()
+        ordered = [
+            (slot, self._slot_keys[slot])
+            for slot in ((self._next_slot + offset) % self.capacity for offset in range(self.capacity))
+            if slot in self._slot_keys
+        ]
+        temporary_path = self._keys_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as f:
+            f.writelines(f"{key} {slot}\n" for slot, key in ordered)
+        os.replace(temporary_path, self._keys_path)
+        self._log_lines = len(ordered)
+        self._keys_file = open(self._keys_path, "a")
+
+    def _release(self, slot: int):
+        previous = self._slot_keys.pop(slot, None)
+        if previous is not None:
+            self._slots.pop(previous, None)
+
+    def _assign(self, key: str, slot: int):
+        self._release(slot)
+        self._slots[key] = slot
+        self._slot_keys[slot] = key
+
+    def _log(self, line: str):
+        self._keys_file.write(line)
+        self._keys_file.flush()
+        self._log_lines += 1
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        return np.array(self._vectors[slot])
+
+    def put(self, key: str, vector: np.ndarray):
+        if key in self._slots:
+            return
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.capacity
+
+        # Drop the slot's old key before its vector is overwritten, and log the new key only after
+        if slot in self._slot_keys:
+            self._release(slot)
+            self._log(f"- {slot}\n")
+        self._vectors[slot] = vector
+        self._assign(key, slot)
+        self._log(f"{key} {slot}\n")
+
+        # Keep the log within a few times the number of live entries
+        if self._log_lines >= 3 * self.capacity:
+            self._compact()
+
+    def close(self):
+        self._vectors.flush()
+        self._keys_file.close()
+
+class EmbeddingCache:
+    """Embedding cache keyed by (model, normalized text hash) with an in-memory LRU tier and an optional disk tier"""
+
+    def __init__(self, model: str, dimension: int, max_entries: int,
+                 disk_dir: Optional[str] = None, disk_capacity: int = 0):
+        self.model = model
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._disk = DiskEmbeddingStore(disk_dir, dimension, disk_capacity) if disk_dir and disk_capacity > 0 else None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        """Hash of the model name and the whitespace/Unicode-normalized text"""
+        normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+        return hashlib.sha256(f"{self.model}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Return the cached embedding for text, or None"""
+        key = self.key(text)
+
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return vector.tolist()
+
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+                self.hits += 1
+                self.disk_hits += 1
+                return vector.tolist()
+
+        self.misses += 1
+        return None
+
+    def put(self, text: str, embedding: List[float]):
+        """Cache an embedding in both tiers"""
+        key = self.key(text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._remember(key, vector)
+        if self._disk is not None:
+            self._disk.put(key, vector)
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """Hit and miss statistics"""
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_capacity": self.max_entries,
+            "disk_entries": len(self._disk) if self._disk is not None else 0,
+            "disk_capacity": self._disk.capacity if self._disk is not None else 0
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from config import MAX_CONVERSATION_HISTORY, HISTORY_CACHE_MAX_SESSIONS, HISTORY_CACHE_TTL
+
+class SessionHistoryCache:
+    """Size-bounded LRU/TTL cache of each active session's recent conversation window
+
+    The chat path appends every stored message, so turns rarely re-read history
+    from MongoDB. The cache is per process, so a window expires a fixed TTL after
+    it was loaded, however active the session: that bounds how long a session
+    served by several workers can see a stale window.
+    """
+
+    def __init__(self, window: int = MAX_CONVERSATION_HISTORY, max_sessions: int = HISTORY_CACHE_MAX_SESSIONS,
+                 ttl: float = HISTORY_CACHE_TTL):
+        self.window = window
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[List[Dict]]:
+        """Return the cached window in chronological order, or None if the session is not cached"""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["created"] > self.ttl:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return list(entry["messages"])
+
+    def set(self, session_id: str, messages: List[Dict]):
+        """Cache a session's window (chronological order)"""
+        self._sessions[session_id] = {
+            "messages": deque(messages[-self.window:], maxlen=self.window),
+            "created": time.monotonic()
+        }
+        self._sessions.move_to_end(session_id)
+        self._evict()
+
+    def append(self, session_id: str, message: Dict):
+        """Append a message to a cached session; uncached sessions are loaded on their next read"""
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            entry["messages"].append(message)
+            self._sessions.move_to_end(session_id)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - entry["created"] > self.ttl:
+                del self._sessions[session_id]
+            else:
+                break
+
+# Global history cache
+session_history_cache = SessionHistoryCache()
@@ -0,0 +1,260 @@
+"""Consolidate and expire long-term memories so each user's index footprint stays bounded
+
+Usage (from the backend folder):
+    python -m memory_compaction              # compact every user that is due, once
+    python -m memory_compaction --users 50
+
+The server also runs a compaction pass every MEMORY_COMPACTION_INTERVAL seconds.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from admission import openai_chat_limiter
+from clients import clients
+from config import (
+    CHAT_MODEL, MEMORY_DEFAULT_IMPORTANCE,
+    MEMORY_COMPACTION_INTERVAL, MEMORY_COMPACTION_MIN_PENDING, MEMORY_COMPACTION_MAX_AGE,
+    MEMORY_COMPACTION_USERS_PER_RUN, MEMORY_COMPACTION_CONCURRENCY, MEMORY_COMPACTION_MAX_MEMORIES,
+    MEMORY_COMPACTION_LEASE, MEMORY_MERGE_SIMILARITY, MEMORY_MERGE_MAX_CLUSTER,
+    MEMORY_DECAY_HALF_LIFE_DAYS, MEMORY_DECAY_MIN_SCORE, MEMORY_DECAY_EXEMPT_IMPORTANCE,
+    VECTOR_STORE_UPSERT_BATCH_SIZE
+)
+from metrics import span
+from prompts import get_memory_merge_prompt
+from resilience import openai_chat_breaker
+from retrieval_cache import session_retrieval_cache
+from topics import normalize_topics
+from vector_store import VectorStore, shutdown_vector_store_executor
+import memory_service
+
+logger = logging.getLogger(__name__)
+
+_compaction_task: Optional[asyncio.Task] = None
+
+def _memory_time(metadata: Dict) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(metadata["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def decayed_importance(metadata: Dict, now: datetime) -> float:
+    """Importance halved every MEMORY_DECAY_HALF_LIFE_DAYS since the memory was stored"""
+    importance = metadata.get("importance", MEMORY_DEFAULT_IMPORTANCE)
+    timestamp = _memory_time(metadata)
+    if timestamp is None:
+        return importance
+    age_days = max((now - timestamp).total_seconds(), 0) / 86400
+    return importance * 0.5 ** (age_days / MEMORY_DECAY_HALF_LIFE_DAYS)
+
+def is_expired(metadata: Dict, now: datetime) -> bool:
+    """Old, low-value memories expire; important ones are kept indefinitely"""
+    if metadata.get("importance", MEMORY_DEFAULT_IMPORTANCE) >= MEMORY_DECAY_EXEMPT_IMPORTANCE:
+        return False
+    return decayed_importance(metadata, now) < MEMORY_DECAY_MIN_SCORE
+
+def cluster_records(records: List[Dict], threshold: float = MEMORY_MERGE_SIMILARITY,
+                    max_cluster: int = MEMORY_MERGE_MAX_CLUSTER) -> List[List[Dict]]:
+    """Greedily group records whose embeddings are within the cosine threshold; singletons are left out"""
+    if len(records) < 2:
+        return []
+
+    vectors = np.asarray([record["values"] for record in records], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1)
+    similarities = vectors @ vectors.T
+
+    assigned = np.zeros(len(records), dtype=bool)
+    clusters = []
+    for i in range(len(records)):
+        if assigned[i]:
+            continue
+        members = np.flatnonzero((similarities[i] >= threshold) & ~assigned)
+        members = np.concatenate(([i], members[members != i]))[:max_cluster]
+        assigned[members] = True
+        if len(members) > 1:
+            clusters.append([records[j] for j in members])
+    return clusters
+
+def _merged_topics(cluster: List[Dict]) -> List[str]:
+    topics = []
+    for record in cluster:
+        for topic in normalize_topics(record["metadata"].get("topics")):
+            if topic not in topics:
+                topics.append(topic)
+    return topics
+
+async def _merge_cluster(cluster: List[Dict]) -> Dict:
+    """Summarize a cluster of memories into one memory dict for build_memory_vectors"""
+    # Oldest first, so the summary reads in the order things were shared
+    cluster = sorted(cluster, key=lambda record: record["metadata"].get("timestamp", ""))
+    async with openai_chat_breaker.guard(), openai_chat_limiter.slot(background=True):
+        with span("memory_merge_llm"):
+            completion = await clients.openai.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[{"role": "user", "content": get_memory_merge_prompt(
+                    [record["metadata"].get("conversation", "") for record in cluster]
+                )}],
+                max_tokens=200,
+                temperature=0.2
+            )
+
+    newest = cluster[-1]["metadata"]
+    return {
+        "id": f"{newest['session_id']}_merged_{uuid.uuid4()}",
+        "session_id": newest["session_id"],
+        "user_id": newest.get("user_id"),
+        "conversation": completion.choices[0].message.content.strip(),
+        "timestamp": _memory_time(newest) or datetime.utcnow(),
+        "topics": _merged_topics(cluster),
+        "importance": max(record["metadata"].get("importance", MEMORY_DEFAULT_IMPORTANCE) for record in cluster),
+        "merged_count": sum(record["metadata"].get("merged_count", 1) for record in cluster)
+    }
+
+async def compact_user_memories(user_id: str, store: VectorStore) -> Dict:
+    """Expire decayed memories and merge near-duplicates for one user (or anonymous session, see memory_owner)
+
+    Merged memories are written before the originals are deleted, so a failure
+    part way leaves duplicates for the next run rather than losing memories.
+    """
+    now = datetime.utcnow()
+    namespace, scope = memory_service.memory_scope(user_id)
+    records = await store.list_records(
+        scope, MEMORY_COMPACTION_MAX_MEMORIES, namespace=namespace, prefix=memory_service.memory_id_prefix(user_id)
+    )
+
+    expired = [record for record in records if is_expired(record["metadata"], now)]
+    expired_ids = {record["id"] for record in expired}
+    clusters = cluster_records([record for record in records if record["id"] not in expired_ids])
+
+    merged = await asyncio.gather(*[_merge_cluster(cluster) for cluster in clusters])
+    if merged:
+        embeddings = await memory_service.embed_texts([memory["conversation"] for memory in merged], background=True)
+        vectors = memory_service.build_memory_vectors(merged, embeddings)
+        for i in range(0, len(vectors), VECTOR_STORE_UPSERT_BATCH_SIZE):
+            await store.upsert(vectors[i:i + VECTOR_STORE_UPSERT_BATCH_SIZE], namespace=namespace)
+
+    removed = expired + [record for cluster in clusters for record in cluster]
+    for i in range(0, len(removed), VECTOR_STORE_UPSERT_BATCH_SIZE):
+        await store.delete([record["id"] for record in removed[i:i + VECTOR_STORE_UPSERT_BATCH_SIZE]], namespace=namespace)
+    for session_id in {record["metadata"].get("session_id") for record in removed}:
+        session_retrieval_cache.invalidate(session_id)
+
+    return {
+        "memories": len(records),
+        "expired": len(expired),
+        "merged": sum(len(cluster) for cluster in clusters),
+        "created": len(merged)
+    }
+
+async def _claim_user(user_id: str, now: datetime) -> Optional[Dict]:
+    """Lease a user so concurrent workers and processes never compact it twice at once"""
+    return await clients.db.memory_users.find_one_and_update(
+        {"_id": user_id, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+        {"$set": {"lease_until": now + timedelta(seconds=MEMORY_COMPACTION_LEASE)}}
+    )
+
+async def run_memory_compaction(max_users: int = MEMORY_COMPACTION_USERS_PER_RUN) -> Dict:
+    """Compact users with many new memories, or not compacted for MEMORY_COMPACTION_MAX_AGE"""
+    store = memory_service.vector_store
+    totals = {"users": 0, "memories": 0, "expired": 0, "merged": 0, "created": 0}
+    if store is None:
+        return totals
+
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=MEMORY_COMPACTION_MAX_AGE)
+    due = await clients.db.memory_users.find({"$or": [
+        {"pending": {"$gte": MEMORY_COMPACTION_MIN_PENDING}},
+        {"compacted_at": {"$lt": cutoff}},
+        {"compacted_at": None, "last_stored_at": {"$lt": cutoff}}
+    ]}, {"_id": 1}).limit(max_users).to_list(max_users)
+
+    semaphore = asyncio.Semaphore(MEMORY_COMPACTION_CONCURRENCY)
+
+    async def compact(user_id: str):
+        async with semaphore:
+            claimed = await _claim_user(user_id, now)
+            if not claimed:
+                return
+            try:
+                with span("memory_compaction_user"):
+                    result = await compact_user_memories(user_id, store)
+                # Memories stored while compacting stay pending for the next run
+                await clients.db.memory_users.update_one(
+                    {"_id": user_id},
+                    {"$set": {"compacted_at": datetime.utcnow(), "lease_until": None},
+                     "$inc": {"pending": -claimed.get("pending", 0)}}
+                )
+                totals["users"] += 1
+                for key, value in result.items():
+                    totals[key] += value
+            except Exception as e:
+                logger.error(f"Error compacting memories for user {user_id[:8]}...: {e}")
+                await clients.db.memory_users.update_one({"_id": user_id}, {"$set": {"lease_until": None}})
+
+    await asyncio.gather(*[compact(document["_id"]) for document in due])
+    logger.info(
+        f"Memory compaction: {totals['users']} users, {totals['memories']} memories read, "
+        f"{totals['expired']} expired, {totals['merged']} merged into {totals['created']}"
+    )
+    return totals
+
+async def _compaction_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_memory_compaction()
+        except Exception as e:
+            logger.error(f"Error running memory compaction: {e}")
+
+def start_memory_compaction(interval: float = MEMORY_COMPACTION_INTERVAL):
+    """Run compaction in the background every interval seconds (0 disables it)"""
+    global _compaction_task
+    if interval > 0 and _compaction_task is None:
+        _compaction_task = asyncio.create_task(_compaction_loop(interval))
+
+async def stop_memory_compaction():
+    """Stop the background compaction loop on shutdown"""
+    global _compaction_task
+    if _compaction_task is not None:
+        _compaction_task.cancel()
+        await asyncio.gather(_compaction_task, return_exceptions=True)
+        _compaction_task = None
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=MEMORY_COMPACTION_USERS_PER_RUN, help="maximum users to compact")
+    return parser.parse_args(argv)
+
+async def _main(args: argparse.Namespace) -> int:
+    try:
+        await memory_service.initialize_vector_store()
+        if memory_service.vector_store is None:
+            return 1
+        totals = await run_memory_compaction(args.users)
+        print(
+            f"Compacted {totals['users']} users: {totals['expired']} memories expired, "
+            f"{totals['merged']} merged into {totals['created']}"
+        )
+        return 0
+    finally:
+        if memory_service.vector_store is not None:
+            memory_service.vector_store.close()
+        shutdown_vector_store_executor()
+        memory_service.close_embedding_cache()
+        await clients.close()
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List
+
+from config import (
+    CHAT_MODEL, MEMORY_SCORE_THRESHOLD,
+    MEMORY_LOCAL_SKIP_BELOW, MEMORY_LOCAL_STORE_ABOVE, MEMORY_RECORD_DECISIONS
+)
+from admission import openai_chat_limiter
+from clients import clients
+from metrics import span, MEMORY_SKIPS
+from prompts import get_conversation_evaluation_prompt
+from resilience import openai_chat_breaker
+from topics import topic_extractor
+
+logger = logging.getLogger(__name__)
+
+SMALL_TALK_PATTERN = re.compile(
+    r"^(hi+|hey+|hello+|yo|sup|good (morning|afternoon|evening|night)|how are you( doing)?|what'?s up|"
+    r"ok(ay)?|k|sure|yes|yeah|yep|no|nope|nah|cool|nice|great|alright|fine|lol|haha+|hmm+|"
+    r"thanks?( you)?( so much)?|thank you|thx|ty|bye|goodbye|see you|got it|i see|makes sense)"
+    r"[\s!.?,]*$"
+)
+FIRST_PERSON_PATTERN = re.compile(r"\b(i|i'm|im|i've|i'd|i'll|me|my|mine|myself)\b")
+EMOTION_PATTERN = re.compile(
+    r"\b(feel|feels|feeling|felt|scared|afraid|lonely|alone|hurt|hurts|upset|cry|crying|cried|hate|"
+    r"love|miss|ashamed|guilty|nervous|worried|hopeless|helpless|happy|excited|proud|jealous|"
+    r"frustrated|tired|exhausted|empty|numb|depressed|anxious|stressed|struggling|struggle|"
+    r"confused|lost|worthless|insecure|embarrassed|grateful|disappointed)\b"
+)
+PERSONAL_INFO_PATTERN = re.compile(
+    r"\b(my name is|call me|i am \d+|i'm \d+|years old|i work (as|at|in)|i live in|i'm from|i am from|"
+    r"my (job|wife|husband|partner|girlfriend|boyfriend|mom|mum|dad|mother|father|sister|brother|son|daughter|"
+    r"kids?|boss|friend|hobby|hobbies|favou?rite))\b"
+)
+
+def extract_local_features(user_message: str, ai_response: str) -> Dict:
+    """Lexical features of an exchange used by the local scorer"""
+    text = user_message.strip().lower()
+    return {
+        "user_length": len(text),
+        "ai_length": len(ai_response.strip()),
+        "word_count": len(text.split()),
+        "small_talk": bool(SMALL_TALK_PATTERN.match(text)),
+        "keyword_hits": len(topic_extractor.extract(text, limit=0)),
+        "emotion_hits": len(set(EMOTION_PATTERN.findall(text))),
+        "first_person": bool(FIRST_PERSON_PATTERN.search(text)),
+        "personal_info": bool(PERSONAL_INFO_PATTERN.search(text))
+    }
+
+def local_conversation_score(features: Dict) -> float:
+    """Cheap 0-1 estimate of how worth storing an exchange is"""
+    # Trivial exchanges and pure greetings/acknowledgements are never worth storing
+    if features["user_length"] < 5 or features["ai_length"] < 10 or features["small_talk"]:
+        return 0.0
+
+    score = 0.1
+    score += 0.15 * min(features["keyword_hits"], 3)
+    score += 0.12 * min(features["emotion_hits"], 3)
+    score += 0.1 if features["first_person"] else 0.0
+    score += 0.25 if features["personal_info"] else 0.0
+
+    if features["word_count"] >= 25:
+        score += 0.15
+    elif features["word_count"] >= 12:
+        score += 0.08
+    elif features["word_count"] < 4:
+        score -= 0.15
+
+    return round(max(0.0, min(1.0, score)), 3)
+
+async def _llm_scores(exchanges: List[Dict]) -> List[int]:
+    """Score several exchanges in one LLM call; unparseable entries come back as None"""
+    evaluation_prompt = get_conversation_evaluation_prompt(exchanges)
+
+    async with openai_chat_breaker.guard(), openai_chat_limiter.slot(background=True):
+        with span("memory_scoring_llm"):
+            evaluation_response = await clients.openai.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[{"role": "user", "content": evaluation_prompt}],
+                max_tokens=8 * len(exchanges) + 2,
+                temperature=0.1
+            )
+
+    score_text = evaluation_response.choices[0].message.content.strip()
+
+    # Extract "<number>: <score>" lines; a lone score is accepted for a single exchange
+    scores = [None] * len(exchanges)
+    for number, score in re.findall(r'(\d+)\s*[:.)-]\s*(10|[0-9])\b', score_text):
+        index = int(number) - 1
+        if 0 <= index < len(exchanges):
+            scores[index] = int(score)
+    if len(exchanges) == 1 and scores[0] is None:
+        score_match = re.search(r'\b([0-9]|10)\b', score_text)
+        if score_match:
+            scores[0] = int(score_match.group(1))
+
+    return scores
+
+async def _record_decisions(decisions: List[Dict]):
+    """Persist evaluator decisions so the local tier thresholds can be tuned"""
+    if not MEMORY_RECORD_DECISIONS or not decisions:
+        return
+    try:
+        await clients.db.memory_decisions.insert_many([dict(decision) for decision in decisions])
+    except Exception as e:
+        logger.error(f"Error recording memory decisions: {e}")
+
+async def evaluate_conversations(exchanges: List[Dict], use_llm: bool = True, record: bool = True) -> List[Dict]:
+    """Decide which exchanges are worth storing as long-term memories
+
+    Each exchange is a dict with "user_message" and "ai_response" (and optionally
+    "session_id"). Clear cases are decided by the local scorer; only exchanges in
+    the ambiguous band are sent to the LLM, all of them in a single prompt. Without
+    the LLM, ambiguous exchanges are stored, as they are when the LLM call fails.
+    Returns one decision dict per exchange with a boolean "store".
+    """
+    decisions = []
+    ambiguous = []
+
+    for exchange in exchanges:
+        features = extract_local_features(exchange["user_message"], exchange["ai_response"])
+        local_score = local_conversation_score(features)
+        decision = {
+            "session_id": exchange.get("session_id"),
+            "features": features,
+            "local_score": local_score,
+            "llm_score": None,
+            "timestamp": datetime.utcnow()
+        }
+
+        if local_score < MEMORY_LOCAL_SKIP_BELOW:
+            decision.update(tier="local", store=False)
+        elif local_score >= MEMORY_LOCAL_STORE_ABOVE:
+            decision.update(tier="local", store=True)
+        else:
+            decision.update(tier="llm", store=True)
+            ambiguous.append((exchange, decision))
+
+        decisions.append(decision)
+
+    if ambiguous and use_llm:
+        try:
+            scores = await _llm_scores([exchange for exchange, _ in ambiguous])
+        except Exception as e:
+            logger.error(f"Error in LLM conversation evaluation: {e} - defaulting to STORE")
+            scores = [None] * len(ambiguous)
+
+        for (_, decision), score in zip(ambiguous, scores):
+            # Unparseable or failed evaluations default to STORE
+            decision["llm_score"] = score
+            decision["store"] = score is None or score >= MEMORY_SCORE_THRESHOLD
+
+    for decision in decisions:
+        if not decision["store"]:
+            MEMORY_SKIPS.labels(decision["tier"]).inc()
+    
+    stored = sum(decision["store"] for decision in decisions)
+    logger.info(f"Evaluated {len(decisions)} exchanges - {len(ambiguous) if use_llm else 0} sent to LLM, {stored} worth storing")
+
+    if record:
+        await _record_decisions(decisions)
+    return decisions
+
+def memory_importance(decision: Dict) -> float:
+    """0-1 value of a stored exchange, used to decay old memories"""
+    if decision.get("llm_score") is not None:
+        return round(decision["llm_score"] / 10, 2)
+    return decision["local_score"]
+
+async def is_conversation_worth_storing(user_message: str, ai_response: str) -> bool:
+    """Evaluate if a conversation contains meaningful therapeutic content"""
+    decisions = await evaluate_conversations([{"user_message": user_message, "ai_response": ai_response}])
+    return decisions[0]["store"]
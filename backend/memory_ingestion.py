@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from config import (
+    MEMORY_QUEUE_MAXSIZE, MEMORY_QUEUE_PUT_TIMEOUT, MEMORY_BATCH_SIZE,
+    MEMORY_BATCH_INTERVAL, MEMORY_INGESTION_WORKERS, MEMORY_FLUSH_TIMEOUT
+)
+from memory_evaluator import evaluate_conversations, memory_importance
+from memory_service import store_conversation_memories
+from metrics import MEMORY_DROPS
+
+logger = logging.getLogger(__name__)
+
+class MemoryIngestionQueue:
+    """Bounded in-process queue that scores, embeds and stores conversation memories off the request path"""
+
+    def __init__(self, maxsize: int = MEMORY_QUEUE_MAXSIZE, batch_size: int = MEMORY_BATCH_SIZE,
+                 batch_interval: float = MEMORY_BATCH_INTERVAL, workers: int = MEMORY_INGESTION_WORKERS):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self.dropped = 0
+
+    def depth(self) -> int:
+        """Number of exchanges waiting to be processed"""
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Start the ingestion workers"""
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def enqueue(self, session_id: str, user_message: str, ai_response: str, user_id: str = None) -> bool:
+        """Queue an exchange for evaluation and storage, waiting briefly for space when the queue is full"""
+        if not self._queue:
+            logger.warning("Memory ingestion queue is not running - dropping exchange")
+            return False
+
+        item = {
+            "session_id": session_id,
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "user_id": user_id
+        }
+        try:
+            await asyncio.wait_for(self._queue.put(item), timeout=MEMORY_QUEUE_PUT_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            MEMORY_DROPS.inc()
+            logger.warning(f"Memory ingestion queue full ({self.maxsize}) - dropping exchange for session {session_id[:8]}...")
+            return False
+
+    async def stop(self, timeout: float = MEMORY_FLUSH_TIMEOUT):
+        """Flush queued exchanges and stop the workers"""
+        if not self._queue:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Memory ingestion flush timed out with {self.depth()} exchanges still queued")
+
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+
+    async def _next_batch(self) -> List[Dict]:
+        """Wait for one exchange, then collect more until the batch is full or the interval elapses"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_interval
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _worker(self):
+        """Process queued exchanges in batches"""
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._process_batch(batch)
+            except Exception as e:
+                logger.error(f"Error processing memory batch: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _process_batch(self, batch: List[Dict]):
+        """Score a batch of exchanges and store the meaningful ones"""
+        decisions = await evaluate_conversations(batch)
+
+        memories = [
+            {
+                "session_id": item["session_id"],
+                "conversation": f"User: {item['user_message']}\nTherapist: {item['ai_response']}",
+                "user_id": item["user_id"],
+                "importance": memory_importance(decision)
+            }
+            for item, decision in zip(batch, decisions)
+            if decision["store"]
+        ]
+
+        await store_conversation_memories(memories)
+
+# Global ingestion queue
+memory_ingestion_queue = MemoryIngestionQueue()
+
+async def start_memory_ingestion():
+    """Start the memory ingestion pipeline on startup"""
+    await memory_ingestion_queue.start()
+
+async def stop_memory_ingestion():
+    """Flush the memory ingestion pipeline on shutdown"""
+    await memory_ingestion_queue.stop()
+
+async def enqueue_conversation_memory(session_id: str, user_message: str, ai_response: str, user_id: str = None) -> bool:
+    """Queue an exchange for background memory storage"""
+    return await memory_ingestion_queue.enqueue(session_id, user_message, ai_response, user_id=user_id)
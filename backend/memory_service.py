@@ -1,191 +1,350 @@
 import asyncio
+import logging
 import uuid
-import re
+from collections import Counter, defaultdict
 from datetime import datetime
-from typing import List
-from openai import AsyncOpenAI
-from pinecone import Pinecone
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
 
+from admission import openai_embedding_limiter, vector_store_limiter
+from clients import clients
 from config import (
-    OPENAI_API_KEY, PINECONE_API_KEY, PINECONE_INDEX, 
-    EMBEDDING_MODEL, CHAT_MODEL, EMBEDDING_DIMENSION,
+    VECTOR_STORE_BACKEND, EMBEDDING_MODEL, EMBEDDING_DIMENSION,
     MEMORY_THRESHOLD_CURRENT_SESSION, MEMORY_THRESHOLD_CROSS_SESSION,
-    MEMORY_SCORE_THRESHOLD
+    MEMORY_QUERY_TOP_K, MEMORY_CURRENT_SESSION_LIMIT, MEMORY_DEFAULT_IMPORTANCE,
+    MEMORY_TOPIC_RETRIEVAL, MEMORY_TOPIC_BOOST,
+    VECTOR_STORE_UPSERT_BATCH_SIZE, VECTOR_QUERY_TIMEOUT, EMBEDDING_TIMEOUT, EMBEDDING_HEDGE_DELAY,
+    EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_DISK_CAPACITY
 )
-from prompts import get_conversation_evaluation_prompt
+from embedding_cache import EmbeddingCache
+from metrics import span, MEMORY_HITS, MEMORY_CACHE_HITS, MEMORY_EMPTY_RETRIEVALS, MEMORY_STORES
+from resilience import (
+    CircuitOpenError, hedged, record_degradation, openai_embedding_breaker, vector_store_breaker
+)
+from retrieval_cache import session_retrieval_cache
+from topics import normalize_topics, topic_extractor
+from vector_store import VectorStore, create_vector_store, shutdown_vector_store_executor
+
+logger = logging.getLogger(__name__)
 
-# Initialize clients
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-pc = Pinecone(api_key=PINECONE_API_KEY)
+# Global vector store for long-term memory (None while memory is disabled)
+vector_store: Optional[VectorStore] = None
 
-# Global variable for Pinecone index
-pinecone_index = None
+# Cache of embeddings keyed by model and normalized text
+embedding_cache = EmbeddingCache(
+    EMBEDDING_MODEL, EMBEDDING_DIMENSION, EMBEDDING_CACHE_SIZE,
+    disk_dir=EMBEDDING_CACHE_DIR, disk_capacity=EMBEDDING_CACHE_DISK_CAPACITY
+)
 
-async def initialize_pinecone():
-    """Initialize Pinecone index on startup"""
-    global pinecone_index
+async def get_active_index_name(backend: str = VECTOR_STORE_BACKEND) -> Optional[str]:
+    """Name of the index a completed reindex made active, or None for the configured default"""
     try:
-        existing_indexes = [index_info["name"] for index_info in pc.list_indexes()]
-        
-        if PINECONE_INDEX not in existing_indexes:
-            pc.create_index(
-                name=PINECONE_INDEX,
-                dimension=EMBEDDING_DIMENSION,
-                metric="cosine",
-                spec={"serverless": {"cloud": "aws", "region": "us-east-1"}}
-            )
-            print(f"Created Pinecone index: {PINECONE_INDEX}")
-        
-        pinecone_index = pc.Index(PINECONE_INDEX)
-        print(f"Connected to Pinecone index: {PINECONE_INDEX}")
-        
+        document = await clients.db.vector_indexes.find_one({"_id": backend})
+        return document["name"] if document else None
+    except Exception as e:
+        logger.error(f"Error reading the active vector index: {e}")
+        return None
+
+async def initialize_vector_store():
+    """Initialize the active vector store on startup"""
+    global vector_store
+    store = create_vector_store(VECTOR_STORE_BACKEND, await get_active_index_name())
+    try:
+        await store.initialize()
+        vector_store = store
     except Exception as e:
-        print(f"Error initializing Pinecone: {e}")
+        logger.error(f"Error initializing {store.name} vector store - long-term memory is DISABLED: {e}")
+
+async def activate_vector_index(name: str, store: Optional[VectorStore] = None, job_id: Optional[str] = None):
+    """Make a rebuilt index the active one
+
+    The choice is persisted so every process uses the index on its next start;
+    passing the initialized store also swaps it into this process immediately.
+    """
+    global vector_store
+    await clients.db.vector_indexes.update_one(
+        {"_id": VECTOR_STORE_BACKEND},
+        {"$set": {"name": name, "job_id": job_id, "activated_at": datetime.utcnow()}},
+        upsert=True
+    )
+    if store is not None:
+        previous, vector_store = vector_store, store
+        session_retrieval_cache.clear()
+        if previous is not None and previous is not store:
+            previous.close()
+    logger.info(f"Activated {VECTOR_STORE_BACKEND} vector index {name}")
+
+async def create_embeddings(batch: List[str], background: bool = False):
+    """Embed one batch through the embedding circuit breaker and limiter, bypassing the cache"""
+    async with openai_embedding_breaker.guard(), openai_embedding_limiter.slot(background=background):
+        with span("embedding"):
+            return await asyncio.wait_for(
+                clients.openai.embeddings.create(model=EMBEDDING_MODEL, input=batch),
+                timeout=EMBEDDING_TIMEOUT
+            )
+
+async def embed_texts(texts: List[str], hedge: bool = False, background: bool = False) -> List[List[float]]:
+    """Embed texts, serving repeats from the embedding cache and batching the misses
+    
+    Latency-sensitive callers pass hedge=True to send a second request after
+    EMBEDDING_HEDGE_DELAY when the first is slow; background callers pass
+    background=True to wait for their share of the embedding limiter.
+    """
+    embeddings = [embedding_cache.get(text) for text in texts]
+    
+    # Deduplicate misses so repeated texts in one call are embedded once
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+    fetched = {}
+    for i in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+        batch = missing[i:i + EMBEDDING_BATCH_SIZE]
+        embedding_response = await hedged(
+            "openai_embedding", lambda: create_embeddings(batch, background), EMBEDDING_HEDGE_DELAY if hedge else None
+        )
+        for text, item in zip(batch, embedding_response.data):
+            fetched[text] = item.embedding
+            embedding_cache.put(text, item.embedding)
+    
+    return [embedding if embedding is not None else fetched[text] for text, embedding in zip(texts, embeddings)]
+
+def get_embedding_cache_stats() -> Dict:
+    """Embedding cache hit and miss statistics"""
+    return embedding_cache.stats()
+
+# Anonymous sessions share one namespace, each seeing only its own memories; the
+# dot keeps it apart from every valid user id
+ANONYMOUS_NAMESPACE = ".anonymous"
+
+def memory_owner(user_id: Optional[str], session_id: str) -> str:
+    """Who memories belong to: their user, or their session when it is anonymous"""
+    return user_id or f"{ANONYMOUS_NAMESPACE}/{session_id}"
+
+def memory_scope(owner: str) -> Tuple[str, Optional[Dict]]:
+    """The namespace holding an owner's memories, and the filter selecting them within it"""
+    if owner.startswith(f"{ANONYMOUS_NAMESPACE}/"):
+        return ANONYMOUS_NAMESPACE, {"session_id": owner[len(ANONYMOUS_NAMESPACE) + 1:]}
+    return owner, None
+
+def memory_id_prefix(owner: str) -> str:
+    """The prefix shared by an owner's memory ids within their namespace ("" for a user's own namespace)
+
+    Memory ids start with their session id, so an anonymous session's memories
+    can be listed without reading the rest of the shared anonymous namespace.
+    """
+    if owner.startswith(f"{ANONYMOUS_NAMESPACE}/"):
+        return f"{owner[len(ANONYMOUS_NAMESPACE) + 1:]}_"
+    return ""
+
+def vector_owner(vector: Dict) -> str:
+    metadata = vector["metadata"]
+    return memory_owner(metadata.get("user_id"), metadata["session_id"])
+
+def vectors_by_namespace(vectors: List[Dict]) -> Dict[str, List[Dict]]:
+    """Memory vectors grouped by the namespace of the user they belong to"""
+    groups = defaultdict(list)
+    for vector in vectors:
+        groups[memory_scope(vector_owner(vector))[0]].append(vector)
+    return groups
 
-async def get_relevant_memories(query: str, session_id: str, limit: int = 5) -> List[str]:
-    """Retrieve relevant conversation memories from Pinecone across all sessions"""
-    if not pinecone_index:
+async def get_relevant_memories(query: str, session_id: str, limit: int = 5, user_id: Optional[str] = None) -> List[str]:
+    """Retrieve relevant conversation memories from all of the user's sessions
+    
+    Only the user's namespace is searched; an anonymous session only sees its own memories.
+    """
+    if vector_store is None:
         return []
     
+    with span("memory_retrieval"):
+        namespace, scope = memory_scope(memory_owner(user_id, session_id))
+        return await _get_relevant_memories(query, session_id, limit, namespace, scope)
+
+async def _get_relevant_memories(query: str, session_id: str, limit: int, namespace: str,
+                                 scope: Optional[Dict]) -> List[str]:
     try:
         # Create embedding for the query
-        embedding_response = await openai_client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=query
-        )
-        query_embedding = embedding_response.data[0].embedding
-        
-        # Search current session memories
-        current_session_response = pinecone_index.query(
-            vector=query_embedding,
-            top_k=3,
-            include_metadata=True,
-            filter={"session_id": session_id}
-        )
-        
-        # Search all sessions memories
-        all_sessions_response = pinecone_index.query(
-            vector=query_embedding,
-            top_k=limit,
-            include_metadata=True
-        )
-        
-        memories = []
-        
-        # Process current session memories first
-        for match in current_session_response.matches:
-            if match.score > MEMORY_THRESHOLD_CURRENT_SESSION:
-                conversation = match.metadata.get("conversation", "")
-                if conversation and conversation not in memories:
-                    memories.append(f"[Current session] {conversation}")
+        query_embedding = (await embed_texts([query], hedge=True))[0]
+        query_topics = topic_extractor.extract(query) if MEMORY_TOPIC_RETRIEVAL != "off" else []
         
-        # Process memories from other sessions
-        for match in all_sessions_response.matches:
-            if match.score > MEMORY_THRESHOLD_CROSS_SESSION:
-                conversation = match.metadata.get("conversation", "")
-                match_session_id = match.metadata.get("session_id", "")
-                
-                if (conversation and 
-                    conversation not in [m.replace("[Current session] ", "") for m in memories] and 
-                    match_session_id != session_id):
-                    memories.append(f"[Previous conversation] {conversation}")
+        # Consecutive turns on the same topic reuse the session's last retrieval
+        cached = session_retrieval_cache.get(session_id, query_embedding, limit)
+        if cached is not None:
+            MEMORY_CACHE_HITS.inc()
+            memories = cached
+        else:
+            # One over-fetched query, partitioned locally into current-session and previous memories
+            matches = await _query_memories(query_embedding, max(MEMORY_QUERY_TOP_K, limit), query_topics, namespace, scope)
+            memories = _partition_matches(matches, session_id, limit, query_topics)
+            session_retrieval_cache.set(session_id, query_embedding, limit, memories)
         
-        return memories[:limit]
+        if memories:
+            MEMORY_HITS.inc(len(memories))
+        else:
+            MEMORY_EMPTY_RETRIEVALS.inc()
+        return memories
         
+    except CircuitOpenError as e:
+        record_degradation("memory_unavailable")
+        logger.warning(f"Skipping memory retrieval: {e}")
+        return []
     except Exception as e:
-        print(f"Error retrieving memories: {e}")
+        record_degradation("memory_error")
+        logger.error(f"Error retrieving memories: {e!r}")
         return []
 
-async def is_conversation_worth_storing(user_message: str, ai_response: str) -> bool:
-    """Use LLM to evaluate if a conversation contains meaningful therapeutic content"""
+async def _query_memories(query_embedding: List[float], top_k: int, query_topics: List[str], namespace: str,
+                         scope: Optional[Dict] = None) -> List:
+    """Query a namespace (within the scope filter); in "filter" mode only memories sharing a topic with the query are searched"""
+    filters = [scope]
+    if query_topics and MEMORY_TOPIC_RETRIEVAL == "filter":
+        # Fall back to the whole scope when no memory shares a topic
+        filters.insert(0, {**(scope or {}), "topics": {"$in": query_topics}})
+    
+    for topic_filter in filters:
+        async with vector_store_breaker.guard(), vector_store_limiter.slot():
+            with span("vector_query"):
+                matches = await asyncio.wait_for(
+                    vector_store.query(query_embedding, top_k=top_k, filter=topic_filter, namespace=namespace),
+                    timeout=VECTOR_QUERY_TIMEOUT
+                )
+        if matches:
+            break
+    return matches
+
+def _match_score(match, query_topics: List[str]) -> float:
+    """Similarity, boosted for each topic (up to two) the memory shares with the query in "boost" mode"""
+    if not query_topics or MEMORY_TOPIC_RETRIEVAL != "boost":
+        return match.score
+    shared = set(query_topics) & set(normalize_topics(match.metadata.get("topics")))
+    return match.score + MEMORY_TOPIC_BOOST * min(len(shared), 2)
+
+def _partition_matches(matches: List, session_id: str, limit: int, query_topics: List[str] = ()) -> List[str]:
+    """Current-session memories first, then previous conversations, each conversation once"""
+    current_session = []
+    previous = []
+    seen = set()
+    
+    # Ordered by (boosted) score, so each list stays most-relevant first
+    scored = sorted(((_match_score(match, query_topics), match) for match in matches), key=lambda item: -item[0])
+    for score, match in scored:
+        conversation = match.metadata.get("conversation", "")
+        if not conversation or conversation in seen:
+            continue
+        
+        if match.metadata.get("session_id") == session_id:
+            if score > MEMORY_THRESHOLD_CURRENT_SESSION and len(current_session) < MEMORY_CURRENT_SESSION_LIMIT:
+                current_session.append(f"[Current session] {conversation}")
+                seen.add(conversation)
+        elif score > MEMORY_THRESHOLD_CROSS_SESSION:
+            previous.append(f"[Previous conversation] {conversation}")
+            seen.add(conversation)
+    
+    return (current_session + previous)[:limit]
+
+async def store_conversation_memory(session_id: str, conversation: str, user_id: str = None):
+    """Store conversation in the vector store for long-term memory"""
+    await store_conversation_memories([
+        {"session_id": session_id, "conversation": conversation, "user_id": user_id}
+    ])
+
+async def store_conversation_memories(memories: List[Dict]):
+    """Store a batch of conversations in the vector store with batched embeddings and chunked upserts
+    
+    Each memory is a dict with "session_id", "conversation" and an optional "user_id",
+    "id" and "timestamp" (see build_memory_vectors).
+    """
+    if vector_store is None or not memories:
+        return
+    
+    with span("memory_store"):
+        await _store_conversation_memories(memories)
+
+async def _store_conversation_memories(memories: List[Dict]):
     try:
-        # Skip obviously trivial cases to save API calls
-        if len(user_message.strip()) < 5 or len(ai_response.strip()) < 10:
-            return False
+        # Create embeddings in batches using the list input form
+        embeddings = await embed_texts([memory["conversation"] for memory in memories], background=True)
+        vectors = build_memory_vectors(memories, embeddings)
         
-        evaluation_prompt = get_conversation_evaluation_prompt(user_message, ai_response)
+        # Store in each user's namespace in chunks
+        for namespace, namespace_vectors in vectors_by_namespace(vectors).items():
+            for i in range(0, len(namespace_vectors), VECTOR_STORE_UPSERT_BATCH_SIZE):
+                async with vector_store_breaker.guard(), vector_store_limiter.slot(background=True):
+                    with span("vector_upsert"):
+                        await vector_store.upsert(namespace_vectors[i:i + VECTOR_STORE_UPSERT_BATCH_SIZE], namespace=namespace)
         
-        # Get LLM evaluation
-        evaluation_response = await openai_client.chat.completions.create(
-            model=CHAT_MODEL,
-            messages=[{"role": "user", "content": evaluation_prompt}],
-            max_tokens=10,
-            temperature=0.1
-        )
+        for session_id in {memory["session_id"] for memory in memories}:
+            session_retrieval_cache.invalidate(session_id)
+        await record_memory_users(vectors)
         
-        score_text = evaluation_response.choices[0].message.content.strip()
+        MEMORY_STORES.inc(len(vectors))
+        logger.info(f"Stored {len(vectors)} memories ({sum(len(m['conversation']) for m in memories)} characters)")
         
-        # Extract numeric score
-        score_match = re.search(r'\b([0-9]|10)\b', score_text)
-        if score_match:
-            score = int(score_match.group(1))
-            
-            if score >= MEMORY_SCORE_THRESHOLD:
-                print(f"Storing conversation - LLM Score: {score}/10")
-            else:
-                print(f"Skipping conversation - LLM Score: {score}/10")
-            
-            return score >= MEMORY_SCORE_THRESHOLD
-        else:
-            print(f"Could not parse LLM score: {score_text} - defaulting to STORE")
-            return True
-            
     except Exception as e:
-        print(f"Error in LLM conversation evaluation: {e} - defaulting to STORE")
-        return True
+        logger.error(f"Error storing memories: {e}")
 
-async def store_conversation_memory(session_id: str, conversation: str, user_id: str = None):
-    """Store conversation in Pinecone for long-term memory"""
-    if not pinecone_index:
+async def record_memory_users(vectors: List[Dict]):
+    """Count memories stored per user since their last compaction"""
+    await record_memory_counts(Counter(vector_owner(vector) for vector in vectors))
+
+async def record_memory_counts(counts: Dict[str, int]):
+    """Add newly stored memories to each owner's pending count (see memory_owner)"""
+    if not counts:
         return
-    
+    now = datetime.utcnow()
     try:
-        # Create embedding
-        embedding_response = await openai_client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=conversation
-        )
-        embedding = embedding_response.data[0].embedding
-        
-        # Generate user_id if not provided
-        if not user_id:
-            user_id = f"user_{session_id.split('_')[0] if '_' in session_id else session_id[:8]}"
+        await clients.db.memory_users.bulk_write([
+            UpdateOne(
+                {"_id": user_id},
+                {"$inc": {"pending": count}, "$set": {"last_stored_at": now}, "$setOnInsert": {"compacted_at": None}},
+                upsert=True
+            )
+            for user_id, count in counts.items()
+        ], ordered=False)
+    except Exception as e:
+        logger.error(f"Error recording memory users: {e}")
+
+def build_memory_vectors(memories: List[Dict], embeddings: List[List[float]]) -> List[Dict]:
+    """Build vector store records for memories
+    
+    A memory may carry a deterministic "id" (so rebuilding an index is idempotent),
+    the "timestamp" of the original exchange and a precomputed "topics" list; otherwise
+    they are generated. "importance" (0-1) drives decay during compaction.
+    """
+    vectors = []
+    for memory, embedding in zip(memories, embeddings):
+        session_id = memory["session_id"]
+        conversation = memory["conversation"]
         
-        # Store in Pinecone
-        vector_id = f"{session_id}_{uuid.uuid4()}"
+        vector_id = memory.get("id") or f"{session_id}_{uuid.uuid4()}"
+        timestamp = memory.get("timestamp") or datetime.utcnow()
         metadata = {
             "session_id": session_id,
-            "user_id": user_id,
             "conversation": conversation,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": timestamp.isoformat(),
             "conversation_length": len(conversation),
-            "topics": extract_conversation_topics(conversation)
+            "topics": memory.get("topics") or extract_conversation_topics(conversation),
+            "importance": memory.get("importance", MEMORY_DEFAULT_IMPORTANCE)
         }
-        
-        pinecone_index.upsert([{
+        # Memories of anonymous sessions carry no user
+        if memory.get("user_id"):
+            metadata["user_id"] = memory["user_id"]
+        if "merged_count" in memory:
+            metadata["merged_count"] = memory["merged_count"]
+        vectors.append({
             "id": vector_id,
             "values": embedding,
             "metadata": metadata
-        }])
-        
-        print(f"Stored memory for session {session_id[:8]}... with {len(conversation)} characters")
-        
-    except Exception as e:
-        print(f"Error storing memory: {e}")
+        })
+    return vectors
+
+def close_vector_store():
+    """Close the vector store and release its worker threads"""
+    if vector_store is not None:
+        vector_store.close()
+    shutdown_vector_store_executor()
 
-def extract_conversation_topics(conversation: str) -> str:
+def close_embedding_cache():
+    """Flush the on-disk embedding cache"""
+    embedding_cache.close()
+
+def extract_conversation_topics(conversation: str) -> List[str]:
     """Extract key topics from conversation for better memory retrieval"""
-    try:
-        therapy_keywords = [
-            'anxiety', 'depression', 'stress', 'work', 'job', 'relationship', 'family',
-            'sleep', 'panic', 'worry', 'fear', 'angry', 'sad', 'overwhelmed', 'therapy',
-            'counseling', 'medication', 'interview', 'presentation', 'public speaking',
-            'social', 'friends', 'marriage', 'divorce', 'grief', 'loss', 'trauma'
-        ]
-        
-        conversation_lower = conversation.lower()
-        found_topics = [keyword for keyword in therapy_keywords if keyword in conversation_lower]
-        
-        return ', '.join(found_topics[:5])
-    except:
-        return ""
\ No newline at end of file
+    return topic_extractor.extract(conversation)
\ No newline at end of file
@@ -0,0 +1,224 @@
+import heapq
+import itertools
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from clients import clients
+from config import MESSAGE_STORAGE, MESSAGE_BUCKET_SIZE
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Two layouts are supported. "documents" keeps one therapy_messages document per
+# message. "buckets" keeps each session's messages in therapy_message_buckets
+# documents of up to MESSAGE_BUCKET_SIZE messages, written a whole turn at a
+# time; reads in this layout also see sessions still stored as documents.
+
+# Order of the (session_id, timestamp, id) index on therapy_messages
+MESSAGE_SORT = [("session_id", 1), ("timestamp", 1), ("id", 1)]
+MESSAGE_FIELDS = {"_id": 0, "id": 1, "session_id": 1, "role": 1, "content": 1, "timestamp": 1}
+
+def is_bucketed() -> bool:
+    return MESSAGE_STORAGE == "buckets"
+
+def _session_key(message: Dict) -> Tuple:
+    return (message["timestamp"], message["id"])
+
+def _global_key(message: Dict) -> Tuple:
+    return (message["session_id"], message["timestamp"], message["id"])
+
+def pack_message(message: Dict) -> Dict:
+    """A message as stored inside its session's bucket"""
+    return {key: value for key, value in message.items() if key not in ("_id", "session_id")}
+
+def _unpack(bucket: Dict) -> List[Dict]:
+    session_id = bucket["session_id"]
+    return [{"id": message["id"], "session_id": session_id, **message} for message in bucket["messages"]]
+
+def build_buckets(session_id: str, messages: List[Dict]) -> List[Dict]:
+    """Bucket documents for a session's messages in chronological order, with deterministic ids"""
+    buckets = []
+    for i in range(0, len(messages), MESSAGE_BUCKET_SIZE):
+        chunk = messages[i:i + MESSAGE_BUCKET_SIZE]
+        buckets.append({
+            "_id": f"{session_id}:{chunk[0]['id']}",
+            "session_id": session_id,
+            "count": len(chunk),
+            "start": chunk[0]["timestamp"],
+            "end": chunk[-1]["timestamp"],
+            "messages": [pack_message(message) for message in chunk]
+        })
+    return buckets
+
+async def store_user_message(message: Dict):
+    """Persist the user side of a turn before the reply is generated (documents layout)
+
+    The bucketed layout defers it to store_turn, which writes both sides at once.
+    """
+    if is_bucketed():
+        return
+    with span("mongo_insert_user"):
+        await clients.db.therapy_messages.insert_one(message)
+
+async def store_turn(user_message: Dict, ai_message: Optional[Dict]):
+    """Persist the reply to a turn, together with the user message in the bucketed layout
+
+    A turn whose reply failed is stored without one (ai_message None), so its user
+    message joins the transcript in both layouts.
+    """
+    if not is_bucketed():
+        if ai_message is not None:
+            with span("mongo_insert_assistant"):
+                await clients.db.therapy_messages.insert_one(ai_message)
+        return
+
+    # One update appends the turn's messages to the session's open bucket, or starts a new one. Concurrent
+    # first turns or a migrated partial bucket can leave several open; the latest written to takes the turn
+    messages = [pack_message(user_message)] + ([pack_message(ai_message)] if ai_message is not None else [])
+    with span("mongo_push_turn"):
+        await clients.db.therapy_message_buckets.find_one_and_update(
+            {"session_id": user_message["session_id"], "count": {"$lte": MESSAGE_BUCKET_SIZE - len(messages)}},
+            {
+                "$push": {"messages": {"$each": messages}},
+                "$inc": {"count": len(messages)},
+                "$min": {"start": user_message["timestamp"]},
+                "$max": {"end": (ai_message or user_message)["timestamp"]}
+            },
+            projection={"_id": 1}, sort=[("end", -1)], upsert=True
+        )
+
+async def get_recent_messages(session_id: str, limit: int) -> List[Dict]:
+    """A session's last messages in chronological order"""
+    if not is_bucketed():
+        messages = await clients.db.therapy_messages.find(
+            {"session_id": session_id}
+        ).sort("timestamp", -1).limit(limit).to_list(limit)
+        messages.reverse()
+        return messages
+
+    # The last bucket written to, plus the ones before it when it has too few messages
+    bucket_count = limit // MESSAGE_BUCKET_SIZE + 2
+    buckets = await clients.db.therapy_message_buckets.find(
+        {"session_id": session_id}, {"_id": 0, "session_id": 1, "messages": {"$slice": -limit}}
+    ).sort("end", -1).limit(bucket_count).to_list(bucket_count)
+    messages = sorted((message for bucket in buckets for message in _unpack(bucket)), key=_session_key)
+    if len(messages) >= limit:
+        return messages[-limit:]
+
+    # Short sessions and sessions not migrated yet may have messages in the documents layout
+    documents = await clients.db.therapy_messages.find(
+        {"session_id": session_id}, MESSAGE_FIELDS
+    ).sort([("timestamp", -1), ("id", -1)]).limit(limit).to_list(limit)
+    merged = {message["id"]: message for message in documents + messages}
+    return sorted(merged.values(), key=_session_key)[-limit:]
+
+async def _merge(streams: List[AsyncIterator[Dict]], key: Callable[[Dict], Tuple]) -> AsyncIterator[Dict]:
+    """Merge sorted message streams; a message present in several streams is yielded once"""
+    heads = []
+    for index, stream in enumerate(streams):
+        message = await anext(stream, None)
+        if message is not None:
+            heads.append((key(message), index, message))
+    heapq.heapify(heads)
+
+    last = None
+    while heads:
+        message_key, index, message = heapq.heappop(heads)
+        following = await anext(streams[index], None)
+        if following is not None:
+            heapq.heappush(heads, (key(following), index, following))
+        if message_key != last:
+            last = message_key
+            yield message
+
+async def _iter_documents(query: Dict, sort: List, limit: Optional[int] = None,
+                          batch_size: Optional[int] = None) -> AsyncIterator[Dict]:
+    cursor = clients.db.therapy_messages.find(query, MESSAGE_FIELDS).sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+    async for message in cursor:
+        yield message
+
+async def _iter_buckets(cursor, key: Callable[[Dict], Tuple], start_key: Callable[[Dict], Tuple],
+                        after: Optional[Tuple], since: Optional[datetime] = None) -> AsyncIterator[Dict]:
+    """Messages of buckets read in start order, re-sorted across buckets whose time ranges overlap"""
+    pending = []
+    sequence = itertools.count()
+    async for bucket in cursor:
+        # Nothing in this or later buckets can sort before a message older than this bucket's start
+        bucket_start = start_key(bucket)
+        while pending and pending[0][0] < bucket_start:
+            yield heapq.heappop(pending)[2]
+        for message in _unpack(bucket):
+            if (after is None or key(message) > after) and (since is None or message["timestamp"] >= since):
+                heapq.heappush(pending, (key(message), next(sequence), message))
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+async def iter_session_messages(session_id: str, after: Optional[Tuple[datetime, str]] = None,
+                                limit: Optional[int] = None) -> AsyncIterator[Dict]:
+    """A session's messages after a (timestamp, id) position, in chronological order"""
+    query = {"session_id": session_id}
+    if after:
+        query["$or"] = [
+            {"timestamp": {"$gt": after[0]}},
+            {"timestamp": after[0], "id": {"$gt": after[1]}}
+        ]
+    documents = _iter_documents(query, [("timestamp", 1), ("id", 1)], limit)
+    if is_bucketed():
+        bucket_query = {"session_id": session_id}
+        if after:
+            bucket_query["end"] = {"$gte": after[0]}
+        cursor = clients.db.therapy_message_buckets.find(bucket_query).sort("start", 1)
+        if limit:
+            cursor = cursor.batch_size(limit // MESSAGE_BUCKET_SIZE + 2)
+        buckets = _iter_buckets(cursor, _session_key, lambda bucket: (bucket["start"],), after)
+        messages = _merge([buckets, documents], _session_key)
+    else:
+        messages = documents
+
+    count = 0
+    async for message in messages:
+        yield message
+        count += 1
+        if limit and count >= limit:
+            break
+
+def _after(cursor: Optional[Dict]) -> Dict:
+    """Keyset condition for messages after a (session_id, timestamp, id) checkpoint"""
+    if not cursor:
+        return {}
+    return {"$or": [
+        {"session_id": {"$gt": cursor["session_id"]}},
+        {"session_id": cursor["session_id"], "timestamp": {"$gt": cursor["timestamp"]}},
+        {"session_id": cursor["session_id"], "timestamp": cursor["timestamp"], "id": {"$gt": cursor["id"]}}
+    ]}
+
+async def iter_all_messages(after: Optional[Dict] = None, since: Optional[datetime] = None,
+                            batch_size: int = 1000) -> AsyncIterator[Dict]:
+    """Every message ordered by (session_id, timestamp, id), after a checkpoint and optionally since a time"""
+    query = _after(after)
+    if since:
+        query["timestamp"] = {"$gte": since}
+    documents = _iter_documents(query, MESSAGE_SORT, batch_size=batch_size)
+    if not is_bucketed():
+        async for message in documents:
+            yield message
+        return
+
+    bucket_query = {}
+    if after:
+        bucket_query["session_id"] = {"$gte": after["session_id"]}
+    if since:
+        bucket_query["end"] = {"$gte": since}
+    cursor = clients.db.therapy_message_buckets.find(bucket_query).sort([("session_id", 1), ("start", 1)])
+    cursor = cursor.batch_size(max(batch_size // MESSAGE_BUCKET_SIZE, 1))
+    after_key = (after["session_id"], after["timestamp"], after["id"]) if after else None
+    buckets = _iter_buckets(
+        cursor, _global_key, lambda bucket: (bucket["session_id"], bucket["start"]), after_key, since
+    )
+    async for message in _merge([buckets, documents], _global_key):
+        yield message
@@ -0,0 +1,160 @@
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+logger = logging.getLogger("mindbuddy.spans")
+
+# Request-scoped context: the request ID and the timing spans recorded while serving it
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+request_spans_var: ContextVar[Optional[List[Dict]]] = ContextVar("request_spans", default=None)
+
+STAGE_LATENCY = Histogram(
+    "mindbuddy_stage_duration_seconds",
+    "Latency of each stage of the chat and memory pipelines",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+STAGE_ERRORS = Counter("mindbuddy_stage_errors_total", "Stages that raised an exception", ["stage"])
+ADMISSION_SHED = Counter("mindbuddy_admission_shed_total", "Requests shed by admission control or upstream limiters", ["reason"])
+DEGRADATIONS = Counter("mindbuddy_degradations_total", "Chat turns served without optional enrichment", ["kind"])
+CIRCUIT_OPENS = Counter("mindbuddy_circuit_opens_total", "Times an upstream circuit breaker opened", ["upstream"])
+HEDGED_CALLS = Counter("mindbuddy_hedged_calls_total", "Calls that started a second, hedged attempt", ["upstream"])
+MEMORY_HITS = Counter("mindbuddy_memory_hits_total", "Memories returned to chat turns")
+MEMORY_CACHE_HITS = Counter("mindbuddy_memory_cache_hits_total", "Memory retrievals served from the semantic cache")
+MEMORY_EMPTY_RETRIEVALS = Counter("mindbuddy_memory_empty_retrievals_total", "Memory retrievals that returned nothing")
+MEMORY_STORES = Counter("mindbuddy_memory_stores_total", "Exchanges stored as long-term memories")
+MEMORY_SKIPS = Counter("mindbuddy_memory_skips_total", "Exchanges not stored as memories", ["tier"])
+MEMORY_DROPS = Counter("mindbuddy_memory_drops_total", "Exchanges dropped because the ingestion queue was full")
+
+def observe_stage(stage: str, duration: float, status: str = "ok"):
+    """Record a measured stage duration in the stage histogram and the request's structured log"""
+    STAGE_LATENCY.labels(stage).observe(duration)
+    if status != "ok":
+        STAGE_ERRORS.labels(stage).inc()
+
+    record = {"stage": stage, "duration_ms": round(duration * 1000, 2), "status": status}
+    spans = request_spans_var.get()
+    if spans is not None:
+        spans.append(record)
+    else:
+        # Background work outside a request is logged span by span
+        logger.info(json.dumps({"event": "span", "request_id": request_id_var.get(), **record}))
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage"""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start, status)
+
+class RequestContextMiddleware:
+    """ASGI middleware assigning each request an ID and logging its spans as one structured line
+
+    The ID is taken from an incoming X-Request-ID header when present and echoed
+    back on the response. The log line is written once the response body has
+    been fully sent, so streamed responses include their streaming spans.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode() or uuid.uuid4().hex
+        spans: List[Dict] = []
+        id_token = request_id_var.set(request_id)
+        spans_token = request_spans_var.set(spans)
+        start = time.perf_counter()
+        status_code = None
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if spans or scope["path"] != "/metrics":
+                logger.info(json.dumps({
+                    "event": "request",
+                    "request_id": request_id,
+                    "method": scope.get("method", "WS"),
+                    "path": scope["path"],
+                    "status": status_code,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                    "spans": spans
+                }))
+            request_spans_var.reset(spans_token)
+            request_id_var.reset(id_token)
+
+class RuntimeStateCollector:
+    """Expose cache and queue state as metrics, read at scrape time"""
+
+    def collect(self):
+        from admission import chat_admission, upstream_limiters
+        from chat_socket import connection_count
+        from history_cache import session_history_cache
+        from memory_ingestion import memory_ingestion_queue
+        from memory_service import embedding_cache
+        from resilience import circuit_breakers
+        from retrieval_cache import session_retrieval_cache
+
+        stats = embedding_cache.stats()
+        hits = CounterMetricFamily("mindbuddy_embedding_cache_hits", "Embedding cache hits", labels=["tier"])
+        hits.add_metric(["memory"], stats["hits"] - stats["disk_hits"])
+        hits.add_metric(["disk"], stats["disk_hits"])
+        yield hits
+        yield CounterMetricFamily("mindbuddy_embedding_cache_misses", "Embedding cache misses", value=stats["misses"])
+
+        entries = GaugeMetricFamily("mindbuddy_embedding_cache_entries", "Embeddings held in the cache", labels=["tier"])
+        entries.add_metric(["memory"], stats["memory_entries"])
+        entries.add_metric(["disk"], stats["disk_entries"])
+        yield entries
+
+        yield GaugeMetricFamily("mindbuddy_history_cache_sessions", "Sessions held in the hot history cache", value=len(session_history_cache))
+        yield GaugeMetricFamily("mindbuddy_memory_cache_sessions", "Sessions with a cached memory retrieval", value=len(session_retrieval_cache))
+        in_flight = GaugeMetricFamily("mindbuddy_in_flight", "Calls holding an admission or upstream slot", labels=["limiter"])
+        waiting = GaugeMetricFamily("mindbuddy_waiting", "Calls waiting for an admission or upstream slot", labels=["limiter"])
+        for limiter in (chat_admission,) + upstream_limiters:
+            in_flight.add_metric([limiter.name], limiter.in_flight)
+            waiting.add_metric([limiter.name], limiter.waiting)
+        yield in_flight
+        yield waiting
+
+        circuit_state = GaugeMetricFamily("mindbuddy_circuit_state", "Upstream circuit state (0 closed, 1 half open, 2 open)", labels=["upstream"])
+        for breaker in circuit_breakers:
+            circuit_state.add_metric([breaker.name], {"closed": 0, "half_open": 1, "open": 2}[breaker.state])
+        yield circuit_state
+
+        yield GaugeMetricFamily("mindbuddy_chat_sockets", "Open WebSocket chat connections", value=connection_count())
+        yield GaugeMetricFamily("mindbuddy_memory_queue_depth", "Exchanges waiting in the memory ingestion queue", value=memory_ingestion_queue.depth())
+
+_runtime_collector_registered = False
+
+def register_runtime_collector():
+    """Register the cache and queue collector with the default registry (once)"""
+    global _runtime_collector_registered
+    if not _runtime_collector_registered:
+        REGISTRY.register(RuntimeStateCollector())
+        _runtime_collector_registered = True
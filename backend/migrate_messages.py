@@ -0,0 +1,85 @@
+"""Move conversation transcripts from one document per message into per-session buckets
+
+Usage (from the backend folder):
+    python -m migrate_messages                 # migrate every session still stored as documents
+    python -m migrate_messages --sessions 1000
+
+Switch the servers to MESSAGE_STORAGE=buckets first, so no new message
+documents are written while the migration runs. Each session's messages are
+written as buckets with deterministic ids before its documents are deleted, so
+an interrupted run is finished by running it again; until then the bucketed
+read path also reads the remaining documents.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from typing import Dict, List
+
+from pymongo import UpdateOne
+
+from clients import clients
+from database import ensure_indexes
+from message_store import MESSAGE_FIELDS, MESSAGE_SORT, build_buckets
+
+logger = logging.getLogger(__name__)
+
+async def migrate_session(session_id: str, messages: List[Dict]) -> int:
+    """Write a session's messages as buckets, then delete their documents; returns the buckets written"""
+    buckets = build_buckets(session_id, messages)
+    # Buckets that already exist (from an interrupted run) may have had turns appended since, so are left as they are
+    await clients.db.therapy_message_buckets.bulk_write([
+        UpdateOne({"_id": bucket["_id"]}, {"$setOnInsert": bucket}, upsert=True) for bucket in buckets
+    ], ordered=False)
+    await clients.db.therapy_messages.delete_many(
+        {"session_id": session_id, "id": {"$in": [message["id"] for message in messages]}}
+    )
+    return len(buckets)
+
+async def migrate_messages(max_sessions: int = 0) -> Dict:
+    """Migrate sessions in index order, one session at a time"""
+    totals = {"sessions": 0, "messages": 0, "buckets": 0}
+    session_id = None
+    messages: List[Dict] = []
+
+    async def flush():
+        totals["buckets"] += await migrate_session(session_id, messages)
+        totals["sessions"] += 1
+        totals["messages"] += len(messages)
+        if totals["sessions"] % 100 == 0:
+            logger.info(f"Migrated {totals['sessions']} sessions, {totals['messages']} messages")
+
+    async for message in clients.db.therapy_messages.find({}, MESSAGE_FIELDS).sort(MESSAGE_SORT).batch_size(1000):
+        if message["session_id"] != session_id:
+            if messages:
+                await flush()
+                if max_sessions and totals["sessions"] >= max_sessions:
+                    return totals
+            session_id, messages = message["session_id"], []
+        messages.append(message)
+
+    if messages:
+        await flush()
+    return totals
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=0, help="maximum sessions to migrate (default: all)")
+    return parser.parse_args(argv)
+
+async def _main(args: argparse.Namespace) -> int:
+    try:
+        await ensure_indexes()
+        totals = await migrate_messages(args.sessions)
+        print(f"Migrated {totals['sessions']} sessions: {totals['messages']} messages into {totals['buckets']} buckets")
+        return 0
+    finally:
+        await clients.close()
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Move long-term memories from the shared default namespace into per-user namespaces
+
+Usage (from the backend folder):
+    python -m migrate_namespaces                # migrate every memory in the default namespace
+    python -m migrate_namespaces --batch 500
+
+Memories stored before per-user namespaces live in the default namespace, which
+chat turns no longer search. Each memory moves to the namespace of its session's
+owner, and memories of anonymous sessions (including every session recorded
+before sessions had owners) move to the shared anonymous namespace. It is
+written there before it is deleted from the default namespace, so an interrupted
+run is finished by running it again.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from typing import Dict, List
+
+import memory_service
+from clients import clients
+from config import VECTOR_STORE_UPSERT_BATCH_SIZE
+from session_owners import get_session_owners
+from vector_store import VectorStore, shutdown_vector_store_executor
+
+logger = logging.getLogger(__name__)
+
+# Pinecone applies deletes asynchronously, so moved memories can be listed again for a while
+STALE_LIST_RETRIES = 5
+STALE_LIST_DELAY = 2.0
+
+async def migrate_records(records: List[Dict], store: VectorStore) -> int:
+    """Copy records into their users' namespaces, then delete them from the default namespace"""
+    session_ids = list({record["metadata"].get("session_id") for record in records} - {None})
+    owners = await get_session_owners(session_ids)
+    for record in records:
+        metadata = record["metadata"]
+        session_id = metadata.get("session_id")
+        # Memories stored before sessions had owners carry a made-up user; only a session's owner counts
+        user_id = owners.get(session_id)
+        metadata.pop("user_id", None)
+        if user_id:
+            metadata["user_id"] = user_id
+
+    for namespace, vectors in memory_service.vectors_by_namespace(records).items():
+        for i in range(0, len(vectors), VECTOR_STORE_UPSERT_BATCH_SIZE):
+            await store.upsert(vectors[i:i + VECTOR_STORE_UPSERT_BATCH_SIZE], namespace=namespace)
+    for i in range(0, len(records), VECTOR_STORE_UPSERT_BATCH_SIZE):
+        await store.delete([record["id"] for record in records[i:i + VECTOR_STORE_UPSERT_BATCH_SIZE]])
+    return len(records)
+
+async def migrate_namespaces(store: VectorStore, batch_size: int = 1000) -> Dict:
+    """Migrate the default namespace one listed batch at a time until it is empty"""
+    totals = {"memories": 0, "users": 0}
+    users = set()
+    moved = set()
+    stale_rounds = 0
+
+    while True:
+        records = await store.list_records(None, batch_size)
+        fresh = [record for record in records if record["id"] not in moved]
+        if not records:
+            break
+        if not fresh:
+            stale_rounds += 1
+            if stale_rounds > STALE_LIST_RETRIES:
+                logger.warning("Deleted memories are still being listed - run the migration again later")
+                break
+            await asyncio.sleep(STALE_LIST_DELAY)
+            continue
+
+        stale_rounds = 0
+        totals["memories"] += await migrate_records(fresh, store)
+        moved.update(record["id"] for record in fresh)
+        users.update(memory_service.vector_owner(record) for record in fresh)
+        totals["users"] = len(users)
+        logger.info(f"Migrated {totals['memories']} memories of {totals['users']} users")
+
+    return totals
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=1000, help="memories listed per batch")
+    return parser.parse_args(argv)
+
+async def _main(args: argparse.Namespace) -> int:
+    try:
+        await memory_service.initialize_vector_store()
+        if memory_service.vector_store is None:
+            return 1
+        totals = await migrate_namespaces(memory_service.vector_store, args.batch)
+        print(f"Migrated {totals['memories']} memories into the namespaces of {totals['users']} users")
+        return 0
+    finally:
+        if memory_service.vector_store is not None:
+            memory_service.vector_store.close()
+        shutdown_vector_store_executor()
+        memory_service.close_embedding_cache()
+        await clients.close()
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
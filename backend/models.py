@@ -1,11 +1,12 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 import uuid
 
 class TherapySession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: Optional[str] = None  # None for anonymous sessions
+    owned: bool = True  # Missing from sessions recorded before they had owners, whose user_id is a random id
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -16,14 +17,27 @@ class TherapyMessage(BaseModel):
     content: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+# Client-generated user ids; they name the user's memory namespace
+USER_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
+    user_id: Optional[str] = Field(None, pattern=USER_ID_PATTERN)  # omitted for anonymous sessions
+
+class SessionRequest(BaseModel):
+    user_id: Optional[str] = Field(None, pattern=USER_ID_PATTERN)
 
 class ChatResponse(BaseModel):
     response: str
     session_id: str
     message_id: str
+    degradations: List[str] = Field(default_factory=list)  # optional steps skipped to stay within the latency budget
+
+class ReindexRequest(BaseModel):
+    target: Optional[str] = None  # index to build; derived from the job id when omitted
+    use_llm: bool = True
+    activate: bool = True
 
 class MemoryResponse(BaseModel):
     session_id: str
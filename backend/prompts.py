@@ -1,4 +1,4 @@
-def get_therapy_system_prompt(memory_context: str = "") -> str:
+def get_therapy_system_prompt(memory_context: str = "", summary: str = "") -> str:
     """Generate the system prompt for therapy conversations"""
     base_prompt = """You are an AI therapy assistant designed to feel like a close, trusted friend. Your entire purpose is to be a safe, non-judgmental space for someone to talk. Your role is to:
             
@@ -12,18 +12,39 @@ def get_therapy_system_prompt(memory_context: str = "") -> str:
             8. Give the replies sweet and short and 
             Remember: You're not a replacement for a professional therapist, but you are a reliable friend who's always there to listen and help them explore their own thoughts and feelings."""
     
+    if summary:
+        base_prompt = f"{base_prompt}\n\nSummary of the earlier part of this conversation:\n{summary}"
+    
     if memory_context:
         return f"{base_prompt}\n{memory_context}"
     
     return base_prompt
 
-def get_conversation_evaluation_prompt(user_message: str, ai_response: str) -> str:
-    """Generate prompt for LLM to evaluate conversation importance"""
-    return f"""You are an expert therapy conversation analyzer. Evaluate if this conversation exchange contains meaningful therapeutic content that should be stored for future reference.
+def get_summary_update_prompt(existing_summary: str, transcript: str) -> str:
+    """Generate prompt for LLM to fold new conversation turns into a rolling session summary"""
+    return f"""You maintain a running summary of a therapy conversation so it can be continued without the full transcript.
+
+Current summary:
+{existing_summary or "(none yet)"}
+
+New conversation turns to add:
+{transcript}
+
+Write an updated summary that merges the new turns into the current summary. Keep what the user shared about their feelings, challenges, relationships, goals, personal details and any coping strategies discussed. Drop greetings and small talk. Write in the third person, in under 150 words.
+
+Updated summary:"""
+
+def get_conversation_evaluation_prompt(exchanges: list) -> str:
+    """Generate prompt for LLM to evaluate the importance of one or more conversation exchanges"""
+    conversations = "\n\n".join(
+        f'Exchange {number}:\nUser: "{exchange["user_message"]}"\nTherapist: "{exchange["ai_response"]}"'
+        for number, exchange in enumerate(exchanges, start=1)
+    )
+    
+    return f"""You are an expert therapy conversation analyzer. Evaluate if each conversation exchange below contains meaningful therapeutic content that should be stored for future reference.
 
-Conversation to evaluate:
-User: "{user_message}"
-Therapist: "{ai_response}"
+Conversations to evaluate:
+{conversations}
 
 Criteria for meaningful content:
 - Discusses emotions, feelings, or mental health
@@ -45,9 +66,22 @@ NOT meaningful (should not store):
 - Casual conversation without therapeutic value
 - Generic responses without personal content
 
-Respond with ONLY a score from 0-10 where:
+Score each exchange from 0-10 where:
 0-3: Not worth storing (trivial/casual)
 4-6: Somewhat meaningful (borderline)
 7-10: Definitely worth storing (therapeutically valuable)
 
-Score:"""
\ No newline at end of file
+Respond with ONLY one line per exchange in the form "<exchange number>: <score>".
+
+Scores:"""
+
+def get_memory_merge_prompt(conversations: list) -> str:
+    """Generate prompt for LLM to merge near-duplicate memories into one"""
+    memories = "\n\n".join(f"Memory {number}:\n{conversation}" for number, conversation in enumerate(conversations, start=1))
+    return f"""The following memories from a user's therapy conversations cover the same ground.
+
+{memories}
+
+Merge them into a single memory that keeps every distinct fact the user shared: feelings, challenges, relationships, goals, personal details, and any coping strategies or advice discussed. Remove repetition. Write in the third person, in under 120 words.
+
+Merged memory:"""
@@ -0,0 +1,356 @@
+"""Rebuild the long-term memory index from the conversation transcripts in MongoDB
+
+Usage (from the backend folder):
+    python -m reindex                              # rebuild into a new index, then activate it
+    python -m reindex --target memories-v2 --no-llm
+    python -m reindex --resume 20250101120000-3fa2c1   # continue an interrupted or failed job
+    python -m reindex --status 20250101120000-3fa2c1
+
+User/assistant exchanges are streamed out of the stored transcripts, run through the
+same storage criteria as live chat, embedded in large batches and upserted into
+a new index (a new Pinecone index, or a new local store directory). Batches are
+processed concurrently but checkpointed in order, so a job resumes from the last
+exchange all earlier batches were stored for. Vector ids are derived from the
+assistant message id, so batches replayed after a resume overwrite themselves.
+Users' pending memory counts only grow when the checkpoint moves past a batch,
+and the scan and catch-up passes each count one side of the job's start time,
+so replays do not count a memory twice.
+The new index only becomes active once the job completes; running servers
+switch immediately when the job ran in them (admin API), others on restart.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from clients import clients
+from config import (
+    VECTOR_STORE_BACKEND, PINECONE_INDEX, LOCAL_VECTOR_STORE_DIR,
+    MEMORY_BATCH_SIZE, EMBEDDING_BATCH_SIZE, VECTOR_STORE_UPSERT_BATCH_SIZE,
+    REINDEX_BATCH_SIZE, REINDEX_CONCURRENCY, REINDEX_MAX_RETRIES, REINDEX_CATCHUP_SLACK
+)
+from memory_evaluator import evaluate_conversations, memory_importance
+from message_store import iter_all_messages
+from session_owners import get_session_owners
+from vector_store import VectorStore, create_vector_store, shutdown_vector_store_executor
+import memory_service
+
+logger = logging.getLogger(__name__)
+
+# Jobs running in this process
+_reindex_tasks: Dict[str, asyncio.Task] = {}
+
+async def _exchange_batches(after: Optional[Dict], since: Optional[datetime],
+                            batch_size: int) -> AsyncIterator[Tuple[List[Dict], Dict]]:
+    """Stream user/assistant exchanges in batches, each with the checkpoint to resume after it"""
+    messages = iter_all_messages(after, since, batch_size=batch_size * 2)
+
+    batch = []
+    pending_user = None
+    async for message in messages:
+        if message["role"] == "user":
+            pending_user = message
+            continue
+
+        # An exchange is a user message directly followed by the assistant reply in the same session
+        if message["role"] == "assistant" and pending_user and pending_user["session_id"] == message["session_id"]:
+            batch.append({
+                "message_id": message["id"],
+                "session_id": message["session_id"],
+                "user_message": pending_user["content"],
+                "ai_response": message["content"],
+                "timestamp": message["timestamp"]
+            })
+            if len(batch) >= batch_size:
+                yield batch, {"session_id": message["session_id"], "timestamp": message["timestamp"], "id": message["id"]}
+                batch = []
+        pending_user = None
+
+    if batch:
+        last = batch[-1]
+        yield batch, {"session_id": last["session_id"], "timestamp": last["timestamp"], "id": last["message_id"]}
+
+async def _store_batch(exchanges: List[Dict], store: VectorStore, use_llm: bool,
+                       count_before: Optional[datetime], count_from: Optional[datetime]) -> Tuple[int, Counter]:
+    """Evaluate, embed and upsert one batch of exchanges into their users' namespaces
+
+    Returns the number stored and, per user, how many of them fall in the
+    [count_from, count_before) window the current pass counts as new memories.
+    """
+    chunks = [exchanges[i:i + MEMORY_BATCH_SIZE] for i in range(0, len(exchanges), MEMORY_BATCH_SIZE)]
+    chunk_decisions = await asyncio.gather(*[
+        evaluate_conversations(chunk, use_llm=use_llm, record=False) for chunk in chunks
+    ])
+    decisions = [decision for chunk in chunk_decisions for decision in chunk]
+    owners = await get_session_owners(list({exchange["session_id"] for exchange in exchanges}))
+
+    memories = [
+        {
+            "id": f"{exchange['session_id']}_{exchange['message_id']}",
+            "session_id": exchange["session_id"],
+            "user_id": owners.get(exchange["session_id"]),
+            "conversation": f"User: {exchange['user_message']}\nTherapist: {exchange['ai_response']}",
+            "timestamp": exchange["timestamp"],
+            "importance": memory_importance(decision)
+        }
+        for exchange, decision in zip(exchanges, decisions)
+        if decision["store"]
+    ]
+    if not memories:
+        return 0, Counter()
+
+    # Embedded in EMBEDDING_BATCH_SIZE requests at once, within the background share of the
+    # embedding limiter; the live embedding cache is bypassed
+    texts = [memory["conversation"] for memory in memories]
+    responses = await asyncio.gather(*[
+        memory_service.create_embeddings(texts[i:i + EMBEDDING_BATCH_SIZE], background=True)
+        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+    ])
+    embeddings = [item.embedding for response in responses for item in response.data]
+    vectors = memory_service.build_memory_vectors(memories, embeddings)
+
+    for namespace, namespace_vectors in memory_service.vectors_by_namespace(vectors).items():
+        for i in range(0, len(namespace_vectors), VECTOR_STORE_UPSERT_BATCH_SIZE):
+            await store.upsert(namespace_vectors[i:i + VECTOR_STORE_UPSERT_BATCH_SIZE], namespace=namespace)
+    new_memories = Counter(
+        memory_service.memory_owner(memory["user_id"], memory["session_id"]) for memory in memories
+        if (count_before is None or memory["timestamp"] < count_before)
+        and (count_from is None or memory["timestamp"] >= count_from)
+    )
+    return len(vectors), new_memories
+
+async def _store_batch_with_retries(exchanges: List[Dict], store: VectorStore, use_llm: bool,
+                                    count_before: Optional[datetime], count_from: Optional[datetime]) -> Tuple[int, Counter]:
+    for attempt in range(REINDEX_MAX_RETRIES):
+        try:
+            return await _store_batch(exchanges, store, use_llm, count_before, count_from)
+        except Exception as e:
+            if attempt == REINDEX_MAX_RETRIES - 1:
+                raise
+            logger.warning(f"Reindex batch failed ({e}) - retrying")
+            await asyncio.sleep(2 ** attempt)
+
+async def _update_job(job_id: str, **fields) -> Dict:
+    fields["updated_at"] = datetime.utcnow()
+    await clients.db.reindex_jobs.update_one({"_id": job_id}, {"$set": fields})
+    return await get_reindex_job(job_id)
+
+async def _run_phase(job: Dict, store: VectorStore, since: Optional[datetime], concurrency: int) -> Dict:
+    """Process every exchange after the job's checkpoint (and since a time) with bounded parallelism and ordered checkpoints
+
+    The scan counts memories of exchanges from before the job started and the
+    catch-up pass (since is set) those from after, as the catch-up re-reads some
+    of what the scan stored.
+    """
+    job_id = job["_id"]
+    count_before, count_from = (job["started_at"], None) if since is None else (None, job["started_at"])
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    progress = {"cursor": job["cursor"], "exchanges": job["exchanges"], "stored": job["stored"]}
+    completed: Dict[int, Tuple[Dict, int, int, Counter]] = {}
+    next_to_commit = 0
+    commit_lock = asyncio.Lock()
+    failures: List[Exception] = []
+
+    async def commit(sequence: int, cursor: Dict, exchanges: int, stored: int, new_memories: Counter):
+        # The checkpoint only moves past a batch once every earlier batch is stored; memories are
+        # counted as pending with it, so batches replayed after a resume are not counted again
+        nonlocal next_to_commit
+        async with commit_lock:
+            completed[sequence] = (cursor, exchanges, stored, new_memories)
+            if next_to_commit not in completed:
+                return
+            committed = Counter()
+            while next_to_commit in completed:
+                cursor, exchanges, stored, new_memories = completed.pop(next_to_commit)
+                progress["cursor"] = cursor
+                progress["exchanges"] += exchanges
+                progress["stored"] += stored
+                committed.update(new_memories)
+                next_to_commit += 1
+            await memory_service.record_memory_counts(committed)
+            await _update_job(job_id, **progress)
+            logger.info(f"Reindex {job_id}: {progress['exchanges']} exchanges scanned, {progress['stored']} stored")
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            # After a failure the remaining batches are drained unprocessed so the reader never blocks
+            if failures:
+                continue
+            sequence, exchanges, cursor = item
+            try:
+                stored, new_memories = await _store_batch_with_retries(
+                    exchanges, store, job["use_llm"], count_before, count_from
+                )
+                await commit(sequence, cursor, len(exchanges), stored, new_memories)
+            except Exception as e:
+                failures.append(e)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        sequence = 0
+        async for exchanges, cursor in _exchange_batches(job["cursor"], since, REINDEX_BATCH_SIZE):
+            if failures:
+                break
+            await queue.put((sequence, exchanges, cursor))
+            sequence += 1
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+    if failures:
+        raise failures[0]
+    return await get_reindex_job(job_id)
+
+def _default_target(job_id: str) -> str:
+    base = PINECONE_INDEX if VECTOR_STORE_BACKEND == "pinecone" else Path(LOCAL_VECTOR_STORE_DIR).name
+    return f"{base or 'memories'}-{job_id}"
+
+async def create_reindex_job(target: Optional[str] = None, use_llm: bool = True, activate: bool = True) -> Dict:
+    """Record a new reindex job; run it with run_reindex_job or start_reindex_job"""
+    now = datetime.utcnow()
+    # The random suffix keeps jobs started within the same second apart
+    job_id = f"{now.strftime('%Y%m%d%H%M%S')}-{secrets.token_hex(3)}"
+    job = {
+        "_id": job_id,
+        "status": "pending",
+        "backend": VECTOR_STORE_BACKEND,
+        "target": target or _default_target(job_id),
+        "use_llm": use_llm,
+        "activate": activate,
+        "phase": "scan",
+        "cursor": None,
+        "exchanges": 0,
+        "stored": 0,
+        "error": None,
+        "started_at": now,
+        "updated_at": now,
+        "completed_at": None
+    }
+    await clients.db.reindex_jobs.insert_one(job)
+    return job
+
+async def get_reindex_job(job_id: str) -> Optional[Dict]:
+    return await clients.db.reindex_jobs.find_one({"_id": job_id})
+
+async def run_reindex_job(job_id: str, concurrency: int = REINDEX_CONCURRENCY) -> Dict:
+    """Run or resume a reindex job to completion, then activate its index
+
+    The main scan walks the transcripts in (session_id, timestamp, id) order. A catch-up pass then
+    re-reads exchanges since shortly before the job started, which picks up turns
+    added to sessions the scan had already passed.
+    """
+    job = await get_reindex_job(job_id)
+    if not job:
+        raise ValueError(f"Unknown reindex job: {job_id}")
+    if job["status"] == "completed":
+        return job
+    if job["backend"] != VECTOR_STORE_BACKEND:
+        raise ValueError(f"Reindex job {job_id} targets the {job['backend']} backend, not {VECTOR_STORE_BACKEND}")
+
+    job = await _update_job(job_id, status="running", error=None)
+    store = create_vector_store(job["backend"], job["target"])
+    swapped = False
+    try:
+        await store.initialize()
+
+        if job["phase"] == "scan":
+            job = await _run_phase(job, store, None, concurrency)
+            job = await _update_job(job_id, phase="catchup", cursor=None)
+
+        since = job["started_at"] - timedelta(seconds=REINDEX_CATCHUP_SLACK)
+        job = await _run_phase(job, store, since, concurrency)
+
+        job = await _update_job(job_id, status="completed", completed_at=datetime.utcnow())
+        logger.info(f"Reindex {job_id} completed: {job['exchanges']} exchanges scanned, {job['stored']} stored in {job['target']}")
+
+        if job["activate"]:
+            # Swap into this process only when it is serving memories
+            swapped = memory_service.vector_store is not None
+            await memory_service.activate_vector_index(job["target"], store=store if swapped else None, job_id=job_id)
+        return job
+
+    except (Exception, asyncio.CancelledError) as e:
+        logger.error(f"Reindex {job_id} stopped: {e!r}")
+        await _update_job(job_id, status="failed", error=repr(e))
+        raise
+    finally:
+        if not swapped:
+            store.close()
+
+def start_reindex_job(job_id: str, concurrency: int = REINDEX_CONCURRENCY):
+    """Run a reindex job in the background of this process"""
+    if job_id in _reindex_tasks and not _reindex_tasks[job_id].done():
+        return
+
+    async def run():
+        try:
+            await run_reindex_job(job_id, concurrency)
+        except Exception:
+            pass  # recorded on the job document
+        finally:
+            _reindex_tasks.pop(job_id, None)
+
+    _reindex_tasks[job_id] = asyncio.create_task(run())
+
+async def stop_reindex_jobs():
+    """Interrupt background reindex jobs on shutdown; they can be resumed later"""
+    tasks = list(_reindex_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="name of the index to build (default: derived from the job id)")
+    parser.add_argument("--resume", metavar="JOB_ID", help="resume an existing job")
+    parser.add_argument("--status", metavar="JOB_ID", help="print a job's progress and exit")
+    parser.add_argument("--no-llm", action="store_true", help="store ambiguous exchanges instead of asking the LLM")
+    parser.add_argument("--no-activate", action="store_true", help="build the index without making it active")
+    parser.add_argument("--concurrency", type=int, default=REINDEX_CONCURRENCY, help="batches processed in parallel")
+    return parser.parse_args(argv)
+
+async def _main(args: argparse.Namespace) -> int:
+    try:
+        if args.status:
+            job = await get_reindex_job(args.status)
+            print(json.dumps(job, default=str, indent=2) if job else f"Unknown reindex job: {args.status}")
+            return 0 if job else 1
+
+        if args.resume:
+            job_id = args.resume
+        else:
+            job = await create_reindex_job(args.target, use_llm=not args.no_llm, activate=not args.no_activate)
+            job_id = job["_id"]
+            print(f"Started reindex job {job_id} into {job['target']}")
+
+        job = await run_reindex_job(job_id, args.concurrency)
+        print(f"Reindex job {job_id} completed: {job['exchanges']} exchanges scanned, {job['stored']} stored in {job['target']}")
+        return 0
+    except Exception as e:
+        print(f"Reindex failed: {e}")
+        return 1
+    finally:
+        await clients.close()
+        shutdown_vector_store_executor()
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for noisy in ("httpx", "memory_evaluator"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+    return asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+from openai import APIStatusError
+
+from admission import OverloadedError
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+from metrics import CIRCUIT_OPENS, DEGRADATIONS, HEDGED_CALLS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Degradations applied while serving the current chat turn (None outside chat turns)
+turn_degradations_var: ContextVar[Optional[List[str]]] = ContextVar("turn_degradations", default=None)
+
+def record_degradation(kind: str):
+    """Note that the current turn was served without something optional, e.g. "memory_timeout" """
+    DEGRADATIONS.labels(kind).inc()
+    degradations = turn_degradations_var.get()
+    if degradations is not None and kind not in degradations:
+        degradations.append(kind)
+
+class CircuitOpenError(OverloadedError):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+def _is_upstream_failure(e: Exception) -> bool:
+    # Shedding and client errors (bad requests, rate limits) say nothing about upstream health
+    if isinstance(e, OverloadedError):
+        return False
+    if isinstance(e, APIStatusError):
+        return e.status_code >= 500
+    return True
+
+class CircuitBreaker:
+    """Stops calling an upstream after consecutive failures
+
+    After failure_threshold failures in a row the circuit opens and calls fail
+    immediately with CircuitOpenError. Once reset_timeout has passed a single
+    trial call is let through; it closes the circuit on success and reopens it
+    on failure.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def _record_failure(self):
+        self.failures += 1
+        if self._opened_at is not None or self.failures >= self.failure_threshold:
+            if self._opened_at is None:
+                logger.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+            self._opened_at = time.monotonic()
+            CIRCUIT_OPENS.labels(self.name).inc()
+
+    def _record_success(self):
+        if self._opened_at is not None:
+            logger.info(f"Circuit for {self.name} closed")
+        self.failures = 0
+        self._opened_at = None
+
+    @asynccontextmanager
+    async def guard(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            retry_after = self._opened_at + self.reset_timeout - time.monotonic()
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable", retry_after)
+
+        trial = state == "half_open"
+        if trial:
+            self._trial_in_flight = True
+        try:
+            yield
+        except Exception as e:
+            if _is_upstream_failure(e):
+                self._record_failure()
+            raise
+        else:
+            self._record_success()
+        finally:
+            if trial:
+                self._trial_in_flight = False
+
+async def hedged(name: str, call: Callable[[], Awaitable[T]], delay: Optional[float]) -> T:
+    """Await call(), starting a second attempt if the first is still running after delay
+
+    The first attempt to succeed wins and the other is cancelled. A falsy delay
+    disables hedging.
+    """
+    if not delay:
+        return await call()
+
+    attempts = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=delay)
+        if not done:
+            HEDGED_CALLS.labels(name).inc()
+            attempts.append(asyncio.ensure_future(call()))
+
+        pending = set(attempts)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    return attempt.result()
+                error = error or attempt.exception()
+        raise error
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+# Global circuit breakers, one per upstream
+openai_chat_breaker = CircuitBreaker("openai_chat")
+openai_embedding_breaker = CircuitBreaker("openai_embedding")
+vector_store_breaker = CircuitBreaker("vector_store")
+circuit_breakers = (openai_chat_breaker, openai_embedding_breaker, vector_store_breaker)
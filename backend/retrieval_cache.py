@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import MEMORY_CACHE_SIMILARITY, MEMORY_CACHE_MAX_SESSIONS, MEMORY_CACHE_TTL
+
+class SessionRetrievalCache:
+    """Per-session semantic cache of the last memory retrieval
+
+    Consecutive turns about the same topic embed to nearby vectors, so when a new
+    query embedding is within the cosine threshold of the session's cached one the
+    cached memories are reused without querying the vector store. Storing memories
+    for a session invalidates its entry; the TTL bounds how long a cached result
+    can miss memories stored from other sessions.
+    """
+
+    def __init__(self, threshold: float = MEMORY_CACHE_SIMILARITY, max_sessions: int = MEMORY_CACHE_MAX_SESSIONS,
+                 ttl: float = MEMORY_CACHE_TTL):
+        self.threshold = threshold
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, session_id: str, embedding: List[float], limit: int) -> Optional[List[str]]:
+        """Return the cached memories if the query is close enough to the cached one, else None"""
+        entry = self._sessions.get(session_id)
+        if entry is None or entry["limit"] != limit:
+            return None
+        if time.monotonic() - entry["created"] > self.ttl:
+            del self._sessions[session_id]
+            return None
+        if float(np.dot(entry["embedding"], self._normalize(embedding))) < self.threshold:
+            return None
+        self._sessions.move_to_end(session_id)
+        return list(entry["memories"])
+
+    def set(self, session_id: str, embedding: List[float], limit: int, memories: List[str]):
+        """Cache a session's latest retrieval"""
+        self._sessions[session_id] = {
+            "embedding": self._normalize(embedding),
+            "limit": limit,
+            "memories": list(memories),
+            "created": time.monotonic()
+        }
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def invalidate(self, session_id: str):
+        """Drop a session's cached retrieval, e.g. after new memories were stored for it"""
+        self._sessions.pop(session_id, None)
+
+    def clear(self):
+        self._sessions.clear()
+
+# Global retrieval cache
+session_retrieval_cache = SessionRetrievalCache()
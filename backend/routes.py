@@ -1,6 +1,19 @@
-from fastapi import APIRouter, HTTPException
-from models import ChatRequest, ChatResponse, MemoryResponse
-from therapy_service import process_therapy_chat, get_session_history, get_session_memories, create_therapy_session
+import hmac
+from typing import AsyncIterator, Callable, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, WebSocket
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from models import ChatRequest, ChatResponse, MemoryResponse, ReindexRequest, SessionRequest, USER_ID_PATTERN
+from admission import OverloadedError, chat_admission
+from config import HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, ADMIN_TOKEN
+from therapy_service import (
+    process_therapy_chat, stream_therapy_chat, get_session_history, stream_session_history,
+    decode_history_cursor, get_session_memories, create_therapy_session
+)
+from memory_service import get_embedding_cache_stats
+from chat_socket import serve_chat_socket
+from reindex import create_reindex_job, get_reindex_job, start_reindex_job
+from session_owners import SessionOwnershipError, resolve_session_user
 
 # Create API router with /api prefix
 api_router = APIRouter(prefix="/api")
@@ -12,33 +25,144 @@ async def root():
 
 @api_router.post("/therapy/chat", response_model=ChatResponse)
 async def therapy_chat(request: ChatRequest):
-    """Main therapy chat endpoint"""
+    """Main therapy chat endpoint
+    
+    Sheds load with 503 (or 429 when OpenAI is rate limiting) and a Retry-After header.
+    Answers 403 when the session belongs to another user.
+    """
     try:
-        return await process_therapy_chat(request)
+        async with chat_admission.admit():
+            return await process_therapy_chat(request)
+    except OverloadedError:
+        raise
+    except SessionOwnershipError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing therapy session: {str(e)}")
 
+async def _release_when_done(events: AsyncIterator[str], release: Callable[[], None]) -> AsyncIterator[str]:
+    try:
+        async for event in events:
+            yield event
+    finally:
+        release()
+
+@api_router.post("/therapy/chat/stream")
+async def therapy_chat_stream(request: ChatRequest):
+    """Streaming therapy chat endpoint (server-sent events)"""
+    # Admitted before the response starts, so a shed request still gets a 503. The slot is
+    # released when the body ends, or by the background task if the client left before it
+    # started (release is idempotent)
+    release = await chat_admission.acquire()
+    return StreamingResponse(
+        _release_when_done(stream_therapy_chat(request), release),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release)
+    )
+
+@api_router.websocket("/therapy/ws")
+async def therapy_chat_socket(
+    websocket: WebSocket,
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = Query(None, pattern=USER_ID_PATTERN)
+):
+    """Chat over a persistent WebSocket that keeps the session's state between turns"""
+    await serve_chat_socket(websocket, session_id, user_id)
+
 @api_router.get("/therapy/session/{session_id}/history")
-async def get_therapy_session_history(session_id: str):
-    """Get conversation history for a session"""
+async def get_therapy_session_history(
+    session_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    user_id: Optional[str] = Query(None, pattern=USER_ID_PATTERN)
+):
+    """Get conversation history for a session
+    
+    Returns a page of messages and a `next_cursor` to pass back for the next page.
+    With format=ndjson the messages are streamed one JSON document per line.
+    Answers 403 unless user_id is the session's owner (omitted for anonymous sessions).
+    """
     try:
-        return await get_session_history(session_id)
+        if cursor:
+            decode_history_cursor(cursor)
+        # Checked before the response starts, so a rejected read still gets a 403
+        await resolve_session_user(session_id, user_id)
+        if format == "ndjson":
+            return StreamingResponse(
+                stream_session_history(session_id, limit=limit, cursor=cursor),
+                media_type="application/x-ndjson"
+            )
+        return await get_session_history(session_id, limit=limit or HISTORY_PAGE_SIZE, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SessionOwnershipError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving session history: {str(e)}")
 
 @api_router.post("/therapy/session")
-async def create_new_therapy_session():
-    """Create a new therapy session"""
+async def create_new_therapy_session(request: Optional[SessionRequest] = None):
+    """Create a new therapy session, owned by the given user if any"""
     try:
-        session_id = await create_therapy_session()
+        session_id = await create_therapy_session(request.user_id if request else None)
         return {"session_id": session_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating therapy session: {str(e)}")
 
 @api_router.get("/therapy/memories/{session_id}", response_model=MemoryResponse)
-async def get_memories_for_session(session_id: str, query: str = ""):
-    """Debug endpoint to test memory retrieval"""
+async def get_memories_for_session(
+    session_id: str,
+    query: str = "",
+    user_id: Optional[str] = Query(None, pattern=USER_ID_PATTERN)
+):
+    """Debug endpoint to test memory retrieval
+
+    Answers 403 unless user_id is the session's owner (omitted for anonymous sessions).
+    """
+    try:
+        return await get_session_memories(session_id, query, user_id)
+    except SessionOwnershipError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving memories: {str(e)}")
+
+@api_router.get("/therapy/embedding-cache/stats")
+async def get_embedding_cache_statistics():
+    """Debug endpoint for embedding cache hit and miss statistics"""
+    return get_embedding_cache_stats()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints need the X-Admin-Token header to match ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled (ADMIN_TOKEN is not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@api_router.post("/admin/reindex", dependencies=[Depends(require_admin)])
+async def start_reindex(request: ReindexRequest):
+    """Rebuild the memory index from stored transcripts in the background"""
     try:
-        return await get_session_memories(session_id, query)
+        job = await create_reindex_job(request.target, use_llm=request.use_llm, activate=request.activate)
+        start_reindex_job(job["_id"])
+        return job
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error retrieving memories: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error starting reindex: {str(e)}")
+
+@api_router.post("/admin/reindex/{job_id}/resume", dependencies=[Depends(require_admin)])
+async def resume_reindex(job_id: str):
+    """Resume an interrupted or failed reindex job from its last checkpoint"""
+    job = await get_reindex_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Reindex job not found")
+    start_reindex_job(job_id)
+    return job
+
+@api_router.get("/admin/reindex/{job_id}", dependencies=[Depends(require_admin)])
+async def get_reindex_status(job_id: str):
+    """Progress of a reindex job"""
+    job = await get_reindex_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Reindex job not found")
+    return job
\ No newline at end of file
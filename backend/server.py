@@ -1,14 +1,50 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from starlette.middleware.cors import CORSMiddleware
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import logging
 
 from config import CORS_ORIGINS
 from routes import api_router
-from memory_service import initialize_pinecone
-from therapy_service import close_db_connection
+from memory_service import initialize_vector_store, close_vector_store, close_embedding_cache
+from memory_ingestion import start_memory_ingestion, stop_memory_ingestion
+from memory_compaction import start_memory_compaction, stop_memory_compaction
+from clients import clients
+from database import ensure_indexes
+from summary_service import stop_summary_updates
+from reindex import stop_reindex_jobs
+from metrics import RequestContextMiddleware, register_runtime_collector
+from admission import OverloadedError
+from chat_socket import close_chat_sockets
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up shared clients and services on startup, drain them all on shutdown"""
+    await clients.warm_up()
+    await ensure_indexes()
+    await initialize_vector_store()
+    await start_memory_ingestion()
+    start_memory_compaction()
+    logger.info("AI Therapy Webapp started successfully")
+
+    yield
+
+    # Flush queued memories before the clients they depend on are closed
+    await close_chat_sockets()
+    await stop_reindex_jobs()
+    await stop_memory_compaction()
+    await stop_memory_ingestion()
+    await stop_summary_updates()
+    close_vector_store()
+    close_embedding_cache()
+    await clients.close()
+    logger.info("AI Therapy Webapp shut down successfully")
 
 # Create the main app
-app = FastAPI(title="AI Therapy Webapp", description="Interactive AI therapy with conversation memory")
+app = FastAPI(title="AI Therapy Webapp", description="Interactive AI therapy with conversation memory", lifespan=lifespan)
 
 # Include API routes
 app.include_router(api_router)
@@ -22,24 +58,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    """Shed requests get 503/429 with Retry-After instead of a generic 500"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Tag each request with an ID and log its per-stage timings
+app.add_middleware(RequestContextMiddleware)
+register_runtime_collector()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logger = logging.getLogger(__name__)
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
-    await initialize_pinecone()
-    logger.info("AI Therapy Webapp started successfully")
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown"""
-    await close_db_connection()
-    logger.info("AI Therapy Webapp shut down successfully")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,86 @@
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from clients import clients
+from config import SESSION_OWNER_CACHE_SIZE
+from metrics import span
+from models import TherapySession
+
+logger = logging.getLogger(__name__)
+
+# A session belongs to the user who started it, whose memories it reads and
+# writes, and only that user may continue it. Sessions started without a user id
+# (and sessions recorded before sessions had owners) are anonymous: they have no
+# owner and can only be continued without a user id.
+
+class SessionOwnershipError(Exception):
+    """Raised when a client names a session without being its owner"""
+
+# Owners never change, so cached entries only leave when the cache is full
+_owner_cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+
+# Fields read to find a session's owner
+_OWNER_PROJECTION = {"_id": 0, "id": 1, "user_id": 1, "owned": 1}
+
+def _owner(document: Dict) -> Optional[str]:
+    # Sessions recorded before they had owners were given a random user_id that no client knows
+    return document.get("user_id") if document.get("owned") else None
+
+def _cache_owner(session_id: str, user_id: Optional[str]):
+    _owner_cache[session_id] = user_id
+    _owner_cache.move_to_end(session_id)
+    while len(_owner_cache) > SESSION_OWNER_CACHE_SIZE:
+        _owner_cache.popitem(last=False)
+
+async def create_session(user_id: Optional[str] = None) -> TherapySession:
+    """Record a new session owned by user_id, or an anonymous one"""
+    session = TherapySession(user_id=user_id)
+    await clients.db.therapy_sessions.insert_one(session.dict())
+    _cache_owner(session.id, session.user_id)
+    return session
+
+async def resolve_session_user(session_id: str, user_id: Optional[str] = None) -> Optional[str]:
+    """The user owning a session (None if anonymous), claiming it for user_id if it has no record yet
+
+    Raises SessionOwnershipError unless user_id is the session's owner: an owned
+    session cannot be continued anonymously or by another user, and an anonymous
+    one cannot be continued under a user id.
+    """
+    if session_id in _owner_cache:
+        owner = _owner_cache[session_id]
+        _owner_cache.move_to_end(session_id)
+    else:
+        claim = TherapySession(id=session_id, user_id=user_id).dict()
+        with span("mongo_session_owner"):
+            try:
+                # One round trip both looks the owner up and claims sessions without a record
+                document = await clients.db.therapy_sessions.find_one_and_update(
+                    {"id": session_id}, {"$setOnInsert": claim}, projection=_OWNER_PROJECTION,
+                    upsert=True, return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # A concurrent turn claimed it first
+                document = await clients.db.therapy_sessions.find_one({"id": session_id}, _OWNER_PROJECTION)
+        owner = _owner(document)
+        _cache_owner(session_id, owner)
+
+    if owner != user_id:
+        if owner is None:
+            raise SessionOwnershipError(f"Session {session_id} is anonymous")
+        if user_id is None:
+            raise SessionOwnershipError(f"Session {session_id} belongs to a user")
+        raise SessionOwnershipError(f"Session {session_id} belongs to another user")
+    return owner
+
+async def get_session_owners(session_ids: List[str]) -> Dict[str, str]:
+    """Owners of the given sessions that have one, keyed by session id; anonymous sessions are left out"""
+    owners = {session_id: _owner_cache[session_id] for session_id in session_ids if session_id in _owner_cache}
+    missing = [session_id for session_id in session_ids if session_id not in owners]
+    if missing:
+        async for document in clients.db.therapy_sessions.find({"id": {"$in": missing}}, _OWNER_PROJECTION):
+            owners[document["id"]] = _owner(document)
+    return {session_id: owner for session_id, owner in owners.items() if owner}
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import (
+    CHAT_MODEL, MAX_CONVERSATION_HISTORY, SUMMARY_MAX_TOKENS,
+    SUMMARY_MIN_NEW_MESSAGES, SUMMARY_MAX_MESSAGES_PER_UPDATE, SUMMARY_CACHE_SIZE,
+    MEMORY_FLUSH_TIMEOUT
+)
+from admission import openai_chat_limiter
+from clients import clients
+from message_store import iter_session_messages
+from metrics import span
+from prompts import get_summary_update_prompt
+from resilience import openai_chat_breaker
+
+logger = logging.getLogger(__name__)
+
+# Summaries of recently active sessions and how far they reach, so chat turns and
+# updates rarely read them from Mongo
+_summary_cache: "OrderedDict[str, Dict]" = OrderedDict()
+
+# Messages that have left the history window since each session's last update was scheduled
+_left_window: "OrderedDict[str, int]" = OrderedDict()
+
+# Sessions with an update in flight, and the tasks running them
+_updating_sessions = set()
+_update_tasks = set()
+
+def _cache_summary(session_id: str, summary: str, summarized_until: Optional[Dict]):
+    _summary_cache[session_id] = {"summary": summary, "summarized_until": summarized_until}
+    _summary_cache.move_to_end(session_id)
+    while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+        _summary_cache.popitem(last=False)
+
+async def get_session_summary(session_id: str) -> str:
+    """Get the rolling summary of turns older than the history window"""
+    if session_id in _summary_cache:
+        _summary_cache.move_to_end(session_id)
+        return _summary_cache[session_id]["summary"]
+
+    try:
+        with span("mongo_summary_find"):
+            document = await clients.db.session_summaries.find_one(
+                {"session_id": session_id}, {"summary": 1, "summarized_until": 1}
+            ) or {}
+        summary = document.get("summary", "")
+        _cache_summary(session_id, summary, document.get("summarized_until"))
+        return summary
+    except Exception as e:
+        logger.error(f"Error getting session summary: {e}")
+        return ""
+
+def schedule_summary_update(session_id: str) -> bool:
+    """Fold turns that fell out of the history window into the rolling summary, in the background
+
+    Returns False if an update of the session is already running.
+    """
+    if session_id in _updating_sessions:
+        return False
+    _updating_sessions.add(session_id)
+
+    task = asyncio.create_task(_update_session_summary(session_id))
+    _update_tasks.add(task)
+    task.add_done_callback(_update_tasks.discard)
+    return True
+
+def note_messages_left_window(session_id: str, count: int) -> bool:
+    """Count messages pushed out of a session's history window
+
+    An update is scheduled only once SUMMARY_MIN_NEW_MESSAGES have left since the
+    last one, so full-window turns do not each read the summary and transcript
+    back from Mongo. Returns True when an update was scheduled.
+    """
+    left = _left_window.pop(session_id, 0) + count
+    if left >= SUMMARY_MIN_NEW_MESSAGES and schedule_summary_update(session_id):
+        return True
+    _left_window[session_id] = left
+    while len(_left_window) > SUMMARY_CACHE_SIZE:
+        _left_window.popitem(last=False)
+    return False
+
+async def _update_session_summary(session_id: str):
+    """Incrementally extend the stored summary with unsummarized turns older than the window"""
+    try:
+        document = _summary_cache.get(session_id)
+        if document is None:
+            document = await clients.db.session_summaries.find_one({"session_id": session_id}) or {}
+        summarized_until: Optional[Dict] = document.get("summarized_until")
+
+        after = (summarized_until["timestamp"], summarized_until["id"]) if summarized_until else None
+
+        fetch_limit = SUMMARY_MAX_MESSAGES_PER_UPDATE + MAX_CONVERSATION_HISTORY
+        unsummarized = [message async for message in iter_session_messages(session_id, after, fetch_limit)]
+
+        # Only turns that have left the recent window are summarized; very long
+        # backlogs are worked through SUMMARY_MAX_MESSAGES_PER_UPDATE at a time
+        if len(unsummarized) == fetch_limit:
+            to_summarize = unsummarized[:SUMMARY_MAX_MESSAGES_PER_UPDATE]
+            # The rest of the backlog is picked up by the update the next full-window turn schedules
+            _left_window[session_id] = max(_left_window.get(session_id, 0), SUMMARY_MIN_NEW_MESSAGES)
+        else:
+            to_summarize = unsummarized[:-MAX_CONVERSATION_HISTORY]
+        if len(to_summarize) < SUMMARY_MIN_NEW_MESSAGES:
+            return
+
+        transcript = "\n".join(
+            f"{'User' if msg['role'] == 'user' else 'Therapist'}: {msg['content']}" for msg in to_summarize
+        )
+        async with openai_chat_breaker.guard(), openai_chat_limiter.slot(background=True):
+            with span("summary_update_llm"):
+                completion = await clients.openai.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=[{"role": "user", "content": get_summary_update_prompt(document.get("summary", ""), transcript)}],
+                    max_tokens=SUMMARY_MAX_TOKENS,
+                    temperature=0.3
+                )
+        summary = completion.choices[0].message.content.strip()
+
+        last = to_summarize[-1]
+        summarized_until = {"timestamp": last["timestamp"], "id": last["id"]}
+        await clients.db.session_summaries.update_one(
+            {"session_id": session_id},
+            {"$set": {
+                "summary": summary,
+                "summarized_until": summarized_until,
+                "updated_at": datetime.utcnow()
+            }, "$inc": {"summarized_messages": len(to_summarize)}},
+            upsert=True
+        )
+        _cache_summary(session_id, summary, summarized_until)
+        logger.info(f"Updated summary for session {session_id[:8]}... with {len(to_summarize)} messages")
+
+    except Exception as e:
+        logger.error(f"Error updating session summary: {e}")
+    finally:
+        _updating_sessions.discard(session_id)
+
+async def stop_summary_updates(timeout: float = MEMORY_FLUSH_TIMEOUT):
+    """Wait for in-flight summary updates on shutdown"""
+    if _update_tasks:
+        await asyncio.wait(list(_update_tasks), timeout=timeout)
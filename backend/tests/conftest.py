@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other top-level, as they do when run from the backend folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from clients import clients  # noqa: E402
+
+@pytest.fixture
+def db(monkeypatch):
+    """Point every service at an in-memory MongoDB"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(clients, "_db", database)
+    return database
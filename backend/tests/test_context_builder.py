@@ -0,0 +1,75 @@
+import pytest
+
+import context_builder
+from config import MEMORY_CONTEXT_TOKEN_BUDGET, SUMMARY_MAX_TOKENS
+from context_builder import MESSAGE_TOKEN_OVERHEAD, build_chat_messages, chat_prefix, count_tokens
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # Budgets are checked against the length-based estimate, so tests do not depend on tiktoken
+    monkeypatch.setattr(context_builder, "_get_encoding", lambda: None)
+    count_tokens.cache_clear()
+    yield
+    count_tokens.cache_clear()
+
+def turn(n, words=20):
+    role = "user" if n % 2 == 0 else "assistant"
+    return {"role": role, "content": f"message {n} " + "word " * words}
+
+def prompt_tokens(messages):
+    return sum(count_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD for message in messages)
+
+def test_everything_fits_a_generous_budget():
+    history = [turn(n) for n in range(6)]
+    messages = build_chat_messages(history, ["remember this"], "we talked before", budget=10000)
+    assert messages[0]["role"] == "system"
+    assert "remember this" in messages[0]["content"]
+    assert "we talked before" in messages[0]["content"]
+    assert [m["content"] for m in messages[1:]] == [m["content"] for m in history]
+
+@pytest.mark.parametrize("budget", [1200, 1500, 2000, 3000])
+def test_prompt_stays_within_budget_and_keeps_newest_history(budget):
+    history = [turn(n, words=250) for n in range(10)]
+    messages = build_chat_messages(history, ["memory " * 50] * 3, "summary " * 100, budget=budget)
+    assert prompt_tokens(messages) <= budget
+
+    kept = [m["content"] for m in messages[1:]]
+    assert kept == [m["content"] for m in history[-len(kept):]]
+    assert len(kept) < len(history)
+
+def test_latest_message_is_always_sent_truncated_if_needed():
+    history = [turn(0), {"role": "user", "content": "long " * 5000}]
+    messages = build_chat_messages(history, [], "", budget=1500)
+    assert messages[-1]["role"] == "user"
+    assert messages[-1]["content"].startswith("long long")
+    assert prompt_tokens(messages) <= 1500
+
+def test_memories_are_packed_most_relevant_first_within_their_budget():
+    memories = [f"memory {n} " + "detail " * 100 for n in range(20)]
+    messages = build_chat_messages([turn(0)], memories, "", budget=10000)
+    system_prompt = messages[0]["content"]
+    included = [n for n in range(20) if f"memory {n} " in system_prompt]
+    assert included == list(range(len(included)))
+    assert 0 < len(included) < 20
+    memory_section = system_prompt[system_prompt.index("Relevant context"):]
+    assert count_tokens(memory_section) <= MEMORY_CONTEXT_TOKEN_BUDGET + count_tokens(context_builder._memory_context(["x"]))
+
+def test_summary_is_truncated_to_its_budget():
+    summary = "summary " * 2000
+    system_prompt = build_chat_messages([turn(0)], [], summary, budget=10000)[0]["content"]
+    assert "summary summary" in system_prompt
+    assert system_prompt.count("summary ") <= SUMMARY_MAX_TOKENS * 4 // len("summary ") + 1
+
+def test_prefix_is_reused_until_summary_or_memories_change():
+    prefix = chat_prefix("summary", ["a", "b"])
+    assert chat_prefix("summary", ["a", "b"], prefix) is prefix
+    assert chat_prefix("summary", ["a", "c"], prefix) is not prefix
+    assert chat_prefix("new summary", ["a", "b"], prefix) is not prefix
+
+def test_prefixed_build_matches_a_fresh_build():
+    history = [turn(n, words=150) for n in range(10)]
+    memories = ["memory " * 50] * 3
+    prefix = chat_prefix("summary", memories)
+    for budget in (1500, 3000):
+        assert build_chat_messages(history, memories, "summary", budget=budget, prefix=prefix) == \
+            build_chat_messages(history, memories, "summary", budget=budget)
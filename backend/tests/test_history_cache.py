@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+import history_cache
+from history_cache import SessionHistoryCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(history_cache, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+def message(n):
+    return {"id": str(n), "content": f"message {n}"}
+
+def test_get_returns_window_in_order(clock):
+    cache = SessionHistoryCache(window=3, max_sessions=10, ttl=60)
+    cache.set("s", [message(1), message(2)])
+    cache.append("s", message(3))
+    cache.append("s", message(4))
+    assert [m["id"] for m in cache.get("s")] == ["2", "3", "4"]
+    assert cache.get("other") is None
+
+def test_append_to_uncached_session_is_ignored(clock):
+    cache = SessionHistoryCache(window=3, max_sessions=10, ttl=60)
+    cache.append("s", message(1))
+    assert cache.get("s") is None
+
+def test_window_expires_a_fixed_age_after_set(clock):
+    cache = SessionHistoryCache(window=3, max_sessions=10, ttl=60)
+    cache.set("s", [message(1)])
+
+    # Reads and appends do not extend the window's lifetime
+    for n in range(2, 6):
+        clock.value += 15
+        cache.append("s", message(n))
+        assert cache.get("s") is not None
+    clock.value += 1
+    assert cache.get("s") is None
+    assert len(cache) == 0
+
+def test_set_restarts_the_age(clock):
+    cache = SessionHistoryCache(window=3, max_sessions=10, ttl=60)
+    cache.set("s", [message(1)])
+    clock.value += 50
+    cache.set("s", [message(1), message(2)])
+    clock.value += 50
+    assert [m["id"] for m in cache.get("s")] == ["1", "2"]
+
+def test_least_recently_used_session_is_evicted_first(clock):
+    cache = SessionHistoryCache(window=3, max_sessions=2, ttl=60)
+    cache.set("a", [message(1)])
+    cache.set("b", [message(2)])
+    cache.get("a")
+    cache.set("c", [message(3)])
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+def test_expired_sessions_are_evicted_on_set(clock):
+    cache = SessionHistoryCache(window=3, max_sessions=10, ttl=60)
+    cache.set("a", [message(1)])
+    clock.value += 61
+    cache.set("b", [message(2)])
+    assert len(cache) == 1
@@ -0,0 +1,29 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+
+from therapy_service import decode_history_cursor, encode_history_cursor
+
+def test_cursor_round_trips_the_message_position():
+    message = {"id": "m-1", "timestamp": datetime(2024, 5, 1, 12, 30, 15, 123456), "content": "hi"}
+    cursor = encode_history_cursor(message)
+    assert decode_history_cursor(cursor) == (message["timestamp"], "m-1")
+
+def test_cursor_is_url_safe_and_opaque():
+    cursor = encode_history_cursor({"id": "m/?+", "timestamp": datetime(2024, 5, 1)})
+    assert all(c.isalnum() or c in "-_=" for c in cursor)
+    assert "m/?+" not in cursor
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(json.dumps({"id": "m-1"}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"t": "yesterday", "id": "m-1"}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(["2024-05-01", "m-1"]).encode()).decode(),
+])
+def test_malformed_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_history_cursor(cursor)
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from vector_store import LocalVectorStore
+
+DIMENSION = 4
+
+def vector(vector_id, values, **metadata):
+    return {"id": vector_id, "values": values, "metadata": metadata}
+
+@pytest.fixture
+def open_store(tmp_path):
+    """Open (or reopen) a small-segment store over tmp_path; every store opened is closed afterwards"""
+    stores = []
+
+    def open_store():
+        store = LocalVectorStore(directory=str(tmp_path), dimension=DIMENSION, segment_size=3)
+        asyncio.run(store.initialize())
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+def query(store, values, top_k=10, filter=None, namespace=""):
+    return asyncio.run(store.query(values, top_k, filter, namespace=namespace))
+
+def ids(matches):
+    return [match.id for match in matches]
+
+def test_query_ranks_by_cosine_similarity(open_store):
+    store = open_store()
+    asyncio.run(store.upsert([
+        vector("a", [1, 0, 0, 0], session_id="s1"),
+        vector("b", [1, 1, 0, 0], session_id="s1"),
+        vector("c", [0, 0, 5, 0], session_id="s2"),
+    ]))
+    matches = query(store, [2, 0, 0, 0])
+    assert ids(matches) == ["a", "b", "c"]
+    assert matches[0].score == pytest.approx(1.0)
+    assert matches[1].score == pytest.approx(2 ** -0.5)
+    assert matches[0].metadata == {"session_id": "s1"}
+    assert ids(query(store, [1, 0, 0, 0], top_k=1)) == ["a"]
+
+def test_filters_on_indexed_and_other_fields(open_store):
+    store = open_store()
+    asyncio.run(store.upsert([
+        vector("a", [1, 0, 0, 0], session_id="s1", topics=["work"]),
+        vector("b", [1, 0, 0, 0], session_id="s2", topics=["family"]),
+        vector("c", [1, 0, 0, 0], session_id="s3", topics=["work", "sleep"]),
+    ]))
+    assert ids(query(store, [1, 0, 0, 0], filter={"session_id": "s2"})) == ["b"]
+    assert sorted(ids(query(store, [1, 0, 0, 0], filter={"session_id": {"$in": ["s1", "s3"]}}))) == ["a", "c"]
+    assert sorted(ids(query(store, [1, 0, 0, 0], filter={"session_id": {"$ne": "s1"}}))) == ["b", "c"]
+    assert sorted(ids(query(store, [1, 0, 0, 0], filter={"topics": {"$in": ["work"]}}))) == ["a", "c"]
+    assert query(store, [1, 0, 0, 0], filter={"session_id": "unknown"}) == []
+
+def test_namespaces_are_queried_apart(open_store):
+    store = open_store()
+    asyncio.run(store.upsert([vector("a", [1, 0, 0, 0])], namespace="alice"))
+    asyncio.run(store.upsert([vector("a", [0, 1, 0, 0])], namespace="bob"))
+    assert query(store, [1, 0, 0, 0], namespace="alice")[0].score == pytest.approx(1.0)
+    assert query(store, [1, 0, 0, 0], namespace="bob")[0].score == pytest.approx(0.0)
+    assert query(store, [1, 0, 0, 0]) == []
+
+def test_reupsert_supersedes_the_earlier_row(open_store):
+    store = open_store()
+    asyncio.run(store.upsert([vector("a", [1, 0, 0, 0], version=1), vector("b", [0, 1, 0, 0])]))
+    asyncio.run(store.upsert([vector("a", [0, 0, 1, 0], version=2)]))
+    matches = query(store, [0, 0, 1, 0])
+    assert ids(matches) == ["a", "b"]
+    assert matches[0].metadata == {"version": 2}
+    assert len(store) == 2
+
+def test_delete_only_touches_its_namespace(open_store):
+    store = open_store()
+    asyncio.run(store.upsert([vector("a", [1, 0, 0, 0]), vector("b", [0, 1, 0, 0])]))
+    asyncio.run(store.upsert([vector("a", [1, 0, 0, 0])], namespace="other"))
+    asyncio.run(store.delete(["a", "missing"]))
+    assert ids(query(store, [1, 0, 0, 0])) == ["b"]
+    assert ids(query(store, [1, 0, 0, 0], namespace="other")) == ["a"]
+
+def test_reload_restores_upserts_reupserts_and_deletes_across_segments(open_store):
+    store = open_store()
+    asyncio.run(store.upsert([vector(str(n), [1, n, 0, 0], n=n) for n in range(7)]))
+    asyncio.run(store.delete(["2"]))
+    asyncio.run(store.upsert([vector("3", [0, 0, 1, 0], n=30)]))
+    # Deleted, then upserted again: the later row stays alive
+    asyncio.run(store.delete(["4"]))
+    asyncio.run(store.upsert([vector("4", [0, 0, 0, 1], n=40)]))
+    store.close()
+
+    reloaded = open_store()
+    assert len(reloaded) == 6
+    assert sorted(ids(query(reloaded, [1, 0, 0, 0]))) == ["0", "1", "3", "4", "5", "6"]
+    assert query(reloaded, [0, 0, 1, 0], top_k=1)[0].metadata == {"n": 30}
+    assert query(reloaded, [0, 0, 0, 1], top_k=1)[0].metadata == {"n": 40}
+
+    # Appends continue after a reload
+    asyncio.run(reloaded.upsert([vector("7", [1, 0, 0, 0], n=7)]))
+    assert len(reloaded) == 7
+
+def test_reload_drops_a_torn_write(open_store, tmp_path):
+    store = open_store()
+    asyncio.run(store.upsert([vector("a", [1, 0, 0, 0]), vector("b", [0, 1, 0, 0])]))
+    store.close()
+    # A crash after the vector was written but before its metadata line was finished
+    with open(tmp_path / "seg_000000.f32", "ab") as f:
+        f.write(b"\0" * DIMENSION * 4)
+    with open(tmp_path / "seg_000000.jsonl", "a") as f:
+        f.write('{"id": "c", "meta')
+
+    reloaded = open_store()
+    assert sorted(ids(query(reloaded, [1, 1, 0, 0]))) == ["a", "b"]
+    asyncio.run(reloaded.upsert([vector("c", [0, 0, 1, 0])]))
+    reloaded.close()
+    assert sorted(ids(query(open_store(), [1, 1, 1, 0]))) == ["a", "b", "c"]
+
+def test_list_records_by_filter_prefix_and_limit(open_store):
+    store = open_store()
+    asyncio.run(store.upsert([
+        vector("s1_a", [1, 0, 0, 0], session_id="s1"),
+        vector("s1_b", [0, 1, 0, 0], session_id="s1"),
+        vector("s2_a", [0, 0, 1, 0], session_id="s2"),
+    ], namespace="n"))
+    asyncio.run(store.delete(["s1_b"], namespace="n"))
+
+    records = asyncio.run(store.list_records(None, 10, namespace="n"))
+    assert [record["id"] for record in records] == ["s1_a", "s2_a"]
+    assert records[1]["values"] == pytest.approx([0, 0, 1, 0])
+    assert records[1]["metadata"] == {"session_id": "s2"}
+
+    assert [r["id"] for r in asyncio.run(store.list_records({"session_id": "s2"}, 10, namespace="n"))] == ["s2_a"]
+    assert [r["id"] for r in asyncio.run(store.list_records(None, 10, namespace="n", prefix="s1_"))] == ["s1_a"]
+    assert len(asyncio.run(store.list_records(None, 1, namespace="n"))) == 1
+    assert asyncio.run(store.list_records(None, 10)) == []
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import memory_compaction
+import memory_service
+from clients import clients
+from config import MEMORY_DECAY_HALF_LIFE_DAYS
+from memory_compaction import cluster_records, compact_user_memories, decayed_importance, is_expired
+from vector_store import LocalVectorStore
+
+NOW = datetime(2025, 1, 1)
+
+def metadata(days_old=0, importance=0.5, **fields):
+    return {"timestamp": (NOW - timedelta(days=days_old)).isoformat(), "importance": importance, **fields}
+
+def record(record_id, values, **fields):
+    return {"id": record_id, "values": values, "metadata": metadata(**fields)}
+
+def test_importance_halves_every_half_life():
+    assert decayed_importance(metadata(importance=0.8), NOW) == pytest.approx(0.8)
+    assert decayed_importance(metadata(MEMORY_DECAY_HALF_LIFE_DAYS, importance=0.8), NOW) == pytest.approx(0.4)
+    assert decayed_importance(metadata(2 * MEMORY_DECAY_HALF_LIFE_DAYS, importance=0.8), NOW) == pytest.approx(0.2)
+    # Memories from before timestamps or importance were recorded
+    assert decayed_importance({"importance": 0.3}, NOW) == 0.3
+    assert decayed_importance({"timestamp": NOW.isoformat()}, NOW) == pytest.approx(0.5)
+
+def test_old_unimportant_memories_expire_and_important_ones_never_do():
+    assert not is_expired(metadata(30), NOW)
+    assert is_expired(metadata(3 * MEMORY_DECAY_HALF_LIFE_DAYS), NOW)
+    assert not is_expired(metadata(10 * MEMORY_DECAY_HALF_LIFE_DAYS, importance=0.9), NOW)
+
+def test_near_duplicates_cluster_and_singletons_are_left_out():
+    records = [
+        record("a", [1, 0, 0, 0]),
+        record("b", [0, 0, 3, 0]),
+        record("c", [10, 1, 0, 0]),
+        record("d", [0, 1, 0, 0]),
+        record("e", [0.1, 0, 1, 0]),
+    ]
+    clusters = cluster_records(records, threshold=0.9)
+    assert [[member["id"] for member in cluster] for cluster in clusters] == [["a", "c"], ["b", "e"]]
+    assert cluster_records(records[:1], threshold=0.9) == []
+
+def test_clusters_are_capped():
+    records = [record(str(n), [1, 0.01 * n, 0, 0]) for n in range(5)]
+    clusters = cluster_records(records, threshold=0.9, max_cluster=2)
+    assert [[member["id"] for member in cluster] for cluster in clusters] == [["0", "1"], ["2", "3"]]
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalVectorStore(directory=str(tmp_path), dimension=4)
+    asyncio.run(store.initialize())
+    yield store
+    store.close()
+
+@pytest.fixture
+def fake_upstreams(monkeypatch):
+    """Merge prompts answered with a fixed summary and embeddings that put every text on one axis"""
+    prompts = []
+
+    async def create(**kwargs):
+        prompts.append(kwargs["messages"][0]["content"])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=" merged summary "))])
+
+    async def embed_texts(texts, hedge=False, background=False):
+        assert background
+        return [[1.0, 0.0, 0.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(clients, "_openai", SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    monkeypatch.setattr(memory_service, "embed_texts", embed_texts)
+    monkeypatch.setattr(memory_compaction, "datetime", SimpleNamespace(utcnow=lambda: NOW, fromisoformat=datetime.fromisoformat))
+    return prompts
+
+def stored(store, namespace):
+    return {r["id"]: r["metadata"] for r in asyncio.run(store.list_records(None, 100, namespace=namespace))}
+
+def test_compaction_merges_duplicates_and_expires_decayed_memories(store, fake_upstreams):
+    asyncio.run(store.upsert([
+        record("s1_a", [1, 0, 0, 0], session_id="s1", user_id="u", conversation="first", topics=["work"], importance=0.6, days_old=10),
+        record("s2_b", [1, 0.1, 0, 0], session_id="s2", user_id="u", conversation="second", topics=["sleep"], days_old=1),
+        record("s1_c", [0, 1, 0, 0], session_id="s1", user_id="u", conversation="decayed", days_old=400),
+        record("s1_d", [0, 0, 1, 0], session_id="s1", user_id="u", conversation="kept", days_old=5),
+    ], namespace="u"))
+
+    result = asyncio.run(compact_user_memories("u", store))
+    assert result == {"memories": 4, "expired": 1, "merged": 2, "created": 1}
+
+    memories = stored(store, "u")
+    merged_id = next(memory_id for memory_id in memories if "_merged_" in memory_id)
+    assert set(memories) == {"s1_d", merged_id}
+    merged = memories[merged_id]
+    assert merged_id.startswith("s2_")
+    assert merged["conversation"] == "merged summary"
+    assert merged["user_id"] == "u"
+    assert merged["topics"] == ["work", "sleep"]
+    assert merged["importance"] == 0.6
+    assert merged["merged_count"] == 2
+    # The newest memory's time, and the originals summarized oldest first
+    assert merged["timestamp"] == (NOW - timedelta(days=1)).isoformat()
+    assert fake_upstreams[0].index("first") < fake_upstreams[0].index("second")
+
+def test_anonymous_compaction_only_touches_its_session(store, fake_upstreams):
+    owner = memory_service.memory_owner(None, "s1")
+    namespace, _ = memory_service.memory_scope(owner)
+    asyncio.run(store.upsert([
+        record("s1_a", [1, 0, 0, 0], session_id="s1", conversation="one"),
+        record("s1_b", [1, 0, 0, 0], session_id="s1", conversation="two"),
+        record("s2_a", [1, 0, 0, 0], session_id="s2", conversation="other"),
+        record("s2_b", [1, 0, 0, 0], session_id="s2", conversation="other again"),
+    ], namespace=namespace))
+
+    result = asyncio.run(compact_user_memories(owner, store))
+    assert result["merged"] == 2
+    memories = stored(store, namespace)
+    assert {"s2_a", "s2_b"} <= set(memories)
+    assert len(memories) == 3
+    assert all("user_id" not in memory for memory in memories.values())
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import message_store
+from message_store import (
+    build_buckets, get_recent_messages, iter_session_messages, pack_message, store_turn, store_user_message
+)
+
+START = datetime(2024, 1, 1)
+
+@pytest.fixture
+def buckets(monkeypatch, db):
+    """Bucketed layout with four messages per bucket"""
+    monkeypatch.setattr(message_store, "MESSAGE_STORAGE", "buckets")
+    monkeypatch.setattr(message_store, "MESSAGE_BUCKET_SIZE", 4)
+    return db
+
+def message(n, session_id="s", role=None):
+    return {
+        "id": f"m{n:02d}",
+        "session_id": session_id,
+        "role": role or ("user" if n % 2 == 0 else "assistant"),
+        "content": f"message {n}",
+        "timestamp": START + timedelta(minutes=n)
+    }
+
+def store_turns(count, session_id="s"):
+    for n in range(0, 2 * count, 2):
+        asyncio.run(store_turn(message(n, session_id), message(n + 1, session_id)))
+
+def ids(messages):
+    return [m["id"] for m in messages]
+
+def session_messages(session_id="s", after=None, limit=None):
+    async def collect():
+        return [m async for m in iter_session_messages(session_id, after, limit)]
+    return asyncio.run(collect())
+
+def test_documents_layout_stores_both_sides_and_reads_recent_in_order(db):
+    for n in range(0, 6, 2):
+        asyncio.run(store_user_message(message(n)))
+        asyncio.run(store_turn(message(n), message(n + 1)))
+    asyncio.run(store_user_message(message(6)))
+    asyncio.run(store_turn(message(6), None))
+
+    assert asyncio.run(db.therapy_messages.count_documents({})) == 7
+    assert ids(asyncio.run(get_recent_messages("s", 3))) == ["m04", "m05", "m06"]
+
+def test_turns_fill_buckets_and_roll_over(buckets):
+    store_turns(5)
+    documents = asyncio.run(buckets.therapy_message_buckets.find().sort("start", 1).to_list(None))
+    assert [document["count"] for document in documents] == [4, 4, 2]
+    assert documents[0]["start"] == message(0)["timestamp"]
+    assert documents[0]["end"] == message(3)["timestamp"]
+    assert "session_id" not in documents[0]["messages"][0]
+
+    recent = asyncio.run(get_recent_messages("s", 6))
+    assert ids(recent) == ["m04", "m05", "m06", "m07", "m08", "m09"]
+    assert recent[0]["session_id"] == "s"
+
+def test_unanswered_turn_is_stored_without_a_reply(buckets):
+    store_turns(1)
+    asyncio.run(store_turn(message(2), None))
+    assert ids(asyncio.run(get_recent_messages("s", 10))) == ["m00", "m01", "m02"]
+
+def test_turn_goes_to_the_latest_written_open_bucket(buckets):
+    # Two open buckets, e.g. a migrated partial bucket next to a live one
+    asyncio.run(buckets.therapy_message_buckets.insert_many([
+        build_buckets("s", [message(0), message(1)])[0],
+        build_buckets("s", [message(2), message(3)])[0],
+    ]))
+    asyncio.run(store_turn(message(4), message(5)))
+
+    documents = asyncio.run(buckets.therapy_message_buckets.find().sort("start", 1).to_list(None))
+    assert [ids(document["messages"]) for document in documents] == [["m00", "m01"], ["m02", "m03", "m04", "m05"]]
+    assert ids(asyncio.run(get_recent_messages("s", 3))) == ["m03", "m04", "m05"]
+
+def test_recent_window_is_read_by_last_message(buckets):
+    # An older bucket that took the latest turn still holds the newest messages
+    asyncio.run(buckets.therapy_message_buckets.insert_many(
+        build_buckets("s", [message(0), message(1)]) + build_buckets("s", [message(n) for n in range(2, 10)])
+    ))
+    asyncio.run(store_turn(message(10), message(11)))
+    assert ids(asyncio.run(get_recent_messages("s", 2))) == ["m10", "m11"]
+
+def test_reads_merge_sessions_still_stored_as_documents(buckets):
+    asyncio.run(buckets.therapy_messages.insert_many([message(0), message(1)]))
+    asyncio.run(store_turn(message(2), message(3)))
+    assert ids(asyncio.run(get_recent_messages("s", 10))) == ["m00", "m01", "m02", "m03"]
+    assert ids(session_messages()) == ["m00", "m01", "m02", "m03"]
+
+def test_session_messages_page_after_a_position_across_buckets(buckets):
+    store_turns(5)
+    store_turns(1, session_id="other")
+    assert ids(session_messages()) == [f"m{n:02d}" for n in range(10)]
+
+    after = (message(3)["timestamp"], "m03")
+    assert ids(session_messages(after=after, limit=3)) == ["m04", "m05", "m06"]
+    assert ids(session_messages(after=(message(9)["timestamp"], "m09"))) == []
+
+def test_build_buckets_chunks_with_deterministic_ids(buckets):
+    messages = [message(n) for n in range(6)]
+    built = build_buckets("s", messages)
+    assert [bucket["_id"] for bucket in built] == ["s:m00", "s:m04"]
+    assert [bucket["count"] for bucket in built] == [4, 2]
+    assert built[1]["messages"] == [pack_message(messages[4]), pack_message(messages[5])]
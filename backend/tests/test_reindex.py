@@ -0,0 +1,142 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import memory_service
+import reindex
+from vector_store import VectorStore
+
+START = datetime(2024, 1, 1)
+
+def message(session_id, n, role):
+    return {
+        "id": f"{session_id}-{n:02d}",
+        "session_id": session_id,
+        "role": role,
+        "content": f"{role} {n}",
+        "timestamp": START + timedelta(minutes=n)
+    }
+
+def transcript(session_id, turns):
+    return [message(session_id, n, "user" if n % 2 == 0 else "assistant") for n in range(2 * turns)]
+
+def batches(after=None, batch_size=2):
+    async def collect():
+        return [item async for item in reindex._exchange_batches(after, None, batch_size)]
+    return asyncio.run(collect())
+
+class RecordingStore(VectorStore):
+    def __init__(self):
+        self.upserts = []
+
+    async def upsert(self, vectors, namespace=""):
+        self.upserts.append((namespace, vectors))
+
+def test_exchanges_pair_a_user_message_with_the_reply_that_follows(db):
+    messages = transcript("a", 3) + transcript("b", 1)
+    # A reply without its user message, and a user message left unanswered
+    messages += [message("c", 1, "assistant"), message("d", 0, "user")]
+    asyncio.run(db.therapy_messages.insert_many(messages))
+
+    result = batches()
+    assert [[exchange["message_id"] for exchange in batch] for batch, _ in result] == [["a-01", "a-03"], ["a-05", "b-01"]]
+    assert result[0][0][0]["user_message"] == "user 0"
+    assert result[0][0][0]["ai_response"] == "assistant 1"
+    assert [checkpoint["id"] for _, checkpoint in result] == ["a-03", "b-01"]
+
+def test_exchanges_resume_after_a_checkpoint(db):
+    asyncio.run(db.therapy_messages.insert_many(transcript("a", 3) + transcript("b", 1)))
+    _, checkpoint = batches()[0]
+    assert [[exchange["message_id"] for exchange in batch] for batch, _ in batches(after=checkpoint)] == [["a-05", "b-01"]]
+
+@pytest.fixture
+def job(db, monkeypatch):
+    """A job over five batches of two exchanges each, with pending counts recorded in a list"""
+    asyncio.run(db.therapy_messages.insert_many(transcript("a", 6) + transcript("b", 4)))
+    monkeypatch.setattr(reindex, "REINDEX_BATCH_SIZE", 2)
+    recorded = []
+
+    async def record_memory_counts(counts):
+        recorded.append(counts)
+
+    monkeypatch.setattr(memory_service, "record_memory_counts", record_memory_counts)
+    job = asyncio.run(reindex.create_reindex_job("test-target", use_llm=False))
+    return SimpleNamespace(document=job, recorded=recorded)
+
+def test_checkpoints_follow_batch_order_when_batches_finish_out_of_order(job, monkeypatch):
+    checkpoints = []
+    update_job = reindex._update_job
+
+    async def track_updates(job_id, **fields):
+        if "cursor" in fields:
+            checkpoints.append((fields["cursor"]["id"], fields["exchanges"]))
+        return await update_job(job_id, **fields)
+
+    # Seconds each batch (by its first exchange) takes; the second is the slowest
+    delays = {"a-01": 0.02, "a-05": 0.1, "a-09": 0.06, "b-01": 0.04, "b-05": 0.02}
+    finished = []
+
+    async def store_batch(exchanges, store, use_llm, count_before, count_from):
+        await asyncio.sleep(delays[exchanges[0]["message_id"]])
+        finished.append(exchanges[0]["message_id"])
+        return len(exchanges), Counter({exchanges[0]["session_id"]: len(exchanges)})
+
+    monkeypatch.setattr(reindex, "_update_job", track_updates)
+    monkeypatch.setattr(reindex, "_store_batch_with_retries", store_batch)
+    result = asyncio.run(reindex._run_phase(job.document, RecordingStore(), None, concurrency=5))
+
+    assert finished[2:] == ["b-01", "a-09", "a-05"]
+    # Batches stored after the slow one wait for it before the checkpoint moves past them
+    assert checkpoints == [("a-03", 2), ("b-07", 10)]
+    assert result["cursor"]["id"] == "b-07"
+    assert result["exchanges"] == result["stored"] == 10
+    assert sum(job.recorded, Counter()) == Counter({"a": 6, "b": 4})
+
+def test_failed_batch_holds_the_checkpoint_before_it(job, monkeypatch):
+    async def store_batch(exchanges, store, use_llm, count_before, count_from):
+        if exchanges[0]["message_id"] == "a-09":
+            raise RuntimeError("embedding failed")
+        await asyncio.sleep(0.01)
+        return len(exchanges), Counter({exchanges[0]["session_id"]: len(exchanges)})
+
+    monkeypatch.setattr(reindex, "_store_batch_with_retries", store_batch)
+    with pytest.raises(RuntimeError):
+        asyncio.run(reindex._run_phase(job.document, RecordingStore(), None, concurrency=4))
+
+    saved = asyncio.run(reindex.get_reindex_job(job.document["_id"]))
+    assert saved["cursor"]["id"] == "a-07"
+    assert saved["exchanges"] == 4
+    # Batches after the failed one were not counted, so a resume counts them once
+    assert sum(job.recorded, Counter()) == Counter({"a": 4})
+
+def test_store_batch_embeds_in_chunks_and_counts_its_window(db, monkeypatch):
+    exchanges = [
+        {"message_id": f"m{n}", "session_id": "s", "user_message": f"user {n}", "ai_response": f"reply {n}",
+         "timestamp": START + timedelta(minutes=n)}
+        for n in range(5)
+    ]
+    requests = []
+
+    async def create_embeddings(batch, background=False):
+        requests.append((len(batch), background))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0, 0.0]) for _ in batch])
+
+    async def evaluate_conversations(chunk, use_llm=True, record=True):
+        return [{"store": True, "tier": "local", "local_score": 1.0} for _ in chunk]
+
+    monkeypatch.setattr(reindex, "EMBEDDING_BATCH_SIZE", 2)
+    monkeypatch.setattr(memory_service, "create_embeddings", create_embeddings)
+    monkeypatch.setattr(reindex, "evaluate_conversations", evaluate_conversations)
+    store = RecordingStore()
+
+    stored, counted = asyncio.run(reindex._store_batch(
+        exchanges, store, False, count_before=START + timedelta(minutes=3), count_from=START + timedelta(minutes=1)
+    ))
+    assert stored == 5
+    assert requests == [(2, True), (2, True), (1, True)]
+    assert [vector["id"] for _, vectors in store.upserts for vector in vectors] == [f"s_m{n}" for n in range(5)]
+    # Anonymous session: counted for its own owner, only inside [count_from, count_before)
+    assert counted == Counter({memory_service.memory_owner(None, "s"): 2})
@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIStatusError
+
+import resilience
+from admission import OverloadedError
+from resilience import CircuitBreaker, CircuitOpenError
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+def status_error(status_code):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return APIStatusError("upstream error", response=httpx.Response(status_code, request=request), body=None)
+
+def call(breaker, error=None):
+    """Run one call through the breaker, raising error from inside it"""
+    async def run():
+        async with breaker.guard():
+            if error is not None:
+                raise error
+    asyncio.run(run())
+
+def fail(breaker, error=None):
+    with pytest.raises(type(error) if error is not None else RuntimeError):
+        call(breaker, error or RuntimeError("upstream down"))
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    fail(breaker)
+    fail(breaker)
+    assert breaker.state == "closed"
+    fail(breaker)
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError) as exc_info:
+        call(breaker)
+    assert exc_info.value.retry_after == 30
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    fail(breaker)
+    call(breaker)
+    fail(breaker)
+    assert breaker.state == "closed"
+
+def test_half_open_after_reset_timeout_and_closed_by_a_successful_trial(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    fail(breaker)
+    clock.value += 29
+    assert breaker.state == "open"
+    clock.value += 1
+    assert breaker.state == "half_open"
+
+    call(breaker)
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+def test_failed_trial_reopens_the_circuit(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    fail(breaker)
+    clock.value += 30
+    fail(breaker)
+    assert breaker.state == "open"
+    clock.value += 29
+    assert breaker.state == "open"
+
+def test_half_open_lets_a_single_trial_through(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    fail(breaker)
+    clock.value += 30
+
+    async def run():
+        trial_started = asyncio.Event()
+        finish_trial = asyncio.Event()
+
+        async def trial():
+            async with breaker.guard():
+                trial_started.set()
+                await finish_trial.wait()
+
+        task = asyncio.create_task(trial())
+        await trial_started.wait()
+        with pytest.raises(CircuitOpenError):
+            async with breaker.guard():
+                pass
+        finish_trial.set()
+        await task
+
+    asyncio.run(run())
+    assert breaker.state == "closed"
+
+@pytest.mark.parametrize("error", [
+    OverloadedError("shed"),
+    CircuitOpenError("another circuit is open"),
+    status_error(400),
+    status_error(429),
+])
+def test_shedding_and_client_errors_are_not_failures(clock, error):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    fail(breaker, error)
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+def test_server_errors_are_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    fail(breaker, status_error(503))
+    assert breaker.state == "open"
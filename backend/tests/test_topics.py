@@ -0,0 +1,73 @@
+import pytest
+
+from topics import TopicExtractor, normalize_topics, stem
+
+VOCABULARY = {
+    "work": ["job", "boss", "laid off", "office"],
+    "anxiety": ["anxious", "panic", "panic attack", "worry"],
+    "family": ["mom", "dad", "parent"],
+    "parenting": ["kids", "toddler"],
+    "sleep": ["insomnia", "can't sleep"],
+    "grief": ["lost my dad", "funeral"],
+}
+
+@pytest.fixture
+def extractor():
+    return TopicExtractor(VOCABULARY)
+
+@pytest.mark.parametrize("word, base", [
+    ("working", "work"), ("worked", "work"), ("works", "work"),
+    ("anxieties", "anxiety"), ("worried", "worry"),
+    ("panicking", "panic"), ("panicked", "panic"),
+    ("stopping", "stop"), ("stressed", "stress"),
+])
+def test_inflections_stem_like_their_base_word(word, base):
+    assert stem(word) == stem(base)
+
+def test_topic_names_and_phrases_match(extractor):
+    assert extractor.extract("My boss yelled at me") == ["work"]
+    assert extractor.extract("Feeling anxious about everything") == ["anxiety"]
+    assert extractor.extract("I can't sleep at night") == ["sleep"]
+
+def test_multi_word_phrases_match_only_as_a_whole(extractor):
+    assert extractor.extract("I got laid off today") == ["work"]
+    assert extractor.extract("I got laid on the couch and dozed off") == []
+
+def test_phrase_ending_inside_a_longer_one_is_found_through_failure_links(extractor):
+    # "lost my dad" is a grief phrase and its suffix "dad" is a family one
+    assert extractor.extract("I lost my dad last year") == ["grief", "family"]
+    # A partial "lost my" falls back and still finds "mom"
+    assert extractor.extract("I lost my mom") == ["family"]
+
+def test_topics_come_in_order_of_first_mention_without_duplicates(extractor):
+    text = "Insomnia again, then my mom called about my job, then more insomnia"
+    assert extractor.extract(text) == ["sleep", "family", "work"]
+
+def test_limit_caps_the_topics_returned(extractor):
+    text = "Insomnia again, then my mom called about my job"
+    assert extractor.extract(text, limit=2) == ["sleep", "family"]
+    assert extractor.extract(text, limit=0) == ["sleep", "family", "work"]
+
+def test_inflected_forms_match(extractor):
+    assert extractor.extract("I've been working late") == ["work"]
+    assert extractor.extract("So many anxieties lately") == ["anxiety"]
+    assert extractor.extract("I keep panicking at night") == ["anxiety"]
+    assert extractor.extract("I had panic attacks") == ["anxiety"]
+
+def test_topic_name_gives_way_to_a_phrase_that_stems_the_same(extractor):
+    # "parenting" stems like "parent", a family phrase, so it is not a parenting keyword
+    assert extractor.extract("Parenting is hard") == ["family"]
+    assert extractor.extract("The kids are asleep") == ["parenting"]
+
+def test_only_whole_words_match(extractor):
+    assert extractor.extract("The jobless rate and my dadaist art") == []
+    assert extractor.extract("Grandmom's sofa") == []
+
+@pytest.mark.parametrize("value, topics", [
+    (None, []),
+    ("", []),
+    ("work, family ,", ["work", "family"]),
+    (["work", " ", "sleep"], ["work", "sleep"]),
+])
+def test_normalize_topics(value, topics):
+    assert normalize_topics(value) == topics
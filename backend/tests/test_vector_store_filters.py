@@ -0,0 +1,48 @@
+import pytest
+
+from vector_store import _value_matches, metadata_matches
+
+def test_plain_value_means_equality():
+    assert _value_matches("s1", "s1")
+    assert not _value_matches("s2", "s1")
+
+def test_list_fields_match_if_any_element_does():
+    topics = ["work", "anxiety"]
+    assert _value_matches(topics, {"$eq": "work"})
+    assert _value_matches(topics, {"$in": ["sleep", "anxiety"]})
+    assert not _value_matches(topics, {"$in": ["sleep"]})
+    assert not _value_matches(topics, {"$ne": "work"})
+    assert _value_matches(topics, {"$nin": ["sleep", "grief"]})
+    assert not _value_matches(topics, {"$nin": ["work"]})
+
+def test_range_operators():
+    assert _value_matches(0.5, {"$gt": 0.2, "$lte": 0.5})
+    assert not _value_matches(0.5, {"$gt": 0.2, "$lt": 0.5})
+    assert _value_matches("2024-05-01", {"$gte": "2024-01-01"})
+
+def test_range_operators_never_match_missing_or_list_values():
+    assert not _value_matches(None, {"$gt": 0})
+    assert not _value_matches([1, 2], {"$gt": 0})
+
+def test_missing_field_only_matches_negations():
+    assert not _value_matches(None, "s1")
+    assert _value_matches(None, {"$ne": "s1"})
+    assert _value_matches(None, {"$nin": ["s1"]})
+
+def test_unsupported_operator_raises():
+    with pytest.raises(ValueError):
+        _value_matches("x", {"$regex": "x"})
+
+def test_metadata_matches_every_top_level_condition():
+    metadata = {"session_id": "s1", "topics": ["work"], "importance": 0.8}
+    assert metadata_matches(metadata, None)
+    assert metadata_matches(metadata, {})
+    assert metadata_matches(metadata, {"session_id": "s1", "topics": {"$in": ["work"]}})
+    assert not metadata_matches(metadata, {"session_id": "s1", "topics": {"$in": ["sleep"]}})
+
+def test_metadata_matches_and_or():
+    metadata = {"session_id": "s1", "topics": ["work"], "importance": 0.8}
+    assert metadata_matches(metadata, {"$or": [{"session_id": "s2"}, {"importance": {"$gte": 0.5}}]})
+    assert not metadata_matches(metadata, {"$or": [{"session_id": "s2"}, {"importance": {"$lt": 0.5}}]})
+    assert metadata_matches(metadata, {"$and": [{"session_id": "s1"}, {"topics": "work"}]})
+    assert not metadata_matches(metadata, {"$and": [{"session_id": "s1"}, {"topics": "sleep"}]})
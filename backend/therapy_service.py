@@ -1,138 +1,360 @@
 import asyncio
-import uuid
-from typing import List, Dict
-from openai import AsyncOpenAI
-from motor.motor_asyncio import AsyncIOMotorClient
+import base64
+import json
+import logging
+import time
+from datetime import datetime
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 
-from config import MONGO_URL, DB_NAME, OPENAI_API_KEY, CHAT_MODEL, MAX_TOKENS, TEMPERATURE, MAX_CONVERSATION_HISTORY
-from models import TherapyMessage, TherapySession, ChatRequest, ChatResponse, MemoryResponse
-from prompts import get_therapy_system_prompt
-from memory_service import get_relevant_memories, is_conversation_worth_storing, store_conversation_memory
+from openai import RateLimitError
 
-# Initialize clients
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-mongo_client = AsyncIOMotorClient(MONGO_URL)
-db = mongo_client[DB_NAME]
+from admission import OverloadedError, openai_chat_limiter, remaining_time
+from config import (
+    CHAT_MODEL, MAX_TOKENS, TEMPERATURE, MAX_CONVERSATION_HISTORY, HISTORY_PAGE_SIZE, MEMORY_RETRIEVAL_TIMEOUT
+)
+from clients import clients
+from history_cache import session_history_cache
+from message_store import get_recent_messages, iter_session_messages, store_user_message, store_turn
+from metrics import span, observe_stage
+from models import TherapyMessage, ChatRequest, ChatResponse, MemoryResponse
+from context_builder import build_chat_messages
+from memory_service import get_relevant_memories
+from summary_service import get_session_summary, note_messages_left_window
+from memory_ingestion import enqueue_conversation_memory
+from resilience import openai_chat_breaker, record_degradation, turn_degradations_var
+from session_owners import SessionOwnershipError, create_session, resolve_session_user
+
+logger = logging.getLogger(__name__)
+
+# Memory retrievals that overran the turn's budget, left to finish in the background
+_late_retrievals = set()
+
+async def _store_and_get_recent_messages(user_message: Dict) -> List[Dict]:
+    """Store the user message and return the recent conversation window in chronological order
+    
+    With bucketed message storage the user message is only written with the reply.
+    """
+    await store_user_message(user_message)
+    
+    # Serve steady-state turns from the hot window cache
+    session_id = user_message["session_id"]
+    cached_messages = session_history_cache.get(session_id)
+    if cached_messages is not None:
+        session_history_cache.append(session_id, user_message)
+        return (cached_messages + [user_message])[-MAX_CONVERSATION_HISTORY:]
+    
+    with span("mongo_history_find"):
+        recent_messages = await get_recent_messages(session_id, MAX_CONVERSATION_HISTORY)
+    
+    # The bucketed layout has not written the user message yet
+    if not recent_messages or recent_messages[-1]["id"] != user_message["id"]:
+        recent_messages = (recent_messages + [user_message])[-MAX_CONVERSATION_HISTORY:]
+    session_history_cache.set(session_id, recent_messages)
+    return recent_messages
+
+async def _store_assistant_message(user_message: Dict, ai_message: TherapyMessage):
+    """Store the AI response (with the user message in the bucketed layout) and append it to the cached window"""
+    message = ai_message.dict()
+    await store_turn(user_message, message)
+    session_history_cache.append(ai_message.session_id, message)
+
+async def _store_unanswered_message(user_message: Dict):
+    """Keep a user message whose reply failed in the transcript, as the cached window already has it"""
+    try:
+        await store_turn(user_message, None)
+    except Exception as e:
+        logger.error(f"Error storing unanswered message: {e}")
+
+async def get_memories_within_budget(query: str, session_id: str, user_id: str) -> List[str]:
+    """Relevant memories, or none if they are not ready within MEMORY_RETRIEVAL_TIMEOUT
+    
+    A late retrieval keeps running so its result still warms the retrieval cache
+    and its outcome still counts towards the upstream circuit breakers.
+    """
+    timeout = MEMORY_RETRIEVAL_TIMEOUT
+    remaining = remaining_time()
+    if remaining is not None:
+        timeout = max(min(timeout, remaining), 0)
+    
+    task = asyncio.create_task(get_relevant_memories(query, session_id, user_id=user_id))
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if task in done:
+        return task.result()
+    
+    _late_retrievals.add(task)
+    task.add_done_callback(_late_retrievals.discard)
+    record_degradation("memory_timeout")
+    return []
+
+async def _prepare_chat_messages(request: ChatRequest) -> Tuple[str, str, Dict, List[Dict], List[str]]:
+    """Store the user message and build the prompt messages for the AI
+    
+    Also returns the session's user, the stored user message and the degradations applied to the turn so far.
+    """
+    degradations = []
+    turn_degradations_var.set(degradations)
+    
+    # Create or get session and its user; a brand new session starts with an empty cached window
+    session_id = request.session_id
+    if not session_id:
+        session = await create_session(request.user_id)
+        session_id, user_id = session.id, session.user_id
+        session_history_cache.set(session_id, [])
+    else:
+        user_id = await resolve_session_user(session_id, request.user_id)
+    
+    # Store user message
+    user_message = TherapyMessage(
+        session_id=session_id,
+        role="user",
+        content=request.message
+    ).dict()
+    
+    # Fetch history (after storing the user message), memories and the rolling summary concurrently
+    recent_messages, relevant_memories, summary = await asyncio.gather(
+        _store_and_get_recent_messages(user_message),
+        get_memories_within_budget(request.message, session_id, user_id),
+        get_session_summary(session_id)
+    )
+    
+    # Once turns start leaving the window, fold them into the rolling summary; a full-window
+    # turn pushes two older messages out for its user message and reply
+    if len(recent_messages) >= MAX_CONVERSATION_HISTORY:
+        note_messages_left_window(session_id, 2)
+    
+    # Pack system prompt, summary, memories and history into the token budget
+    with span("context_build"):
+        messages = build_chat_messages(recent_messages, relevant_memories, summary)
+    
+    return session_id, user_id, user_message, messages, degradations
+
+def _upstream_rate_limited(e: RateLimitError) -> OverloadedError:
+    """Surface an OpenAI rate limit as a 429 carrying the upstream's Retry-After"""
+    try:
+        retry_after = float(e.response.headers.get("retry-after", 1))
+    except (AttributeError, ValueError):
+        retry_after = 1
+    return OverloadedError("AI service is rate limited, please retry shortly", retry_after, status_code=429)
+
+def _upstream_timed_out() -> OverloadedError:
+    return OverloadedError("AI service did not respond within the latency budget, please retry shortly")
 
 async def process_therapy_chat(request: ChatRequest) -> ChatResponse:
     """Process therapy chat request and return AI response"""
     try:
-        # Create or get session
-        session_id = request.session_id or str(uuid.uuid4())
+        session_id, user_id, user_message, messages, degradations = await _prepare_chat_messages(request)
+        
+        # Get AI response within what is left of the turn's latency budget
+        try:
+            ai_response = await _create_completion(messages)
+        except BaseException:
+            await _store_unanswered_message(user_message)
+            raise
         
-        # Store user message
-        user_message = TherapyMessage(
+        # Store AI response
+        ai_message = TherapyMessage(
             session_id=session_id,
-            role="user",
-            content=request.message
+            role="assistant",
+            content=ai_response
         )
-        await db.therapy_messages.insert_one(user_message.dict())
-        
-        # Get conversation history
-        recent_messages = await db.therapy_messages.find(
-            {"session_id": session_id}
-        ).sort("timestamp", -1).limit(MAX_CONVERSATION_HISTORY).to_list(MAX_CONVERSATION_HISTORY)
-        
-        recent_messages.reverse()
-        
-        # Build conversation context
-        conversation_history = []
-        for msg in recent_messages:
-            conversation_history.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        await _store_assistant_message(user_message, ai_message)
         
-        # Get relevant memories
-        relevant_memories = await get_relevant_memories(request.message, session_id)
-        memory_context = ""
-        if relevant_memories:
-            memory_context = "\n\nRelevant context from previous conversations:\n" + "\n".join([f"- {memory}" for memory in relevant_memories])
-            memory_context += "\n\nPlease reference these previous conversations when relevant to provide continuity and deeper understanding."
+        # Queue conversation for background evaluation and storage in long-term memory
+        await enqueue_conversation_memory(session_id, request.message, ai_response, user_id=user_id)
         
-        # Create system prompt
-        system_prompt = get_therapy_system_prompt(memory_context)
+        return ChatResponse(
+            response=ai_response,
+            session_id=session_id,
+            message_id=ai_message.id,
+            degradations=degradations
+        )
         
-        # Prepare messages for AI
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(conversation_history)
+    except OverloadedError as e:
+        logger.warning(f"Therapy chat shed: {e}")
+        raise e
+    except SessionOwnershipError as e:
+        logger.warning(f"Therapy chat rejected: {e}")
+        raise e
+    except Exception as e:
+        logger.error(f"Error in therapy chat: {e}")
+        raise e
+
+async def _create_completion(messages: List[Dict]) -> str:
+    """The AI response, which has to arrive within what is left of the turn's latency budget"""
+    try:
+        async with openai_chat_breaker.guard(), openai_chat_limiter.slot():
+            with span("chat_completion"):
+                completion = await asyncio.wait_for(
+                    clients.openai.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=messages,
+                        max_tokens=MAX_TOKENS,
+                        temperature=TEMPERATURE
+                    ),
+                    timeout=remaining_time()
+                )
+    except RateLimitError as e:
+        raise _upstream_rate_limited(e) from e
+    except asyncio.TimeoutError as e:
+        raise _upstream_timed_out() from e
+    return completion.choices[0].message.content
+
+async def stream_completion(messages: List[Dict]) -> AsyncIterator[str]:
+    """Stream the AI response tokens, holding the upstream slot until the stream ends
+    
+    The stream has to start within what is left of the turn's latency budget.
+    """
+    completion_start = time.perf_counter()
+    first_token = True
+    try:
+        async with openai_chat_breaker.guard(), openai_chat_limiter.slot():
+            with span("chat_completion_stream"):
+                stream = await asyncio.wait_for(
+                    clients.openai.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=messages,
+                        max_tokens=MAX_TOKENS,
+                        temperature=TEMPERATURE,
+                        stream=True
+                    ),
+                    timeout=remaining_time()
+                )
+                
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        if first_token:
+                            first_token = False
+                            observe_stage("chat_completion_first_token", time.perf_counter() - completion_start)
+                        yield token
+    except RateLimitError as e:
+        raise _upstream_rate_limited(e) from e
+    except asyncio.TimeoutError as e:
+        raise _upstream_timed_out() from e
+
+def _sse_event(payload: Dict) -> str:
+    """Format a payload as a server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+async def stream_therapy_chat(request: ChatRequest) -> AsyncIterator[str]:
+    """Process therapy chat request and stream the AI response as server-sent events"""
+    try:
+        session_id, user_id, user_message, messages, degradations = await _prepare_chat_messages(request)
+        yield _sse_event({"type": "session", "session_id": session_id})
         
-        # Get AI response
-        completion = await openai_client.chat.completions.create(
-            model=CHAT_MODEL,
-            messages=messages,
-            max_tokens=MAX_TOKENS,
-            temperature=TEMPERATURE
-        )
+        # Stream AI response tokens as they arrive
+        response_parts = []
+        try:
+            async for token in stream_completion(messages):
+                response_parts.append(token)
+                yield _sse_event({"type": "token", "content": token})
+        except BaseException:
+            await _store_unanswered_message(user_message)
+            raise
         
-        ai_response = completion.choices[0].message.content
+        ai_response = "".join(response_parts)
         
-        # Store AI response
+        # Store the assembled AI response
         ai_message = TherapyMessage(
             session_id=session_id,
             role="assistant",
             content=ai_response
         )
-        await db.therapy_messages.insert_one(ai_message.dict())
+        await _store_assistant_message(user_message, ai_message)
         
-        # Store conversation in Pinecone if meaningful
-        if await is_conversation_worth_storing(request.message, ai_response):
-            asyncio.create_task(store_conversation_memory(
-                session_id, 
-                f"User: {request.message}\nTherapist: {ai_response}",
-                user_id=session_id
-            ))
+        # Queue conversation for background evaluation and storage in long-term memory
+        await enqueue_conversation_memory(session_id, request.message, ai_response, user_id=user_id)
         
-        return ChatResponse(
-            response=ai_response,
-            session_id=session_id,
-            message_id=ai_message.id
-        )
+        yield _sse_event({
+            "type": "done", "session_id": session_id, "message_id": ai_message.id, "degradations": degradations
+        })
         
+    except OverloadedError as e:
+        logger.warning(f"Streaming therapy chat shed: {e}")
+        yield _sse_event({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+    except SessionOwnershipError as e:
+        logger.warning(f"Streaming therapy chat rejected: {e}")
+        yield _sse_event({"type": "error", "detail": str(e)})
     except Exception as e:
-        print(f"Error in therapy chat: {e}")
-        raise e
+        logger.error(f"Error in streaming therapy chat: {e}")
+        yield _sse_event({"type": "error", "detail": f"Error processing therapy session: {str(e)}"})
+
+def encode_history_cursor(message: Dict) -> str:
+    """Encode the (timestamp, id) keyset position after a message as an opaque cursor"""
+    position = {"t": message["timestamp"].isoformat(), "id": message["id"]}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode an opaque history cursor; raises ValueError if it is malformed"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position["t"]), position["id"]
+    except Exception:
+        raise ValueError("Invalid history cursor")
 
-async def get_session_history(session_id: str) -> Dict:
-    """Get conversation history for a session"""
+def _history_messages(session_id: str, cursor: Optional[str], limit: Optional[int] = None) -> AsyncIterator[Dict]:
+    """Messages after the cursor in (timestamp, id) order"""
+    after = decode_history_cursor(cursor) if cursor else None
+    return iter_session_messages(session_id, after, limit)
+
+async def get_session_history(session_id: str, limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None) -> Dict:
+    """Get one page of conversation history for a session"""
     try:
-        messages = await db.therapy_messages.find(
-            {"session_id": session_id},
-            {"_id": 0}
-        ).sort("timestamp", 1).to_list(100)
+        # Fetch one extra message to know whether another page follows
+        messages = [message async for message in _history_messages(session_id, cursor, limit + 1)]
+        
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = encode_history_cursor(messages[-1])
         
-        return {"messages": messages}
+        return {"messages": messages, "next_cursor": next_cursor}
     except Exception as e:
-        print(f"Error getting session history: {e}")
+        logger.error(f"Error getting session history: {e}")
         raise e
 
-async def get_session_memories(session_id: str, query: str = "") -> MemoryResponse:
-    """Get memories for debugging purposes"""
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+async def stream_session_history(session_id: str, limit: Optional[int] = None, cursor: Optional[str] = None) -> AsyncIterator[str]:
+    """Stream conversation history as NDJSON straight from the Mongo cursor"""
+    async for message in _history_messages(session_id, cursor, limit):
+        yield json.dumps(message, default=_json_default) + "\n"
+
+async def get_session_memories(session_id: str, query: str = "", user_id: Optional[str] = None) -> MemoryResponse:
+    """Get memories for debugging purposes
+    
+    Like a chat turn, only the session's owner (no user for an anonymous session)
+    may read them; others get SessionOwnershipError.
+    """
     try:
         if not query:
             query = "anxiety stress work therapy"
         
-        memories = await get_relevant_memories(query, session_id, limit=10)
+        user_id = await resolve_session_user(session_id, user_id)
+        memories = await get_relevant_memories(query, session_id, limit=10, user_id=user_id)
         return MemoryResponse(
             session_id=session_id,
             query=query,
             memories=memories,
             count=len(memories)
         )
+    except SessionOwnershipError as e:
+        logger.warning(f"Memory read rejected: {e}")
+        raise e
     except Exception as e:
-        print(f"Error retrieving memories: {e}")
+        logger.error(f"Error retrieving memories: {e}")
         raise e
 
-async def create_therapy_session() -> str:
-    """Create a new therapy session and store it in database"""
+async def create_therapy_session(user_id: Optional[str] = None) -> str:
+    """Create a new therapy session for a user and store it in database"""
     try:
-        session = TherapySession()
-        await db.therapy_sessions.insert_one(session.dict())
+        session = await create_session(user_id)
         return session.id
     except Exception as e:
-        print(f"Error creating session: {e}")
+        logger.error(f"Error creating session: {e}")
         raise e
-
-async def close_db_connection():
-    """Close database connection"""
-    mongo_client.close()
\ No newline at end of file
@@ -0,0 +1,133 @@
+import json
+import logging
+import re
+from collections import deque
+from typing import Any, Dict, List
+
+from config import TOPIC_VOCABULARY_PATH, MEMORY_MAX_TOPICS
+
+logger = logging.getLogger(__name__)
+
+# Words (with inner apostrophes and hyphens), so patterns only ever match whole words
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:['’-][a-z0-9]+)*")
+
+VOWEL_PATTERN = re.compile(r"[aeiouy]")
+
+def tokenize(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower().replace("’", "'"))
+
+def stem(token: str) -> str:
+    """Strip common inflections so "working", "worked" and "works" all become "work"
+
+    Deliberately crude: it only has to map a word and its inflections to the same
+    string, as vocabulary phrases and text go through it alike.
+    """
+    if len(token) <= 3:
+        return token
+    if token.endswith(("ies", "ied")) and len(token) > 4:
+        token = token[:-3] + "y"
+    elif token.endswith("ing") and VOWEL_PATTERN.search(token[:-3]) and len(token) > 5:
+        token = _undouble(token[:-3])
+    elif token.endswith("ed") and VOWEL_PATTERN.search(token[:-2]) and len(token) > 4:
+        token = _undouble(token[:-2])
+    elif token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        token = token[:-1]
+    if token.endswith("e") and len(token) > 3:
+        token = token[:-1]
+    # "panicking" and "panicked" keep the k they gained for the suffix
+    if token.endswith("ck"):
+        token = token[:-1]
+    return token
+
+def _undouble(token: str) -> str:
+    # "stopping" -> "stopp" -> "stop", but "stressed" -> "stress"
+    if len(token) > 3 and token[-1] == token[-2] and token[-1] not in "aeioulsz":
+        return token[:-1]
+    return token
+
+def stemmed_tokens(text: str) -> List[str]:
+    return [stem(token) for token in tokenize(text)]
+
+class TopicExtractor:
+    """Aho-Corasick automaton over word tokens mapping phrases to canonical topics
+
+    The vocabulary maps each topic to the phrases that indicate it, e.g.
+    {"work": ["work", "job", "boss", "laid off"]}. Phrases are matched as whole
+    words in a single pass over the text, however large the vocabulary is. Both
+    sides are stemmed first, so inflected forms ("working", "anxieties") match too.
+    """
+
+    def __init__(self, vocabulary: Dict[str, List[str]]):
+        self.topics = list(vocabulary)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+
+        phrase_topics: Dict[tuple, set] = {}
+        for topic, phrases in vocabulary.items():
+            for phrase in phrases:
+                phrase_topics.setdefault(tuple(stemmed_tokens(phrase)), set()).add(topic)
+
+        for topic, phrases in vocabulary.items():
+            # A topic's own name gives way to another topic's phrase that stems the same ("parenting", "parent")
+            own_name = [] if phrase_topics.get(tuple(stemmed_tokens(topic)), {topic}) - {topic} else [topic]
+            for phrase in own_name + list(phrases):
+                state = 0
+                tokens = stemmed_tokens(phrase)
+                if not tokens:
+                    continue
+                for token in tokens:
+                    if token not in self._goto[state]:
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._output.append([])
+                        self._goto[state][token] = len(self._goto) - 1
+                    state = self._goto[state][token]
+                if topic not in self._output[state]:
+                    self._output[state].append(topic)
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(token, 0)
+                # A phrase ending here also ends every phrase that is a suffix of it
+                self._output[child] = self._output[child] + [
+                    topic for topic in self._output[self._fail[child]] if topic not in self._output[child]
+                ]
+
+    def extract(self, text: str, limit: int = MEMORY_MAX_TOPICS) -> List[str]:
+        """Topics mentioned in the text, in order of first mention"""
+        found = []
+        state = 0
+        for token in stemmed_tokens(text):
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for topic in self._output[state]:
+                if topic not in found:
+                    found.append(topic)
+                    if limit and len(found) >= limit:
+                        return found
+        return found
+
+def load_vocabulary(path: str = TOPIC_VOCABULARY_PATH) -> Dict[str, List[str]]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def normalize_topics(value: Any) -> List[str]:
+    """Topics from memory metadata as a list; memories stored before topics were lists hold a comma-separated string"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [topic.strip() for topic in value if topic and topic.strip()]
+
+# Global topic extractor built from the configured vocabulary
+topic_extractor = TopicExtractor(load_vocabulary())
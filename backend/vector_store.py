@@ -0,0 +1,525 @@
+import asyncio
+import functools
+import json
+import logging
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    PINECONE_API_KEY, PINECONE_INDEX, EMBEDDING_DIMENSION, PINECONE_MAX_WORKERS, PINECONE_LIST_PAGE_SIZE,
+    VECTOR_STORE_BACKEND, LOCAL_VECTOR_STORE_DIR, LOCAL_VECTOR_SEGMENT_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Vector store clients are synchronous; their calls run on this bounded pool so
+# they never block the event loop
+vector_store_executor = ThreadPoolExecutor(max_workers=PINECONE_MAX_WORKERS, thread_name_prefix="vector-store")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking vector store call on the vector store executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(vector_store_executor, functools.partial(func, *args, **kwargs))
+
+@dataclass
+class VectorMatch:
+    id: str
+    score: float
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+class VectorStore:
+    """Interface for the long-term memory vector index"""
+
+    name = "base"
+
+    async def initialize(self):
+        """Connect to (or create) the index"""
+        raise NotImplementedError
+
+    # Every operation works within one namespace, a partition of the index that
+    # queries never look outside of; "" is the default namespace
+
+    async def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None,
+                    namespace: str = "") -> List[VectorMatch]:
+        """Return the top_k most similar vectors in the namespace matching the metadata filter"""
+        raise NotImplementedError
+
+    async def upsert(self, vectors: List[Dict], namespace: str = ""):
+        """Insert or replace vectors given as {"id", "values", "metadata"} dicts"""
+        raise NotImplementedError
+
+    async def delete(self, ids: List[str], namespace: str = ""):
+        """Delete vectors by id"""
+        raise NotImplementedError
+
+    async def list_records(self, filter: Optional[Dict], limit: int, namespace: str = "",
+                           prefix: str = "") -> List[Dict]:
+        """Return up to limit {"id", "values", "metadata"} records in the namespace matching the metadata filter
+
+        A prefix limits the listing to ids starting with it, which Pinecone can
+        list without reading the rest of the namespace.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release resources held by the store"""
+
+class PineconeVectorStore(VectorStore):
+    """Vector store backed by a Pinecone serverless index"""
+
+    name = "pinecone"
+
+    def __init__(self, api_key: str = PINECONE_API_KEY, index_name: str = PINECONE_INDEX):
+        self.api_key = api_key
+        self.index_name = index_name
+        self.index = None
+
+    async def initialize(self):
+        from pinecone import Pinecone
+
+        pc = Pinecone(api_key=self.api_key, pool_threads=PINECONE_MAX_WORKERS)
+        existing_indexes = [index_info["name"] for index_info in await run_blocking(pc.list_indexes)]
+
+        if self.index_name not in existing_indexes:
+            await run_blocking(
+                pc.create_index,
+                name=self.index_name,
+                dimension=EMBEDDING_DIMENSION,
+                metric="cosine",
+                spec={"serverless": {"cloud": "aws", "region": "us-east-1"}}
+            )
+            logger.info(f"Created Pinecone index: {self.index_name}")
+
+        # One connection per worker thread, opened now rather than on the first query
+        self.index = pc.Index(self.index_name, connection_pool_maxsize=PINECONE_MAX_WORKERS)
+        await run_blocking(self.index.describe_index_stats)
+        logger.info(f"Connected to Pinecone index: {self.index_name}")
+
+    async def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None,
+                    namespace: str = "") -> List[VectorMatch]:
+        kwargs = {"vector": vector, "top_k": top_k, "include_metadata": True, "namespace": namespace}
+        if filter:
+            kwargs["filter"] = filter
+        response = await run_blocking(self.index.query, **kwargs)
+        return [VectorMatch(match.id, match.score, match.metadata or {}) for match in response.matches]
+
+    async def upsert(self, vectors: List[Dict], namespace: str = ""):
+        await run_blocking(self.index.upsert, vectors, namespace=namespace)
+
+    async def delete(self, ids: List[str], namespace: str = ""):
+        await run_blocking(self.index.delete, ids=ids, namespace=namespace)
+
+    async def list_records(self, filter: Optional[Dict], limit: int, namespace: str = "",
+                           prefix: str = "") -> List[Dict]:
+        return await run_blocking(self._list_records, filter, limit, namespace, prefix)
+
+    def _list_records(self, filter: Optional[Dict], limit: int, namespace: str, prefix: str) -> List[Dict]:
+        # Pinecone lists ids (in id order) but cannot list by metadata, so pages of ids are
+        # fetched and filtered here. A namespace with more than limit records is only
+        # covered beyond its first ones as those are deleted, e.g. by the migration
+        records = []
+        kwargs = {"namespace": namespace, "limit": PINECONE_LIST_PAGE_SIZE}
+        if prefix:
+            kwargs["prefix"] = prefix
+        for ids in self.index.list(**kwargs):
+            response = self.index.fetch(ids=ids, namespace=namespace)
+            for vector_id in ids:
+                vector = response.vectors.get(vector_id)
+                if vector is None or not metadata_matches(vector.metadata or {}, filter):
+                    continue
+                records.append({"id": vector_id, "values": list(vector.values), "metadata": vector.metadata or {}})
+                if len(records) >= limit:
+                    return records
+        return records
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+def _value_matches(value: Any, condition: Any) -> bool:
+    """Evaluate a Pinecone-style field condition; list-valued fields match if any element does"""
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+
+    values = value if isinstance(value, list) else [value]
+    for op, operand in condition.items():
+        if op == "$eq":
+            ok = operand in values
+        elif op == "$ne":
+            ok = operand not in values
+        elif op == "$in":
+            ok = any(v in operand for v in values)
+        elif op == "$nin":
+            ok = not any(v in operand for v in values)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if value is None or isinstance(value, list):
+                return False
+            ok = {
+                "$gt": lambda: value > operand,
+                "$gte": lambda: value >= operand,
+                "$lt": lambda: value < operand,
+                "$lte": lambda: value <= operand
+            }[op]()
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if not ok:
+            return False
+    return True
+
+def metadata_matches(metadata: Dict, filter: Optional[Dict]) -> bool:
+    """Evaluate a Pinecone-style metadata filter against one metadata dict"""
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(metadata_matches(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(metadata_matches(metadata, sub) for sub in condition):
+                return False
+        elif not _value_matches(metadata.get(key), condition):
+            return False
+    return True
+
+# Joins a namespace and a vector id into a row key; a control character, so it cannot occur in either
+_NAMESPACE_SEPARATOR = "\x1f"
+
+def _row_key(vector_id: str, namespace: str) -> str:
+    return f"{namespace}{_NAMESPACE_SEPARATOR}{vector_id}" if namespace else vector_id
+
+class LocalVectorStore(VectorStore):
+    """NumPy-backed vector store persisted as append-only segments on disk
+
+    Each segment is a raw float32 file of L2-normalized vectors plus a JSONL file
+    with one {"id", "metadata", "namespace"} line per row. The newest segment takes
+    appends until it holds segment_size rows; older segments are memory-mapped
+    read-only. Deletes are appended to a tombstone log, and a re-upserted id
+    supersedes its earlier rows. Each namespace keeps the list of its rows, so a
+    query scores only its own namespace. Filters on session_id and user_id are
+    evaluated vectorized.
+    """
+
+    name = "local"
+
+    # Metadata fields with integer-coded columns for vectorized filtering
+    INDEXED_FIELDS = ("session_id", "user_id")
+
+    def __init__(self, directory: str = LOCAL_VECTOR_STORE_DIR, dimension: int = EMBEDDING_DIMENSION,
+                 segment_size: int = LOCAL_VECTOR_SEGMENT_SIZE):
+        self.directory = Path(directory)
+        self.dimension = dimension
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+
+        self._sealed: List[np.ndarray] = []
+        self._active: Optional[np.ndarray] = None
+        self._active_rows = 0
+        self._active_number = 0
+        self._vector_file = None
+        self._metadata_file = None
+        self._tombstone_file = None
+
+        self._ids: List[str] = []
+        self._metadata: List[Dict] = []
+        self._rows_by_id: Dict[str, int] = {}
+        self._namespace_rows: Dict[str, array] = {}
+        self._alive = array("b")
+        self._codes = {field_name: array("i") for field_name in self.INDEXED_FIELDS}
+        self._code_maps: Dict[str, Dict[str, int]] = {field_name: {} for field_name in self.INDEXED_FIELDS}
+
+    def __len__(self) -> int:
+        return len(self._rows_by_id)
+
+    async def initialize(self):
+        await run_blocking(self._load)
+        logger.info(f"Loaded local vector store from {self.directory} ({len(self)} vectors)")
+
+    # Persistence
+
+    def _segment_paths(self, number: int):
+        return (self.directory / f"seg_{number:06d}.f32", self.directory / f"seg_{number:06d}.jsonl")
+
+    def _load(self):
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            numbers = sorted(int(path.stem.split("_")[1]) for path in self.directory.glob("seg_*.jsonl"))
+            row_bytes = self.dimension * 4
+
+            for number in numbers:
+                vector_path, metadata_path = self._segment_paths(number)
+                with open(metadata_path) as f:
+                    records = [json.loads(line) for line in f if line.endswith("\n")]
+                vector_rows = vector_path.stat().st_size // row_bytes if vector_path.exists() else 0
+
+                # Drop rows from a torn write so vectors and metadata stay aligned
+                rows = min(len(records), vector_rows)
+                self._truncate_segment(number, rows)
+
+                if rows:
+                    matrix = np.memmap(vector_path, dtype=np.float32, mode="r", shape=(rows, self.dimension))
+                else:
+                    matrix = np.zeros((0, self.dimension), dtype=np.float32)
+                for record in records[:rows]:
+                    self._index_row(record["id"], record["metadata"], record.get("namespace", ""))
+
+                if number == numbers[-1] and rows < self.segment_size:
+                    self._active = np.array(matrix)
+                    self._active_rows = rows
+                    self._active_number = number
+                else:
+                    self._sealed.append(matrix)
+                    self._active_number = number + 1
+
+            tombstone_path = self.directory / "tombstones.log"
+            if tombstone_path.exists():
+                with open(tombstone_path) as f:
+                    for line in f:
+                        parts = line.rstrip("\n").split(" ", 1)
+                        if len(parts) == 2:
+                            self._tombstone(parts[1], before_row=int(parts[0]))
+
+            self._tombstone_file = open(tombstone_path, "a")
+            self._open_active_segment()
+
+    def _truncate_segment(self, number: int, rows: int):
+        vector_path, metadata_path = self._segment_paths(number)
+        if vector_path.exists() and vector_path.stat().st_size != rows * self.dimension * 4:
+            with open(vector_path, "r+b") as f:
+                f.truncate(rows * self.dimension * 4)
+        with open(metadata_path) as f:
+            lines = f.readlines()
+        if len(lines) != rows or (lines and not lines[-1].endswith("\n")):
+            with open(metadata_path, "w") as f:
+                f.writelines(lines[:rows])
+
+    def _open_active_segment(self):
+        if self._active is None:
+            self._active = np.zeros((0, self.dimension), dtype=np.float32)
+            self._active_rows = 0
+        vector_path, metadata_path = self._segment_paths(self._active_number)
+        self._vector_file = open(vector_path, "ab")
+        self._metadata_file = open(metadata_path, "a")
+
+    def _seal_active_segment(self):
+        self._vector_file.close()
+        self._metadata_file.close()
+        vector_path, _ = self._segment_paths(self._active_number)
+        self._sealed.append(np.memmap(vector_path, dtype=np.float32, mode="r", shape=(self._active_rows, self.dimension)))
+        self._active = None
+        self._active_number += 1
+        self._open_active_segment()
+
+    # Row bookkeeping
+
+    def _index_row(self, vector_id: str, metadata: Dict, namespace: str):
+        row = len(self._ids)
+        key = _row_key(vector_id, namespace)
+        previous = self._rows_by_id.get(key)
+        if previous is not None:
+            self._alive[previous] = 0
+        self._rows_by_id[key] = row
+        self._namespace_rows.setdefault(namespace, array("q")).append(row)
+        self._ids.append(vector_id)
+        self._metadata.append(metadata)
+        self._alive.append(1)
+        for field_name in self.INDEXED_FIELDS:
+            code_map = self._code_maps[field_name]
+            value = metadata.get(field_name)
+            code = code_map.setdefault(value, len(code_map)) if isinstance(value, str) else -1
+            self._codes[field_name].append(code)
+
+    def _tombstone(self, key: str, before_row: int):
+        row = self._rows_by_id.get(key)
+        if row is not None and row < before_row:
+            self._alive[row] = 0
+            del self._rows_by_id[key]
+
+    def _rows(self, namespace: str) -> np.ndarray:
+        """Rows of a namespace in ascending order, including dead ones"""
+        rows = self._namespace_rows.get(namespace)
+        return np.frombuffer(rows, dtype=np.int64) if rows else np.zeros(0, dtype=np.int64)
+
+    # Operations
+
+    async def upsert(self, vectors: List[Dict], namespace: str = ""):
+        await run_blocking(self._upsert, vectors, namespace)
+
+    def _upsert(self, vectors: List[Dict], namespace: str):
+        with self._lock:
+            for item in vectors:
+                if self._active_rows >= self.segment_size:
+                    self._seal_active_segment()
+
+                values = np.asarray(item["values"], dtype=np.float32)
+                norm = np.linalg.norm(values)
+                if norm > 0:
+                    values = values / norm
+                metadata = item.get("metadata") or {}
+
+                if self._active_rows == len(self._active):
+                    grown = np.zeros((min(self.segment_size, max(16, 2 * len(self._active))), self.dimension), dtype=np.float32)
+                    grown[:self._active_rows] = self._active[:self._active_rows]
+                    self._active = grown
+                self._active[self._active_rows] = values
+                self._active_rows += 1
+
+                self._vector_file.write(values.tobytes())
+                record = {"id": item["id"], "metadata": metadata}
+                if namespace:
+                    record["namespace"] = namespace
+                self._metadata_file.write(json.dumps(record) + "\n")
+                self._index_row(item["id"], metadata, namespace)
+
+            self._vector_file.flush()
+            self._metadata_file.flush()
+
+    async def delete(self, ids: List[str], namespace: str = ""):
+        await run_blocking(self._delete, ids, namespace)
+
+    def _delete(self, ids: List[str], namespace: str):
+        with self._lock:
+            row_count = len(self._ids)
+            for vector_id in ids:
+                key = _row_key(vector_id, namespace)
+                if key in self._rows_by_id:
+                    self._tombstone(key, before_row=row_count)
+                    self._tombstone_file.write(f"{row_count} {key}\n")
+            self._tombstone_file.flush()
+
+    async def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None,
+                    namespace: str = "") -> List[VectorMatch]:
+        return await run_blocking(self._query, vector, top_k, filter, namespace)
+
+    def _filter_mask(self, filter: Optional[Dict], rows: np.ndarray) -> Tuple[np.ndarray, Dict]:
+        """Vectorized mask over rows for alive rows and indexed-field conditions; returns the remaining filter"""
+        mask = np.frombuffer(self._alive, dtype=np.int8)[rows].astype(bool)
+        remaining = {}
+
+        for key, condition in (filter or {}).items():
+            if key not in self.INDEXED_FIELDS:
+                remaining[key] = condition
+                continue
+
+            codes = np.frombuffer(self._codes[key], dtype=np.int32)[rows]
+            code_map = self._code_maps[key]
+            if isinstance(condition, dict) and set(condition) <= {"$eq", "$in"}:
+                wanted = list(condition.get("$in", []))
+                if "$eq" in condition:
+                    wanted.append(condition["$eq"])
+                mask &= np.isin(codes, [code_map[value] for value in wanted if value in code_map])
+            elif not isinstance(condition, dict):
+                mask &= codes == code_map.get(condition, -2)
+            else:
+                remaining[key] = condition
+
+        return mask, remaining
+
+    def _matrices(self) -> Tuple[List[np.ndarray], np.ndarray]:
+        """Segment matrices and the first row of each"""
+        matrices = self._sealed + [self._active[:self._active_rows]]
+        return matrices, np.cumsum([0] + [len(matrix) for matrix in matrices])
+
+    def _scores(self, rows: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        """Similarity of ascending rows to the query, reading only the segments they are in"""
+        scores = np.empty(len(rows), dtype=np.float32)
+        matrices, offsets = self._matrices()
+        for segment, matrix in enumerate(matrices):
+            start, end = np.searchsorted(rows, offsets[segment:segment + 2])
+            if start == end:
+                continue
+            local = rows[start:end] - offsets[segment]
+            # Gathering rows costs a copy each; past half a segment one pass over all of it is cheaper
+            if 2 * len(local) > len(matrix):
+                scores[start:end] = (matrix @ query_vector)[local]
+            else:
+                scores[start:end] = matrix[local] @ query_vector
+        return scores
+
+    def _query(self, vector: List[float], top_k: int, filter: Optional[Dict], namespace: str) -> List[VectorMatch]:
+        with self._lock:
+            rows = self._rows(namespace)
+            if not len(rows) or top_k <= 0:
+                return []
+
+            query_vector = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(query_vector)
+            if norm > 0:
+                query_vector = query_vector / norm
+
+            mask, remaining = self._filter_mask(filter, rows)
+            candidates = rows[mask]
+
+            # Non-indexed conditions are checked per row, only on the vectorized candidates
+            if remaining:
+                candidates = np.array(
+                    [row for row in candidates if metadata_matches(self._metadata[row], remaining)],
+                    dtype=np.int64
+                )
+            if len(candidates) == 0:
+                return []
+
+            candidate_scores = self._scores(candidates, query_vector)
+            k = min(top_k, len(candidates))
+            top = np.argpartition(-candidate_scores, k - 1)[:k]
+            top = top[np.argsort(-candidate_scores[top])]
+
+            return [
+                VectorMatch(self._ids[candidates[i]], float(candidate_scores[i]), self._metadata[candidates[i]])
+                for i in top
+            ]
+
+    async def list_records(self, filter: Optional[Dict], limit: int, namespace: str = "",
+                           prefix: str = "") -> List[Dict]:
+        return await run_blocking(self._list_records, filter, limit, namespace, prefix)
+
+    def _list_records(self, filter: Optional[Dict], limit: int, namespace: str, prefix: str) -> List[Dict]:
+        with self._lock:
+            rows = self._rows(namespace)
+            if not len(rows):
+                return []
+
+            mask, remaining = self._filter_mask(filter, rows)
+            rows = [
+                row for row in rows[mask]
+                if self._ids[row].startswith(prefix) and (not remaining or metadata_matches(self._metadata[row], remaining))
+            ]
+
+            matrices, offsets = self._matrices()
+            records = []
+            for row in rows[:limit]:
+                segment = int(np.searchsorted(offsets, row, side="right")) - 1
+                records.append({
+                    "id": self._ids[row],
+                    "values": matrices[segment][row - offsets[segment]].tolist(),
+                    "metadata": self._metadata[row]
+                })
+            return records
+
+    def close(self):
+        with self._lock:
+            for f in (self._vector_file, self._metadata_file, self._tombstone_file):
+                if f is not None:
+                    f.close()
+
+def create_vector_store(backend: str = VECTOR_STORE_BACKEND, name: Optional[str] = None) -> VectorStore:
+    """Build the configured vector store backend
+
+    A name selects a Pinecone index, or a local store directory next to
+    LOCAL_VECTOR_STORE_DIR, other than the configured default.
+    """
+    if backend == "pinecone":
+        return PineconeVectorStore(index_name=name) if name else PineconeVectorStore()
+    if backend == "local":
+        return LocalVectorStore(directory=str(Path(LOCAL_VECTOR_STORE_DIR).with_name(name))) if name else LocalVectorStore()
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+def shutdown_vector_store_executor():
+    """Release the vector store worker threads"""
+    vector_store_executor.shutdown(wait=True)
@@ -2,10 +2,22 @@ import React, { useState, useEffect, useRef } from "react";
 import "./App.css";
 import { motion } from "framer-motion";
 import { Send } from "lucide-react";
-import axios from "axios";
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || "http://localhost:8000";
 
+// "websocket" keeps one connection open for the whole conversation instead of a request per message
+const USE_WEBSOCKET = process.env.REACT_APP_CHAT_TRANSPORT === "websocket";
+
+// Anonymous user id kept in this browser, so memories carry over between sessions
+const getUserId = () => {
+  let userId = localStorage.getItem("mindbuddy_user_id");
+  if (!userId) {
+    userId = crypto.randomUUID();
+    localStorage.setItem("mindbuddy_user_id", userId);
+  }
+  return userId;
+};
+
 //Message component
 const Message = ({ text, isUser }) => (
   <motion.div 
@@ -32,14 +44,17 @@ function App() {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState("");
   const [sessionId, setSessionId] = useState(null);
+  const [userId] = useState(getUserId);
   const [loading, setLoading] = useState(false);
   
   // Refs
   const messagesEnd = useRef(null);
+  const socketRef = useRef(null);
   
   // Initialize
   useEffect(() => {
     addWelcomeMessage();
+    return () => socketRef.current?.close();
   }, []);
   
   useEffect(() => {
@@ -60,6 +75,74 @@ function App() {
     messagesEnd.current?.scrollIntoView({ behavior: 'smooth' });
   };
   
+  // Stream one reply over a POST request answered with server-sent events
+  const streamOverHttp = async (text, onEvent) => {
+    const response = await fetch(`${API_URL}/api/therapy/chat/stream`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        message: text,
+        session_id: sessionId,
+        user_id: userId
+      })
+    });
+    
+    if (!response.ok || !response.body) {
+      throw new Error(`Request failed with status ${response.status}`);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+      
+      for (const event of events) {
+        if (!event.startsWith("data: ")) continue;
+        onEvent(JSON.parse(event.slice(6)));
+      }
+    }
+  };
+  
+  // Open the chat socket, or reuse the one still open (the server closes idle ones)
+  const openSocket = () => new Promise((resolve, reject) => {
+    const current = socketRef.current;
+    if (current && current.readyState === WebSocket.OPEN) {
+      resolve(current);
+      return;
+    }
+    const params = new URLSearchParams({ user_id: userId });
+    if (sessionId) params.set("session_id", sessionId);
+    const socket = new WebSocket(`${API_URL.replace(/^http/, "ws")}/api/therapy/ws?${params}`);
+    socket.onopen = () => resolve(socket);
+    socket.onerror = () => reject(new Error("WebSocket connection failed"));
+    socketRef.current = socket;
+  });
+  
+  // Stream one reply over the chat socket; the events are the same as over HTTP
+  const streamOverSocket = async (text, onEvent) => {
+    const socket = await openSocket();
+    await new Promise((resolve, reject) => {
+      socket.onmessage = (message) => {
+        try {
+          const data = JSON.parse(message.data);
+          onEvent(data);
+          if (data.type === "done") resolve();
+        } catch (error) {
+          reject(error);
+        }
+      };
+      socket.onclose = () => reject(new Error("WebSocket closed"));
+      socket.send(JSON.stringify({ message: text }));
+    });
+  };
+  
   const sendMessage = async () => {
     if (!input.trim() || loading) return;
     
@@ -73,28 +156,35 @@ function App() {
     setInput("");
     setLoading(true);
     
-    try {
-      const response = await axios.post(`${API_URL}/api/therapy/chat`, {
-        message: input,
-        session_id: sessionId
-      });
-      
-      const aiMessage = {
-        id: Date.now() + 1,
-        text: response.data.response,
-        isUser: false
-      };
-      
-      setMessages(prev => [...prev, aiMessage]);
-      
-      if (!sessionId) {
-        setSessionId(response.data.session_id);
+    const aiMessageId = Date.now() + 1;
+    let started = false;
+    
+    const handleEvent = (data) => {
+      if (data.type === "session" && !sessionId) {
+        setSessionId(data.session_id);
+      } else if (data.type === "token") {
+        // Show the reply as soon as the first token arrives
+        if (!started) {
+          started = true;
+          setLoading(false);
+          setMessages(prev => [...prev, { id: aiMessageId, text: data.content, isUser: false }]);
+        } else {
+          setMessages(prev => prev.map(msg =>
+            msg.id === aiMessageId ? { ...msg, text: msg.text + data.content } : msg
+          ));
+        }
+      } else if (data.type === "error") {
+        throw new Error(data.detail);
       }
-      
+    };
+    
+    try {
+      const stream = USE_WEBSOCKET ? streamOverSocket : streamOverHttp;
+      await stream(input, handleEvent);
     } catch (error) {
       console.error('Error:', error);
       const errorMessage = {
-        id: Date.now() + 1,
+        id: Date.now() + 2,
         text: "Sorry, I'm having trouble connecting. Please try again.",
         isUser: false
       };